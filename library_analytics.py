@@ -0,0 +1,202 @@
+from array import array
+from datetime import date
+
+from library_index import field_ordinal
+
+try:
+    import numpy as np
+except ImportError:  # the same reports, computed with plain Python loops
+    np = None
+
+# Loans as columns: one array per field, one row per loan. Ids and dates are
+# integers (users and books by their position in user_ids/book_ids, dates as
+# day ordinals, 0 for none), so with NumPy every report is a handful of
+# whole-column operations instead of a loop over the records.
+ACTIVE, RETURNED, OTHER, DELETED = 0, 1, 2, 3
+STATUS_CODES = {'Active': ACTIVE, 'Returned': RETURNED}
+NO_DATE = 0
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# (label, first day, last day) of the overdue ranges in the analytics report
+OVERDUE_RANGES = (
+    ('1-7 days', 1, 7),
+    ('8-14 days', 8, 14),
+    ('15-30 days', 15, 30),
+    ('31-90 days', 31, 90),
+    ('91+ days', 91, None)
+)
+
+COLUMNS = ('user', 'book', 'borrowed', 'due', 'returned', 'status')
+
+
+def engine():
+    return 'numpy' if np is not None else 'python'
+
+
+def date_or_none(record, field):
+    try:
+        return field_ordinal(record, field)
+    except (TypeError, ValueError):
+        return NO_DATE
+
+
+class LoanColumns:
+    def __init__(self):
+        self.columns = {name: array('q') for name in COLUMNS}
+        self.rows = {}       # request id -> row
+        self.user_ids = []   # user code -> user id
+        self.book_ids = []   # book code -> book id
+        self.user_codes = {}
+        self.book_codes = {}
+
+    def build(self, requests):
+        for request in requests:
+            self.put(request)
+
+    def code(self, codes, ids, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(ids)
+            ids.append(value)
+        return code
+
+    def put(self, request):
+        # Add a loan, or overwrite its row if we have it already
+        values = (
+            self.code(self.user_codes, self.user_ids, request.get('user_id')),
+            self.code(self.book_codes, self.book_ids, request.get('book_id')),
+            date_or_none(request, 'borrow_date'),
+            date_or_none(request, 'due_date'),
+            date_or_none(request, 'return_date'),
+            STATUS_CODES.get(request.get('status'), OTHER)
+        )
+        request_id = str(request.get('id'))
+        row = self.rows.get(request_id)
+        if row is None:
+            self.rows[request_id] = len(self.columns['status'])
+            for name, value in zip(COLUMNS, values):
+                self.columns[name].append(value)
+        else:
+            for name, value in zip(COLUMNS, values):
+                self.columns[name][row] = value
+
+    def discard(self, request_id):
+        row = self.rows.pop(str(request_id), None)
+        if row is not None:
+            self.columns['status'][row] = DELETED
+
+    def column(self, name):
+        # A NumPy view of the column's buffer, no copy
+        return np.frombuffer(self.columns[name], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def overdue_by_days(self, today):
+        # {days overdue: active loans}, for loans due today or earlier
+        status, due = self.columns['status'], self.columns['due']
+        if np is not None:
+            status, due = self.column('status'), self.column('due')
+            late = (status == ACTIVE) & (due != NO_DATE) & (due <= today)
+            counts = np.bincount(today - due[late])
+            return {int(days): int(count) for days, count in enumerate(counts) if count}
+
+        counts = {}
+        for row in range(len(status)):
+            if status[row] == ACTIVE and due[row] != NO_DATE and due[row] <= today:
+                days = today - due[row]
+                counts[days] = counts.get(days, 0) + 1
+        return dict(sorted(counts.items()))
+
+    def fines_owed(self, today, per_day):
+        # {user id: fine so far} on the loans still out past their due date
+        status, due, users = self.columns['status'], self.columns['due'], self.columns['user']
+        if np is not None:
+            status, due, users = self.column('status'), self.column('due'), self.column('user')
+            late = (status == ACTIVE) & (due != NO_DATE) & (due < today)
+            fines = np.bincount(users[late], weights=(today - due[late]) * per_day,
+                                minlength=len(self.user_ids))
+            owing = np.flatnonzero(fines)
+            return {self.user_ids[code]: float(fines[code]) for code in owing}
+
+        fines = {}
+        for row in range(len(status)):
+            if status[row] == ACTIVE and due[row] != NO_DATE and due[row] < today:
+                user_id = self.user_ids[users[row]]
+                fines[user_id] = fines.get(user_id, 0.0) + (today - due[row]) * per_day
+        return fines
+
+    def loans_by_category_month(self, categories):
+        # {(category, "YYYY-MM"): loans}, by borrow month; `categories` maps
+        # book id -> category
+        names = sorted(set(categories.values()) | {'Unknown'})
+        name_codes = {name: code for code, name in enumerate(names)}
+        book_category = [name_codes[categories.get(book_id, 'Unknown')]
+                         for book_id in self.book_ids]
+        status, borrowed, books = (self.columns['status'], self.columns['borrowed'],
+                                   self.columns['book'])
+        if np is not None:
+            status, borrowed = self.column('status'), self.column('borrowed')
+            keep = (status != DELETED) & (borrowed != NO_DATE)
+            category = np.array(book_category, dtype=np.int64)[self.column('book')[keep]]
+            borrowed = borrowed[keep]
+            if not len(borrowed):
+                return {}
+            # Month of each day in the range, looked up rather than converted per loan
+            low = int(borrowed.min())
+            day_months = ((np.arange(low, int(borrowed.max()) + 1) - EPOCH_ORDINAL)
+                          .astype('datetime64[D]').astype('datetime64[M]').astype(np.int64))
+            first = int(day_months[0])
+            span = int(day_months[-1]) - first + 1
+            counts = np.bincount(category * span + (day_months[borrowed - low] - first),
+                                 minlength=len(names) * span)
+            return {(names[key // span], month_label(first + key % span)): int(counts[key])
+                    for key in np.flatnonzero(counts).tolist()}
+
+        labels = {}   # few distinct days, many loans
+        counts = {}
+        for row in range(len(status)):
+            if status[row] == DELETED or borrowed[row] == NO_DATE:
+                continue
+            label = labels.get(borrowed[row])
+            if label is None:
+                label = labels[borrowed[row]] = date.fromordinal(borrowed[row]).strftime("%Y-%m")
+            key = (names[book_category[books[row]]], label)
+            counts[key] = counts.get(key, 0) + 1
+        return dict(sorted(counts.items()))
+
+    def average_loan_days(self):
+        # Mean days from borrow to return over returned loans, None if there are none
+        status, borrowed, returned = (self.columns['status'], self.columns['borrowed'],
+                                      self.columns['returned'])
+        if np is not None:
+            status, borrowed, returned = (self.column('status'), self.column('borrowed'),
+                                          self.column('returned'))
+            done = (status == RETURNED) & (borrowed != NO_DATE) & (returned != NO_DATE)
+            if not done.any():
+                return None
+            return float((returned[done] - borrowed[done]).mean())
+
+        total = loans = 0
+        for row in range(len(status)):
+            if status[row] == RETURNED and borrowed[row] != NO_DATE and returned[row] != NO_DATE:
+                total += returned[row] - borrowed[row]
+                loans += 1
+        return total / loans if loans else None
+
+
+def month_label(months_since_epoch):
+    year, month = divmod(months_since_epoch, 12)
+    return f"{1970 + year:04d}-{month + 1:02d}"
+
+
+def overdue_ranges(by_days):
+    # Fold {days overdue: loans} into the OVERDUE_RANGES
+    totals = {label: 0 for label, first, last in OVERDUE_RANGES}
+    for days, loans in by_days.items():
+        for label, first, last in OVERDUE_RANGES:
+            if days >= first and (last is None or days <= last):
+                totals[label] += loans
+                break
+    return totals
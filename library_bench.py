@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+from library_service import LibraryService
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+CATEGORIES = ('Fiction', 'Science', 'History', 'Biography', 'Children', 'Poetry',
+              'Travel', 'Cooking', 'Technology', 'Art')
+WORDS = ('river', 'night', 'garden', 'empire', 'shadow', 'silver', 'winter', 'ocean',
+         'secret', 'journey', 'house', 'mountain', 'letter', 'storm', 'island', 'clock',
+         'stone', 'city', 'fire', 'glass', 'forest', 'queen', 'machine', 'memory')
+SURNAMES = ('Smith', 'Okafor', 'Nguyen', 'Garcia', 'Muller', 'Tanaka', 'Rossi', 'Kowalski',
+            'Mensah', 'Silva', 'Haddad', 'Novak', 'Ivanova', 'Kim', 'Dubois', 'Uwimana')
+FIRST_NAMES = ('Alice', 'Jean', 'Amina', 'Lucas', 'Mei', 'Omar', 'Grace', 'Pierre',
+               'Ana', 'David', 'Chloe', 'Eric', 'Fatima', 'Ivan', 'Nadia', 'Paul')
+
+
+def generate_library(books, users, requests, seed=42, today=None):
+    # Deterministic tables in the current JSON schema: `requests` loans spread
+    # over the past two years, the most recent few percent still out
+    rng = random.Random(seed)
+    today = today or date.today()
+
+    book_records = []
+    for book_id in range(1, books + 1):
+        title = ' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(1, 4)))
+        book_records.append({
+            'id': book_id,
+            'title': title,
+            'author': f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}",
+            'isbn': f"978-{rng.randrange(10**9):09d}",
+            'category': rng.choice(CATEGORIES),
+            'year': str(rng.randint(1900, today.year)),
+            'status': 'Available',
+            'date_added': (today - timedelta(days=rng.randint(0, 3650))).isoformat()
+        })
+
+    user_records = []
+    for user_id in range(1, users + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(SURNAMES)
+        user_records.append({
+            'id': user_id,
+            'name': f"{first} {last}",
+            'email': f"{first.lower()}.{last.lower()}{user_id}@example.com",
+            'phone': f"555-{rng.randrange(10000):04d}",
+            'address': f"{rng.randint(1, 999)} {rng.choice(WORDS).capitalize()} St",
+            'date_joined': (today - timedelta(days=rng.randint(0, 3650))).isoformat(),
+            'active_borrowings': 0,
+            'total_borrowings': 0
+        })
+
+    request_records = []
+    active_from = requests - requests // 20
+    for req_id in range(1, requests + 1):
+        book = book_records[rng.randrange(books)]
+        user = user_records[rng.randrange(users)]
+        borrowed = today - timedelta(days=(requests - req_id) * 730 // requests)
+        active = (req_id > active_from and book['status'] == 'Available'
+                  and user['active_borrowings'] < 5)
+        request = {
+            'id': req_id,
+            'user_id': str(user['id']),
+            'book_id': str(book['id']),
+            'borrow_date': borrowed.isoformat(),
+            'due_date': (borrowed + timedelta(days=14)).isoformat(),
+            'status': 'Active' if active else 'Returned',
+            'renewals': 0
+        }
+        if active:
+            book['status'] = 'Borrowed'
+            user['active_borrowings'] += 1
+        else:
+            request['return_date'] = (borrowed + timedelta(days=rng.randint(1, 20))).isoformat()
+        user['total_borrowings'] += 1
+        request_records.append(request)
+
+    return {'books': book_records, 'users': user_records, 'requests': request_records}
+
+
+def write_library(tables, directory):
+    for table, records in tables.items():
+        with open(os.path.join(directory, f"{table}.json"), 'w') as f:
+            json.dump(records, f, indent=2)
+
+
+def timed(results, name, function, runs=1):
+    # Mean seconds per call over `runs` calls; None when there was nothing to run
+    if runs <= 0:
+        results[name] = {'seconds': None, 'runs': 0}
+        return
+    started = time.perf_counter()
+    for _ in range(runs):
+        function()
+    elapsed = time.perf_counter() - started
+    results[name] = {'seconds': elapsed / runs, 'runs': runs}
+
+
+def run_size(size, seed=42, operations=100):
+    # Time each operation against a fresh library of `size` books and loans
+    results = {}
+    directory = tempfile.mkdtemp(prefix=f"library_bench_{size}_")
+    previous = os.getcwd()
+    os.chdir(directory)  # the storage works on files in the current directory
+    try:
+        tables = generate_library(size, max(10, size // 10), size, seed)
+        write_library(tables, directory)
+        rng = random.Random(seed)
+
+        def load():
+            LibraryService().table_data()
+
+        timed(results, 'load_data', load)
+        timed(results, 'load_data_cached', load)
+        service = LibraryService()
+        service.table_data()
+
+        # One small change saved on its own, as every lending operation does,
+        # and the full snapshot rewrite that compaction does
+        user_ids = [user['id'] for user in service.users]
+        user_iter = iter(rng.choice(user_ids) for _ in range(operations))
+        timed(results, 'save_data',
+              lambda: service.update_user(next(user_iter), phone=str(rng.randint(1000, 9999))),
+              operations)
+        timed(results, 'compact_data', service.compact_data)
+
+        queries = [rng.choice(WORDS)[:rng.randint(3, 6)] for _ in range(operations)]
+        timed(results, 'search_index_build', lambda: service.search(queries[0], 10))
+        query_iter = iter(queries)
+        timed(results, 'search_book', lambda: service.search(next(query_iter), 20), operations)
+
+        # Borrow books that are free, for users with room for one more loan
+        available = [book['id'] for book in service.books if book.get('status') == 'Available']
+        free_users = [user['id'] for user in service.users
+                      if user.get('active_borrowings', 0) == 0]
+        count = min(len(available), len(free_users), operations)
+        loans = list(zip(free_users[:count], rng.sample(available, count)))
+        loan_iter = iter(loans)
+        request_ids = []
+        timed(results, 'borrow_book',
+              lambda: request_ids.append(service.borrow(*next(loan_iter))['id']), len(loans))
+        return_iter = iter(request_ids)
+        timed(results, 'return_book', lambda: service.return_book(next(return_iter)),
+              len(request_ids))
+
+        timed(results, 'page_requests_build', lambda: service.page('requests', 20))
+        timed(results, 'page_requests', lambda: service.page('requests', 20), operations)
+        last_page = -(-len(service.listing('requests')) // 20)
+        timed(results, 'page_requests_last', lambda: service.page('requests', 20, number=last_page),
+              operations)
+        timed(results, 'most_popular_books', lambda: service.most_popular(10))
+        timed(results, 'overdue_analysis', service.overdue_analysis)
+        timed(results, 'loan_analytics_build', service.loan_analytics)
+        timed(results, 'loan_analytics', service.loan_analytics)
+        timed(results, 'report_pack', service.report_pack)
+        timed(results, 'report_pack_parallel', lambda: service.report_pack(os.cpu_count() or 1))
+        timed(results, 'export_all_data', lambda: service.export_all(parallel=True))
+        service.close()
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the lending operations at several library sizes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="numbers of books (and of historical loans) to test with")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--operations', type=int, default=100,
+                        help="searches, borrows and returns timed per size")
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'sizes': {}
+    }
+    for size in args.sizes:
+        print(f"Benchmarking {size} books...")
+        report['sizes'][str(size)] = run_size(size, args.seed, args.operations)
+        for name, result in report['sizes'][str(size)].items():
+            if result['seconds'] is None:
+                print(f"  {name:<20} {'skipped':>10}")
+            else:
+                print(f"  {name:<20} {result['seconds'] * 1000:10.2f} ms")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
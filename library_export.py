@@ -0,0 +1,86 @@
+import csv
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# (header, record key) per exported column
+EXPORT_COLUMNS = {
+    'books': (
+        ('ID', 'id'), ('Title', 'title'), ('Author', 'author'), ('ISBN', 'isbn'),
+        ('Category', 'category'), ('Year', 'year'), ('Status', 'status'),
+        ('Date Added', 'date_added')
+    ),
+    'users': (
+        ('ID', 'id'), ('Name', 'name'), ('Email', 'email'), ('Phone', 'phone'),
+        ('Address', 'address'), ('Date Joined', 'date_joined'),
+        ('Active Borrowings', 'active_borrowings'), ('Total Borrowings', 'total_borrowings')
+    ),
+    'requests': (
+        ('ID', 'id'), ('User ID', 'user_id'), ('Book ID', 'book_id'),
+        ('Borrow Date', 'borrow_date'), ('Due Date', 'due_date'),
+        ('Return Date', 'return_date'), ('Status', 'status'), ('Renewals', 'renewals')
+    )
+}
+
+EXPORT_STATE_FILE = "export_state.json"
+WRITE_BUFFER = 1024 * 1024
+ROWS_PER_WRITE = 10000
+
+
+def export_rows(records, keys, since=None):
+    for record in records:
+        # Incremental exports skip rows not touched since the last export
+        if since and (record.get('last_modified') or '') < since:
+            continue
+        yield [record.get(key, '') for key in keys]
+
+
+def export_table(table, records, filename, compress=False, since=None):
+    columns = EXPORT_COLUMNS[table]
+    keys = [key for header, key in columns]
+    if compress:
+        f = gzip.open(filename, 'wt', newline='', encoding='utf-8')
+    else:
+        f = open(filename, 'w', newline='', encoding='utf-8', buffering=WRITE_BUFFER)
+
+    count = 0
+    with f:
+        writer = csv.writer(f)
+        writer.writerow([header for header, key in columns])
+        batch = []
+        for row in export_rows(records, keys, since):
+            batch.append(row)
+            if len(batch) >= ROWS_PER_WRITE:
+                writer.writerows(batch)
+                count += len(batch)
+                batch = []
+        writer.writerows(batch)
+        count += len(batch)
+    return count
+
+
+def export_tables(tables, timestamp, compress=False, since=None, parallel=True):
+    # Returns {table: (filename, rows written)}
+    suffix = ".csv.gz" if compress else ".csv"
+    jobs = {table: f"{table}_export_{timestamp}{suffix}" for table in EXPORT_COLUMNS}
+
+    def run(table):
+        return table, (jobs[table], export_table(table, tables[table], jobs[table], compress, since))
+
+    if parallel:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            return dict(pool.map(run, jobs))
+    return dict(run(table) for table in jobs)
+
+
+def last_export_time(state_file=EXPORT_STATE_FILE):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as f:
+        return json.load(f).get('last_export')
+
+
+def save_export_time(value, state_file=EXPORT_STATE_FILE):
+    with open(state_file, 'w') as f:
+        json.dump({'last_export': value}, f)
@@ -0,0 +1,76 @@
+import csv
+import json
+from datetime import datetime
+
+from library_export import EXPORT_COLUMNS
+
+# Fields taken from an import file; ids are always assigned on import
+IMPORT_FIELDS = {
+    'books': ('title', 'author', 'isbn', 'category', 'year', 'status', 'date_added'),
+    'users': ('name', 'email', 'phone', 'address', 'date_joined')
+}
+
+REQUIRED_FIELDS = {
+    'books': ('title', 'author'),
+    'users': ('name',)
+}
+
+
+def read_rows(path):
+    # (line number, raw row) from a CSV file with a header, or JSON Lines
+    if path.endswith(('.jsonl', '.ndjson')):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_number, e
+                    continue
+                yield line_number, row
+    else:
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            for line_number, row in enumerate(csv.DictReader(f), 2):
+                yield line_number, row
+
+
+def clean_row(table, row):
+    # Returns (record, None) or (None, error message)
+    if isinstance(row, ValueError):
+        return None, f"invalid JSON ({row})"
+    if not isinstance(row, dict):
+        return None, "row is not an object"
+
+    # Accept both the export headers ("Date Added") and the record keys
+    headers = {header: key for header, key in EXPORT_COLUMNS[table]}
+    values = {}
+    for name, value in row.items():
+        key = headers.get(name, name)
+        if key in IMPORT_FIELDS[table] and value is not None:
+            values[key] = str(value).strip()
+
+    for field in REQUIRED_FIELDS[table]:
+        if not values.get(field):
+            return None, f"missing {field}"
+
+    today = datetime.now().strftime("%Y-%m-%d")
+    if table == 'books':
+        if values.get('year') and not values['year'].isdigit():
+            return None, f"invalid year '{values['year']}'"
+        status = values.get('status') or 'Available'
+        if status not in ('Available', 'Borrowed'):
+            return None, f"invalid status '{status}'"
+        record = {field: values.get(field, '') for field in IMPORT_FIELDS[table]}
+        # An imported book has no loan behind it, so a 'Borrowed' row from an
+        # export comes in on the shelf
+        record['status'] = 'Available'
+        record['date_added'] = values.get('date_added') or today
+    else:
+        if values.get('email') and '@' not in values['email']:
+            return None, f"invalid email '{values['email']}'"
+        record = {field: values.get(field, '') for field in IMPORT_FIELDS[table]}
+        record['date_joined'] = values.get('date_joined') or today
+        record['active_borrowings'] = 0
+        record['total_borrowings'] = 0
+    return record, None
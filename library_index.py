@@ -0,0 +1,556 @@
+import heapq
+import re
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from datetime import date
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# How much a match in each field counts towards a book's rank
+SEARCH_FIELDS = (
+    ('title', 3),
+    ('author', 2),
+    ('isbn', 3),
+    ('category', 1)
+)
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text or '').lower())
+
+
+# Inverted index over the searchable book fields
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}    # token -> {book_id: weight}
+        self.doc_terms = {}   # book_id -> tokens it was indexed under
+        self.terms = []       # sorted vocabulary, for prefix lookups
+
+    def build(self, books):
+        # Bulk load: sort the vocabulary once instead of inserting term by term
+        for book in books:
+            self.add(book, keep_sorted=False)
+        self.terms = sorted(self.postings)
+
+    def add(self, book, keep_sorted=True):
+        book_id = str(book.get('id'))
+        weights = {}
+        for field, weight in SEARCH_FIELDS:
+            value = book.get(field)
+            tokens = tokenize(value)
+            if field == 'isbn' and len(tokens) > 1:
+                # Also index the ISBN without its dashes or spaces
+                tokens.append(''.join(tokens))
+            for token in tokens:
+                weights[token] = weights.get(token, 0) + weight
+
+        for token, weight in weights.items():
+            docs = self.postings.get(token)
+            if docs is None:
+                docs = self.postings[token] = {}
+                if keep_sorted:
+                    insort(self.terms, token)
+            docs[book_id] = weight
+        self.doc_terms[book_id] = tuple(weights)
+
+    def remove(self, book_id):
+        book_id = str(book_id)
+        for token in self.doc_terms.pop(book_id, ()):
+            docs = self.postings[token]
+            del docs[book_id]
+            if not docs:
+                del self.postings[token]
+                del self.terms[bisect_left(self.terms, token)]
+
+    def update(self, book):
+        self.remove(book.get('id'))
+        self.add(book)
+
+    def prefix_matches(self, prefix):
+        # Every indexed term starting with prefix, scored per book
+        scores = {}
+        position = bisect_left(self.terms, prefix)
+        while position < len(self.terms) and self.terms[position].startswith(prefix):
+            term = self.terms[position]
+            # Whole-word hits rank above prefix hits
+            bonus = 2 if term == prefix else 1
+            for book_id, weight in self.postings[term].items():
+                score = weight * bonus
+                if score > scores.get(book_id, 0):
+                    scores[book_id] = score
+            position += 1
+        return scores
+
+    def search(self, query, limit=None):
+        # Books matching every query term (as a prefix), best matches first
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        matches = [self.prefix_matches(term) for term in set(terms)]
+        matches.sort(key=len)
+        results = matches[0]
+        for scores in matches[1:]:
+            results = {book_id: score + scores[book_id]
+                       for book_id, score in results.items() if book_id in scores}
+            if not results:
+                return []
+
+        ranked = sorted(results.items(), key=lambda item: (-item[1], sort_key(item[0])))
+        if limit:
+            ranked = ranked[:limit]
+        return [book_id for book_id, score in ranked]
+
+
+def sort_key(record_id):
+    # Numeric ids sort numerically, anything else after them
+    return (0, int(record_id), '') if record_id.isdigit() else (1, 0, record_id)
+
+
+def key_id(key):
+    # The id a sort_key() was made from
+    return str(key[1]) if key[0] == 0 else key[2]
+
+
+# A table's ids in id order, for paging through it by cursor: a cursor is
+# an id, found again by bisection, and page N starts at position N * size
+class Listing:
+    def __init__(self, records):
+        self.records = records  # id -> record
+        self.keys = sorted(sort_key(record_id) for record_id in records)
+
+    def put(self, record):
+        record_id = str(record.get('id'))
+        self.records[record_id] = record
+        key = sort_key(record_id)
+        position = bisect_left(self.keys, key)
+        if position == len(self.keys) or self.keys[position] != key:
+            self.keys.insert(position, key)
+
+    def remove(self, record_id):
+        record_id = str(record_id)
+        self.records.pop(record_id, None)
+        key = sort_key(record_id)
+        position = bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+
+    def after(self, record_id):
+        # Position of the first id after record_id
+        return bisect_right(self.keys, sort_key(str(record_id)))
+
+    def before(self, record_id):
+        # Position just past the last id before record_id
+        return bisect_left(self.keys, sort_key(str(record_id)))
+
+    def forward(self, position):
+        # Records from position on, read one at a time
+        while position < len(self.keys):
+            record = self.records.get(key_id(self.keys[position]))
+            if record is not None:
+                yield record
+            position += 1
+
+    def backward(self, position):
+        # Records before position, nearest first
+        while position > 0:
+            position -= 1
+            record = self.records.get(key_id(self.keys[position]))
+            if record is not None:
+                yield record
+
+    def __len__(self):
+        return len(self.keys)
+
+
+# Running totals behind library_statistics
+class LibraryStats:
+    def __init__(self):
+        self.total_books = 0
+        self.book_statuses = {}
+        self.categories = {}
+        self.active_requests = 0
+
+    @classmethod
+    def count(cls, books, requests):
+        # Full recount, used to build the totals and to verify them
+        stats = cls()
+        for book in books:
+            stats.add_book(book)
+        for request in requests:
+            stats.add_request(request)
+        return stats
+
+    def add_book(self, book, change=1):
+        self.total_books += change
+        bump(self.book_statuses, book.get('status'), change)
+        bump(self.categories, book.get('category', 'Uncategorized'), change)
+
+    def remove_book(self, book):
+        self.add_book(book, -1)
+
+    def add_request(self, request, change=1):
+        if request.get('status') == 'Active':
+            self.active_requests += change
+
+    def remove_request(self, request):
+        self.add_request(request, -1)
+
+    def counts(self):
+        return {
+            'total_books': self.total_books,
+            'available_books': self.book_statuses.get('Available', 0),
+            'borrowed_books': self.book_statuses.get('Borrowed', 0),
+            'active_requests': self.active_requests,
+            'categories': dict(self.categories)
+        }
+
+
+def bump(counter, key, change):
+    count = counter.get(key, 0) + change
+    if count:
+        counter[key] = count
+    else:
+        counter.pop(key, None)
+
+
+# Active loans ordered by due date, so overdue lookups only touch overdue loans
+class DueDateIndex:
+    def __init__(self):
+        self.entries = []   # sorted (due ordinal, request id)
+        self.keys = {}      # request id -> its entry
+
+    def build(self, requests):
+        for request in requests:
+            if request.get('status') == 'Active':
+                key = (due_ordinal(request), str(request.get('id')))
+                self.keys[key[1]] = key
+        self.entries = sorted(self.keys.values())
+
+    def add(self, request):
+        if request.get('status') != 'Active':
+            return
+        key = (due_ordinal(request), str(request.get('id')))
+        self.keys[key[1]] = key
+        insort(self.entries, key)
+
+    def remove(self, request):
+        key = self.keys.pop(str(request.get('id')), None)
+        if key is not None:
+            del self.entries[bisect_left(self.entries, key)]
+
+    def due_before(self, ordinal):
+        # (due ordinal, request id) for active loans due before the given day
+        return self.entries[:bisect_left(self.entries, (ordinal,))]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Each user's loans by request id: the active ones always, the closed ones
+# once something has asked for a user's past loans
+class UserLoanIndex:
+    def __init__(self):
+        self.active = {}    # user id -> {request id: active loan}
+        self.closed = {}    # user id -> {request id: closed loan}, for users whose history was read
+
+    def build(self, requests):
+        for request in requests:
+            self.add(request)
+
+    def add(self, request):
+        if request.get('status') == 'Active':
+            self.active.setdefault(request.get('user_id'), {})[str(request.get('id'))] = request
+
+    def remove(self, request):
+        loans = self.active.get(request.get('user_id'))
+        if loans is not None:
+            loans.pop(str(request.get('id')), None)
+            if not loans:
+                del self.active[request.get('user_id')]
+
+    def build_closed(self, requests):
+        # Every closed loan at once
+        self.closed = {}
+        for request in requests:
+            self.closed.setdefault(request.get('user_id'), {})[str(request.get('id'))] = request
+
+    def has_closed(self, user_id):
+        return str(user_id) in self.closed
+
+    def set_closed(self, user_id, requests):
+        # A user's closed loans, read from the archive; kept current from here on
+        self.closed[str(user_id)] = {str(request.get('id')): request for request in requests}
+
+    def add_closed(self, request):
+        loans = self.closed.get(request.get('user_id'))
+        if loans is not None:
+            loans[str(request.get('id'))] = request
+
+    def remove_closed(self, request_id):
+        for loans in self.closed.values():
+            loans.pop(request_id, None)
+
+    def active_loans(self, user_id):
+        return list(self.active.get(str(user_id), {}).values())
+
+    def active_count(self, user_id):
+        return len(self.active.get(str(user_id), ()))
+
+    def closed_loans(self, user_id):
+        return list(self.closed.get(str(user_id), {}).values())
+
+
+# The active loans of each book, for availability checks
+class BookLoanIndex:
+    def __init__(self):
+        self.active = {}    # book id -> {request id: active loan}
+
+    def build(self, requests):
+        for request in requests:
+            self.add(request)
+
+    def add(self, request):
+        if request.get('status') == 'Active':
+            self.active.setdefault(request.get('book_id'), {})[str(request.get('id'))] = request
+
+    def remove(self, request):
+        loans = self.active.get(request.get('book_id'))
+        if loans is not None:
+            loans.pop(str(request.get('id')), None)
+            if not loans:
+                del self.active[request.get('book_id')]
+
+    def active_loans(self, book_id):
+        return list(self.active.get(str(book_id), {}).values())
+
+
+# Open holds, first come first served. Waiting holds queue up per book; a
+# hold is ready once a copy is set aside for it, and ready holds are kept
+# ordered by pickup deadline so expired ones are found without a scan.
+class HoldQueue:
+    def __init__(self):
+        self.waiting = {}     # book id -> waiting holds, oldest first
+        self.open = {}        # (user id, book id) -> the user's hold on that book
+        self.ready = {}       # barcode -> the hold its copy is set aside for
+        self.deadlines = []   # sorted (pickup ordinal, hold id) of ready holds
+        self.keys = {}        # hold id -> its deadline entry
+
+    def build(self, holds):
+        # Oldest first, so each queue is in the order the holds were placed
+        for hold in sorted(holds, key=lambda hold: sort_key(str(hold.get('id')))):
+            self.add(hold)
+
+    def add(self, hold):
+        self.open[(hold.get('user_id'), hold.get('book_id'))] = hold
+        if hold.get('status') == 'Ready':
+            key = (field_ordinal(hold, 'pickup_by'), str(hold.get('id')))
+            self.keys[key[1]] = key
+            insort(self.deadlines, key)
+            self.ready[hold.get('barcode')] = hold
+        else:
+            self.waiting.setdefault(hold.get('book_id'), deque()).append(hold)
+
+    def remove(self, hold):
+        hold_id = str(hold.get('id'))
+        self.open.pop((hold.get('user_id'), hold.get('book_id')), None)
+        key = self.keys.pop(hold_id, None)
+        if key is not None:
+            del self.deadlines[bisect_left(self.deadlines, key)]
+            self.ready.pop(hold.get('barcode'), None)
+            return
+
+        book_id = hold.get('book_id')
+        queue = self.waiting.get(book_id)
+        if not queue:
+            return
+        if str(queue[0].get('id')) == hold_id:
+            queue.popleft()  # the usual case: the head of the queue is being served
+        else:
+            queue = self.waiting[book_id] = deque(waiting for waiting in queue
+                                                  if str(waiting.get('id')) != hold_id)
+        if not queue:
+            del self.waiting[book_id]
+
+    def get(self, user_id, book_id):
+        return self.open.get((str(user_id), str(book_id)))
+
+    def next_waiting(self, book_id):
+        queue = self.waiting.get(str(book_id))
+        return queue[0] if queue else None
+
+    def waiting_holds(self, book_id):
+        return list(self.waiting.get(str(book_id), ()))
+
+    def expired(self, ordinal):
+        # Ids of ready holds whose pickup date is before the given day
+        return [hold_id for _, hold_id in self.deadlines[:bisect_left(self.deadlines, (ordinal,))]]
+
+
+def copy_barcode(book_id, number):
+    return f"{book_id}-{number}"
+
+
+def book_copies(book):
+    # A book without a copies list is a single copy with the book's own status
+    copies = book.get('copies')
+    if copies is None:
+        return [{'barcode': copy_barcode(book.get('id'), 1), 'status': book.get('status')}]
+    return copies
+
+
+# The free copies of each title, so a borrow claims one without looking
+# through the others
+class CopyPool:
+    def __init__(self):
+        self.free = {}      # book id -> barcodes of its available copies
+        self.totals = {}    # book id -> number of copies
+
+    def build(self, books):
+        for book in books:
+            self.add(book)
+
+    def add(self, book):
+        book_id = str(book.get('id'))
+        copies = book_copies(book)
+        self.totals[book_id] = len(copies)
+        self.free[book_id] = [copy.get('barcode') for copy in copies
+                              if copy.get('status') == 'Available']
+
+    def remove(self, book):
+        book_id = str(book.get('id'))
+        self.totals.pop(book_id, None)
+        self.free.pop(book_id, None)
+
+    def claim(self, book_id):
+        # Barcode of a free copy, now taken, or None if every copy is out
+        free = self.free.get(str(book_id))
+        return free.pop() if free else None
+
+    def release(self, book_id, barcode):
+        free = self.free.get(str(book_id))
+        if free is not None and barcode not in free:
+            free.append(barcode)
+
+    def available(self, book_id):
+        return len(self.free.get(str(book_id), ()))
+
+    def total(self, book_id):
+        return self.totals.get(str(book_id), 0)
+
+
+# Borrow counts per book with the books grouped by count, so the top K
+# are read off the highest counts without sorting every book
+class PopularityCounter:
+    def __init__(self):
+        self.counts = {}    # book id -> borrow count
+        self.buckets = {}   # count -> book ids with that count
+        self.levels = []    # sorted counts that have a bucket
+
+    def add(self, book_id, change=1):
+        old = self.counts.get(book_id, 0)
+        new = old + change
+        if old:
+            bucket = self.buckets[old]
+            bucket.discard(book_id)
+            if not bucket:
+                del self.buckets[old]
+                del self.levels[bisect_left(self.levels, old)]
+        if new > 0:
+            self.counts[book_id] = new
+            if new not in self.buckets:
+                self.buckets[new] = set()
+                insort(self.levels, new)
+            self.buckets[new].add(book_id)
+        else:
+            self.counts.pop(book_id, None)
+
+    def top(self, limit):
+        # [(book id, count)], highest count first, ties by id
+        results = []
+        for count in reversed(self.levels):
+            needed = limit - len(results)
+            if needed <= 0:
+                break
+            for book_id in heapq.nsmallest(needed, self.buckets[count], key=sort_key):
+                results.append((book_id, count))
+        return results
+
+
+# All-time borrow counts plus rolling windows over the last few days. Each
+# window keeps its own counter; as days pass, the borrows of the day that
+# drops out are taken off it, so no window ever rescans the history.
+class PopularityIndex:
+    WINDOWS = (7, 30, 365)
+
+    def __init__(self, today=None):
+        self.today = today or date.today().toordinal()
+        self.all_time = PopularityCounter()
+        self.windows = {days: PopularityCounter() for days in self.WINDOWS}
+        self.daily = {}   # borrow day ordinal -> {book id: borrows}, for the longest window
+
+    def build(self, requests):
+        for request in requests:
+            self.add(request)
+
+    def add(self, request, change=1):
+        book_id = request.get('book_id')
+        if book_id is None:
+            return
+        self.all_time.add(book_id, change)
+        try:
+            day = field_ordinal(request, 'borrow_date')
+        except (TypeError, ValueError):
+            return  # no usable borrow date: counts towards all time only
+        if day <= self.today - max(self.WINDOWS):
+            return
+        borrows = self.daily.setdefault(day, {})
+        borrows[book_id] = borrows.get(book_id, 0) + change
+        for days, counter in self.windows.items():
+            if day > self.today - days:
+                counter.add(book_id, change)
+
+    def remove(self, request):
+        self.add(request, -1)
+
+    def advance(self, today):
+        # Move the windows forward to `today`
+        if today <= self.today:
+            return
+        for days, counter in self.windows.items():
+            old_start, new_start = self.today - days, today - days
+            for day in [day for day in self.daily if old_start < day <= new_start]:
+                for book_id, borrows in self.daily[day].items():
+                    counter.add(book_id, -borrows)
+        oldest = today - max(self.WINDOWS)
+        for day in [day for day in self.daily if day <= oldest]:
+            del self.daily[day]
+        self.today = today
+
+    @classmethod
+    def check_window(cls, days):
+        if days is not None and days not in cls.WINDOWS:
+            raise ValueError(f"No popularity window of {days} days; use one of {cls.WINDOWS}")
+
+    def top(self, limit, days=None):
+        # [(book id, borrows)] of all time, or over the last `days` days
+        if days is None:
+            return self.all_time.top(limit)
+        self.check_window(days)
+        self.advance(date.today().toordinal())
+        return self.windows[days].top(limit)
+
+
+def date_ordinal(value):
+    return date.fromisoformat(value).toordinal()
+
+
+def field_ordinal(record, field):
+    # Compact records keep their dates as ordinals already
+    if hasattr(record, 'ordinal'):
+        return record.ordinal(field)
+    return date_ordinal(record.get(field))
+
+
+def due_ordinal(request):
+    return field_ordinal(request, 'due_date')
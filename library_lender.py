@@ -1,43 +1,24 @@
 import json
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
+
+from library_export import last_export_time
+from library_metrics import Metrics
+from library_reports import write_report_pack
+from library_service import LendingError, LibraryService
+
+PAGE_SIZE = 20  # rows per page in the listings
+
 
 class LibraryLenderSystem:
-    def __init__(self):
-        self.books_file = "books.json"
-        self.users_file = "users.json"
-        self.requests_file = "requests.json"
-        self.load_data()
-    
-    def load_data(self):
-        # Load books
-        if os.path.exists(self.books_file):
-            with open(self.books_file, 'r') as f:
-                self.books = json.load(f)
-        else:
-            self.books = []
-        
-        # Load users
-        if os.path.exists(self.users_file):
-            with open(self.users_file, 'r') as f:
-                self.users = json.load(f)
-        else:
-            self.users = []
-        
-        # Load requests
-        if os.path.exists(self.requests_file):
-            with open(self.requests_file, 'r') as f:
-                self.requests = json.load(f)
-        else:
-            self.requests = []
-    
-    def save_data(self):
-        with open(self.books_file, 'w') as f:
-            json.dump(self.books, f, indent=2)
-        with open(self.users_file, 'w') as f:
-            json.dump(self.users, f, indent=2)
-        with open(self.requests_file, 'w') as f:
-            json.dump(self.requests, f, indent=2)
+    # Menu-driven front end; all the work is done by LibraryService
+    def __init__(self, backend='json', verify_stats=False, service=None, show_timings=False,
+                 metrics_file=None):
+        self.metrics_file = metrics_file  # where to dump operation metrics on exit
+        metrics = Metrics() if metrics_file else None
+        self.service = service or LibraryService(backend, verify_stats, metrics)
+        self.show_timings = show_timings  # report startup and table load times
     
     def display_menu(self):
         print("\n" + "="*50)
@@ -52,7 +33,10 @@ class LibraryLenderSystem:
         print("="*50)
     
     def run(self):
+        if self.show_timings:
+            print(f"Started in {self.service.startup_time * 1000:.1f} ms")
         while True:
+            self.service.refresh()  # pick up changes saved by other sessions
             self.display_menu()
             choice = input("\nEnter your choice (1-6): ")
             
@@ -67,15 +51,25 @@ class LibraryLenderSystem:
             elif choice == '5':
                 self.generate_reports()
             elif choice == '6':
-                self.save_data()
+                self.service.close()
+                if self.show_timings:
+                    self.print_load_times()
+                if self.metrics_file:
+                    self.service.metrics.dump(self.metrics_file)
                 print("\nThank you for using Library Lending System!")
                 break
             else:
                 print("\nInvalid choice! Please try again.")
     
+    def print_load_times(self):
+        print("\nLoad times:")
+        for name, seconds in self.service.load_times.items():
+            print(f"  {name}: {seconds * 1000:.1f} ms")
+    
     # OPTION 1: MANAGE BOOKS
     def manage_books(self):
         while True:
+            self.service.refresh()
             print("\n" + "="*50)
             print("MANAGE BOOKS")
             print("="*50)
@@ -84,9 +78,11 @@ class LibraryLenderSystem:
             print("3. Update Book Details")
             print("4. Delete Book")
             print("5. Check Book Availability")
-            print("6. Back to Main Menu")
+            print("6. Import Books from File")
+            print("7. Add Copies")
+            print("8. Back to Main Menu")
             
-            choice = input("\nEnter your choice (1-6): ")
+            choice = input("\nEnter your choice (1-8): ")
             
             if choice == '1':
                 self.view_all_books()
@@ -99,27 +95,66 @@ class LibraryLenderSystem:
             elif choice == '5':
                 self.check_availability()
             elif choice == '6':
+                self.import_records('books')
+            elif choice == '7':
+                self.add_copies()
+            elif choice == '8':
                 break
             else:
                 print("Invalid choice!")
     
+    def page_through(self, table, header, width, format_row, **filters):
+        # Shows one page at a time; only the rows on screen are read and formatted
+        page = self.service.page(table, PAGE_SIZE, **filters)
+        number = 1
+        while True:
+            print("\n" + "="*width)
+            print(header)
+            print("="*width)
+            for record in page['records']:
+                print(format_row(record))
+            if not page['records']:
+                print("No records found!")
+            if page['next'] is None and page['prev'] is None:
+                return
+            
+            position = f"Page {number}"
+            if page['total'] is not None:
+                position += f" of {max(1, -(-page['total'] // PAGE_SIZE))}"
+            choice = input(f"\n{position} - [n]ext, [p]revious, [g]o to page, [q]uit: ").lower()
+            if choice == 'n' and page['next'] is not None:
+                page = self.service.page(table, PAGE_SIZE, after=page['next'], **filters)
+                number += 1
+            elif choice == 'p' and page['prev'] is not None:
+                page = self.service.page(table, PAGE_SIZE, before=page['prev'], **filters)
+                number -= 1
+            elif choice == 'g':
+                try:
+                    number = max(1, int(input("Page number: ")))
+                except ValueError:
+                    print("Invalid page number!")
+                    continue
+                page = self.service.page(table, PAGE_SIZE, number=number, **filters)
+            elif choice == 'q':
+                return
+            else:
+                print("Invalid choice!")
+    
     def view_all_books(self):
-        print("\n" + "="*80)
-        print(f"{'ID':<5} {'Title':<30} {'Author':<20} {'Status':<10} {'ISBN':<15}")
-        print("="*80)
-        for book in self.books:
-            print(f"{book.get('id', ''):<5} {book.get('title', '')[:28]:<30} "
-                  f"{book.get('author', '')[:18]:<20} {book.get('status', ''):<10} "
-                  f"{book.get('isbn', ''):<15}")
+        status = input("Filter by status (Enter for all): ")
+        category = input("Filter by category (Enter for all): ")
+        self.page_through('books',
+                          f"{'ID':<5} {'Title':<30} {'Author':<20} {'Status':<10} {'ISBN':<15}",
+                          80, self.format_book, status=status, category=category)
+    
+    def format_book(self, book):
+        return (f"{book.get('id', ''):<5} {book.get('title', '')[:28]:<30} "
+                f"{book.get('author', '')[:18]:<20} {book.get('status', ''):<10} "
+                f"{book.get('isbn', ''):<15}")
     
     def search_book(self):
-        search_term = input("\nEnter title, author, or ISBN to search: ").lower()
-        results = []
-        for book in self.books:
-            if (search_term in book.get('title', '').lower() or
-                search_term in book.get('author', '').lower() or
-                search_term in book.get('isbn', '').lower()):
-                results.append(book)
+        search_term = input("\nEnter title, author, ISBN or category to search: ")
+        results = self.service.search(search_term)
         
         if results:
             print(f"\nFound {len(results)} book(s):")
@@ -134,67 +169,88 @@ class LibraryLenderSystem:
     
     def update_book(self):
         book_id = input("Enter Book ID to update: ")
-        for book in self.books:
-            if str(book.get('id')) == book_id:
-                print("\nCurrent Details:")
-                print(f"Title: {book.get('title')}")
-                print(f"Author: {book.get('author')}")
-                print(f"ISBN: {book.get('isbn')}")
-                print(f"Status: {book.get('status')}")
-                
-                print("\nEnter new details (press Enter to keep current):")
-                new_title = input(f"Title [{book.get('title')}]: ") or book.get('title')
-                new_author = input(f"Author [{book.get('author')}]: ") or book.get('author')
-                new_isbn = input(f"ISBN [{book.get('isbn')}]: ") or book.get('isbn')
-                new_status = input(f"Status (Available/Borrowed) [{book.get('status')}]: ") or book.get('status')
-                
-                book['title'] = new_title
-                book['author'] = new_author
-                book['isbn'] = new_isbn
-                book['status'] = new_status
-                
-                print("Book updated successfully!")
-                self.save_data()
-                return
+        book = self.service.get_book_by_id(book_id)
+        if not book:
+            print("Book not found!")
+            return
+        
+        print("\nCurrent Details:")
+        print(f"Title: {book.get('title')}")
+        print(f"Author: {book.get('author')}")
+        print(f"ISBN: {book.get('isbn')}")
+        print(f"Category: {book.get('category')}")
+        print(f"Status: {book.get('status')}")
         
-        print("Book not found!")
+        print("\nEnter new details (press Enter to keep current):")
+        new_title = input(f"Title [{book.get('title')}]: ") or None
+        new_author = input(f"Author [{book.get('author')}]: ") or None
+        new_isbn = input(f"ISBN [{book.get('isbn')}]: ") or None
+        new_category = input(f"Category [{book.get('category')}]: ") or None
+        new_status = input(f"Status (Available/Borrowed) [{book.get('status')}]: ") or None
+        
+        self.service.update_book(book_id, title=new_title, author=new_author, isbn=new_isbn,
+                                 category=new_category, status=new_status)
+        print("Book updated successfully!")
     
     def delete_book(self):
         book_id = input("Enter Book ID to delete: ")
-        for i, book in enumerate(self.books):
-            if str(book.get('id')) == book_id:
-                if book.get('status') == 'Borrowed':
-                    print("Cannot delete borrowed book!")
-                    return
-                
-                confirm = input(f"Delete '{book.get('title')}'? (y/n): ").lower()
-                if confirm == 'y':
-                    del self.books[i]
-                    print("Book deleted successfully!")
-                    self.save_data()
-                return
+        book = self.service.get_book_by_id(book_id)
+        if not book:
+            print("Book not found!")
+            return
+        
+        if book.get('status') == 'Borrowed':
+            print("Cannot delete borrowed book!")
+            return
         
-        print("Book not found!")
+        confirm = input(f"Delete '{book.get('title')}'? (y/n): ").lower()
+        if confirm == 'y':
+            try:
+                self.service.delete_book(book_id)
+            except LendingError as e:
+                print(e)
+                return
+            print("Book deleted successfully!")
     
     def check_availability(self):
         book_id = input("Enter Book ID to check: ")
-        for book in self.books:
-            if str(book.get('id')) == book_id:
-                print(f"\nBook: {book.get('title')}")
-                print(f"Status: {book.get('status')}")
-                
-                # Check if book is borrowed
-                if book.get('status') == 'Borrowed':
-                    for request in self.requests:
-                        if (request.get('book_id') == book_id and 
-                            request.get('status') == 'Active'):
-                            due_date = request.get('due_date')
-                            borrower = request.get('user_id')
-                            print(f"Borrowed by: User {borrower}")
-                            print(f"Due Date: {due_date}")
-                return
+        try:
+            availability = self.service.check_availability(book_id)
+        except LendingError as e:
+            print(e)
+            return
         
-        print("Book not found!")
+        book = availability['book']
+        print(f"\nBook: {book.get('title')}")
+        print(f"Status: {book.get('status')}")
+        print(f"Copies available: {availability['available']} of {availability['total']}")
+        
+        # Who has the copies that are out
+        for request in availability['loans']:
+            print(f"Borrowed by: User {request.get('user_id')}")
+            if request.get('barcode'):
+                print(f"Copy: {request.get('barcode')}")
+            print(f"Due Date: {request.get('due_date')}")
+        
+        for hold in availability['holds']:
+            if hold.get('status') == 'Ready':
+                print(f"On hold for: User {hold.get('user_id')} until {hold.get('pickup_by')}")
+            else:
+                print(f"Waiting: User {hold.get('user_id')} since {hold.get('hold_date')}")
+    
+    def add_copies(self):
+        book_id = input("Enter Book ID: ")
+        try:
+            count = int(input("Number of copies to add: "))
+            book = self.service.add_copies(book_id, count)
+        except ValueError:
+            print("Invalid number!")
+            return
+        except LendingError as e:
+            print(e)
+            return
+        
+        print(f"\nBook '{book.get('title')}' now has {len(book['copies'])} copies")
     
     # OPTION 2: ADD BOOK
     def add_book(self):
@@ -202,36 +258,34 @@ class LibraryLenderSystem:
         print("ADD NEW BOOK")
         print("="*50)
         
-        # Generate new ID
-        if self.books:
-            new_id = max(int(book['id']) for book in self.books) + 1
-        else:
-            new_id = 1
-        
         title = input("Enter book title: ")
         author = input("Enter author: ")
         isbn = input("Enter ISBN: ")
         category = input("Enter category: ")
         year = input("Enter publication year: ")
         
-        new_book = {
-            'id': new_id,
-            'title': title,
-            'author': author,
-            'isbn': isbn,
-            'category': category,
-            'year': year,
-            'status': 'Available',
-            'date_added': datetime.now().strftime("%Y-%m-%d")
-        }
-        
-        self.books.append(new_book)
-        self.save_data()
-        print(f"\nBook '{title}' added successfully with ID: {new_id}")
+        new_book = self.service.add_book(title, author, isbn, category, year)
+        print(f"\nBook '{title}' added successfully with ID: {new_book['id']}")
+    
+    def import_records(self, table):
+        path = input("Enter path to CSV or JSON Lines file: ")
+        if not os.path.exists(path):
+            print("File not found!")
+            return
+        
+        imported, errors = self.service.bulk_import(table, path)
+        print(f"\nImported {imported} {table}")
+        if errors:
+            print(f"Skipped {len(errors)} row(s):")
+            for line_number, error in errors[:20]:
+                print(f"  Line {line_number}: {error}")
+            if len(errors) > 20:
+                print(f"  ... and {len(errors) - 20} more")
     
     # OPTION 3: MANAGE USERS
     def manage_users(self):
         while True:
+            self.service.refresh()
             print("\n" + "="*50)
             print("MANAGE USERS")
             print("="*50)
@@ -240,9 +294,10 @@ class LibraryLenderSystem:
             print("3. Update User")
             print("4. Delete User")
             print("5. View User Borrowing History")
-            print("6. Back to Main Menu")
+            print("6. Import Users from File")
+            print("7. Back to Main Menu")
             
-            choice = input("\nEnter your choice (1-6): ")
+            choice = input("\nEnter your choice (1-7): ")
             
             if choice == '1':
                 self.view_all_users()
@@ -255,101 +310,85 @@ class LibraryLenderSystem:
             elif choice == '5':
                 self.view_user_history()
             elif choice == '6':
+                self.import_records('users')
+            elif choice == '7':
                 break
             else:
                 print("Invalid choice!")
     
     def view_all_users(self):
-        print("\n" + "="*70)
-        print(f"{'ID':<5} {'Name':<20} {'Email':<25} {'Phone':<15}")
-        print("="*70)
-        for user in self.users:
-            print(f"{user.get('id', ''):<5} {user.get('name', '')[:18]:<20} "
-                  f"{user.get('email', '')[:23]:<25} {user.get('phone', ''):<15}")
+        self.page_through('users', f"{'ID':<5} {'Name':<20} {'Email':<25} {'Phone':<15}",
+                          70, self.format_user)
+    
+    def format_user(self, user):
+        return (f"{user.get('id', ''):<5} {user.get('name', '')[:18]:<20} "
+                f"{user.get('email', '')[:23]:<25} {user.get('phone', ''):<15}")
     
     def add_user(self):
         print("\nADD NEW USER")
         print("-"*30)
         
-        if self.users:
-            new_id = max(int(user['id']) for user in self.users) + 1
-        else:
-            new_id = 1
-        
         name = input("Enter full name: ")
         email = input("Enter email: ")
         phone = input("Enter phone: ")
         address = input("Enter address: ")
         
-        new_user = {
-            'id': new_id,
-            'name': name,
-            'email': email,
-            'phone': phone,
-            'address': address,
-            'date_joined': datetime.now().strftime("%Y-%m-%d"),
-            'active_borrowings': 0,
-            'total_borrowings': 0
-        }
-        
-        self.users.append(new_user)
-        self.save_data()
-        print(f"\nUser '{name}' added successfully with ID: {new_id}")
+        new_user = self.service.add_user(name, email, phone, address)
+        print(f"\nUser '{name}' added successfully with ID: {new_user['id']}")
     
     def update_user(self):
         user_id = input("Enter User ID to update: ")
-        for user in self.users:
-            if str(user.get('id')) == user_id:
-                print("\nCurrent Details:")
-                print(f"Name: {user.get('name')}")
-                print(f"Email: {user.get('email')}")
-                print(f"Phone: {user.get('phone')}")
-                print(f"Address: {user.get('address')}")
-                
-                print("\nEnter new details (press Enter to keep current):")
-                user['name'] = input(f"Name [{user.get('name')}]: ") or user.get('name')
-                user['email'] = input(f"Email [{user.get('email')}]: ") or user.get('email')
-                user['phone'] = input(f"Phone [{user.get('phone')}]: ") or user.get('phone')
-                user['address'] = input(f"Address [{user.get('address')}]: ") or user.get('address')
-                
-                print("User updated successfully!")
-                self.save_data()
-                return
+        user = self.service.get_user_by_id(user_id)
+        if not user:
+            print("User not found!")
+            return
+        
+        print("\nCurrent Details:")
+        print(f"Name: {user.get('name')}")
+        print(f"Email: {user.get('email')}")
+        print(f"Phone: {user.get('phone')}")
+        print(f"Address: {user.get('address')}")
         
-        print("User not found!")
+        print("\nEnter new details (press Enter to keep current):")
+        name = input(f"Name [{user.get('name')}]: ") or None
+        email = input(f"Email [{user.get('email')}]: ") or None
+        phone = input(f"Phone [{user.get('phone')}]: ") or None
+        address = input(f"Address [{user.get('address')}]: ") or None
+        
+        self.service.update_user(user_id, name=name, email=email, phone=phone, address=address)
+        print("User updated successfully!")
     
     def delete_user(self):
         user_id = input("Enter User ID to delete: ")
-        for i, user in enumerate(self.users):
-            if str(user.get('id')) == user_id:
-                # Check if user has active borrowings
-                if user.get('active_borrowings', 0) > 0:
-                    print("Cannot delete user with active borrowings!")
-                    return
-                
-                confirm = input(f"Delete '{user.get('name')}'? (y/n): ").lower()
-                if confirm == 'y':
-                    del self.users[i]
-                    print("User deleted successfully!")
-                    self.save_data()
-                return
+        user = self.service.get_user_by_id(user_id)
+        if not user:
+            print("User not found!")
+            return
         
-        print("User not found!")
+        # Check if user has active borrowings
+        if user.get('active_borrowings', 0) > 0:
+            print("Cannot delete user with active borrowings!")
+            return
+        
+        confirm = input(f"Delete '{user.get('name')}'? (y/n): ").lower()
+        if confirm == 'y':
+            try:
+                self.service.delete_user(user_id)
+            except LendingError as e:
+                print(e)
+                return
+            print("User deleted successfully!")
     
     def view_user_history(self):
         user_id = input("Enter User ID: ")
         
-        # Find user
-        user = None
-        for u in self.users:
-            if str(u.get('id')) == user_id:
-                user = u
-                break
-        
-        if not user:
-            print("User not found!")
+        try:
+            history = self.service.user_history(user_id)
+        except LendingError as e:
+            print(e)
             return
         
+        user = history['user']
         print(f"\nBorrowing History for {user.get('name')}")
         print("="*70)
         print(f"Active Borrowings: {user.get('active_borrowings', 0)}")
@@ -357,31 +396,33 @@ class LibraryLenderSystem:
         print("\nCurrent Borrowings:")
         print("-"*70)
         
-        has_active = False
-        for request in self.requests:
-            if (request.get('user_id') == user_id and 
-                request.get('status') == 'Active'):
-                has_active = True
-                book_id = request.get('book_id')
-                book = self.get_book_by_id(book_id)
-                if book:
-                    print(f"Book: {book.get('title')}")
-                    print(f"Borrowed on: {request.get('borrow_date')}")
-                    print(f"Due on: {request.get('due_date')}")
-                    print("-"*40)
-        
-        if not has_active:
+        for request in history['active_loans']:
+            book = self.service.get_book_by_id(request.get('book_id'))
+            if book:
+                print(f"Book: {book.get('title')}")
+                print(f"Borrowed on: {request.get('borrow_date')}")
+                print(f"Due on: {request.get('due_date')}")
+                print("-"*40)
+        
+        if not history['active_loans']:
             print("No active borrowings")
-    
-    def get_book_by_id(self, book_id):
-        for book in self.books:
-            if str(book.get('id')) == str(book_id):
-                return book
-        return None
+        
+        print("\nPast Borrowings:")
+        print("-"*70)
+        
+        for request in history['past_loans']:
+            print(f"Book: {self.service.get_book_title(request.get('book_id'))}")
+            print(f"Borrowed on: {request.get('borrow_date')}")
+            print(f"Returned on: {request.get('return_date', '')}")
+            print("-"*40)
+        
+        if not history['past_loans']:
+            print("No past borrowings")
     
     # OPTION 4: MANAGE REQUESTS
     def manage_requests(self):
         while True:
+            self.service.refresh()
             print("\n" + "="*50)
             print("MANAGE REQUESTS")
             print("="*50)
@@ -390,9 +431,11 @@ class LibraryLenderSystem:
             print("3. Return Book")
             print("4. Renew Book")
             print("5. View Overdue Books")
-            print("6. Back to Main Menu")
+            print("6. Place Hold")
+            print("7. Cancel Hold")
+            print("8. Back to Main Menu")
             
-            choice = input("\nEnter your choice (1-6): ")
+            choice = input("\nEnter your choice (1-8): ")
             
             if choice == '1':
                 self.view_all_requests()
@@ -405,37 +448,27 @@ class LibraryLenderSystem:
             elif choice == '5':
                 self.view_overdue()
             elif choice == '6':
+                self.place_hold()
+            elif choice == '7':
+                self.cancel_hold()
+            elif choice == '8':
                 break
             else:
                 print("Invalid choice!")
     
     def view_all_requests(self):
-        print("\n" + "="*100)
-        print(f"{'Req ID':<8} {'User':<15} {'Book':<25} {'Status':<12} {'Borrowed':<12} {'Due':<12}")
-        print("="*100)
-        
-        for request in self.requests:
-            user_id = request.get('user_id')
-            book_id = request.get('book_id')
-            
-            user_name = self.get_user_name(user_id)
-            book_title = self.get_book_title(book_id)
-            
-            print(f"{request.get('id', ''):<8} {user_name[:13]:<15} {book_title[:23]:<25} "
-                  f"{request.get('status', ''):<12} {request.get('borrow_date', ''):<12} "
-                  f"{request.get('due_date', ''):<12}")
-    
-    def get_user_name(self, user_id):
-        for user in self.users:
-            if str(user.get('id')) == str(user_id):
-                return user.get('name', 'Unknown')
-        return 'Unknown'
-    
-    def get_book_title(self, book_id):
-        for book in self.books:
-            if str(book.get('id')) == str(book_id):
-                return book.get('title', 'Unknown')
-        return 'Unknown'
+        status = input("Filter by status (Enter for all): ")
+        self.page_through('requests',
+                          f"{'Req ID':<8} {'User':<15} {'Book':<25} {'Status':<12} "
+                          f"{'Borrowed':<12} {'Due':<12}",
+                          100, self.format_request, status=status)
+    
+    def format_request(self, request):
+        user_name = self.service.get_user_name(request.get('user_id'))
+        book_title = self.service.get_book_title(request.get('book_id'))
+        return (f"{request.get('id', ''):<8} {user_name[:13]:<15} {book_title[:23]:<25} "
+                f"{request.get('status', ''):<12} {request.get('borrow_date', ''):<12} "
+                f"{request.get('due_date', ''):<12}")
     
     def borrow_book(self):
         print("\nBORROW BOOK")
@@ -444,69 +477,15 @@ class LibraryLenderSystem:
         user_id = input("Enter User ID: ")
         book_id = input("Enter Book ID: ")
         
-        # Check if user exists
-        user = None
-        for u in self.users:
-            if str(u.get('id')) == user_id:
-                user = u
-                break
-        
-        if not user:
-            print("User not found!")
-            return
-        
-        # Check if book exists and is available
-        book = None
-        for b in self.books:
-            if str(b.get('id')) == book_id:
-                book = b
-                break
-        
-        if not book:
-            print("Book not found!")
-            return
-        
-        if book.get('status') != 'Available':
-            print(f"Book is not available. Status: {book.get('status')}")
+        try:
+            request = self.service.borrow(user_id, book_id)
+        except LendingError as e:
+            print(e)
             return
         
-        # Check user's active borrowings
-        if user.get('active_borrowings', 0) >= 5:  # Limit to 5 books
-            print("User has reached maximum borrowing limit (5 books)")
-            return
-        
-        # Generate request ID
-        if self.requests:
-            req_id = max(int(req['id']) for req in self.requests) + 1
-        else:
-            req_id = 1
-        
-        borrow_date = datetime.now().strftime("%Y-%m-%d")
-        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")  # 2 weeks
-        
-        new_request = {
-            'id': req_id,
-            'user_id': user_id,
-            'book_id': book_id,
-            'borrow_date': borrow_date,
-            'due_date': due_date,
-            'status': 'Active',
-            'renewals': 0
-        }
-        
-        # Update book status
-        book['status'] = 'Borrowed'
-        
-        # Update user stats
-        user['active_borrowings'] = user.get('active_borrowings', 0) + 1
-        user['total_borrowings'] = user.get('total_borrowings', 0) + 1
-        
-        self.requests.append(new_request)
-        self.save_data()
-        
-        print(f"\nBook '{book.get('title')}' borrowed successfully!")
-        print(f"Due Date: {due_date}")
-        print(f"Request ID: {req_id}")
+        print(f"\nBook '{self.service.get_book_title(book_id)}' borrowed successfully!")
+        print(f"Due Date: {request['due_date']}")
+        print(f"Request ID: {request['id']}")
     
     def return_book(self):
         print("\nRETURN BOOK")
@@ -514,49 +493,52 @@ class LibraryLenderSystem:
         
         req_id = input("Enter Request ID: ")
         
-        # Find request
-        request = None
-        for req in self.requests:
-            if str(req.get('id')) == req_id and req.get('status') == 'Active':
-                request = req
-                break
-        
-        if not request:
-            print("Active request not found!")
+        try:
+            result = self.service.return_book(req_id)
+        except LendingError as e:
+            print(e)
             return
         
-        user_id = request.get('user_id')
-        book_id = request.get('book_id')
+        book_title = self.service.get_book_title(result['request'].get('book_id'))
+        print(f"\nBook '{book_title}' returned successfully!")
         
-        # Update request status
-        request['status'] = 'Returned'
-        request['return_date'] = datetime.now().strftime("%Y-%m-%d")
+        # Check for overdue
+        if result['days_overdue']:
+            print(f"Book was {result['days_overdue']} days overdue")
+            print(f"Fine amount: ${result['fine']:.2f}")
         
-        # Update book status
-        for book in self.books:
-            if str(book.get('id')) == book_id:
-                book['status'] = 'Available'
-                book_title = book.get('title')
-                break
+        # Next in the hold queue
+        hold = result['hold']
+        if hold:
+            print(f"Set aside for User {hold.get('user_id')} until {hold.get('pickup_by')}")
+    
+    def place_hold(self):
+        print("\nPLACE HOLD")
+        print("-"*30)
         
-        # Update user stats
-        for user in self.users:
-            if str(user.get('id')) == user_id:
-                user['active_borrowings'] = max(0, user.get('active_borrowings', 0) - 1)
-                break
+        user_id = input("Enter User ID: ")
+        book_id = input("Enter Book ID: ")
         
-        self.save_data()
-        print(f"\nBook '{book_title}' returned successfully!")
+        try:
+            hold = self.service.place_hold(user_id, book_id)
+        except LendingError as e:
+            print(e)
+            return
         
-        # Check for overdue
-        due_date = datetime.strptime(request.get('due_date'), "%Y-%m-%d")
-        return_date = datetime.strptime(request.get('return_date'), "%Y-%m-%d")
+        position = len(self.service.holds.waiting_holds(book_id))
+        print(f"\nHold placed on '{self.service.get_book_title(book_id)}'")
+        print(f"Hold ID: {hold['id']}")
+        print(f"Position in queue: {position}")
+    
+    def cancel_hold(self):
+        hold_id = input("Enter Hold ID: ")
+        try:
+            self.service.cancel_hold(hold_id)
+        except LendingError as e:
+            print(e)
+            return
         
-        if return_date > due_date:
-            days_overdue = (return_date - due_date).days
-            fine = days_overdue * 1.00  # $1 per day
-            print(f"Book was {days_overdue} days overdue")
-            print(f"Fine amount: ${fine:.2f}")
+        print("Hold cancelled successfully!")
     
     def renew_book(self):
         print("\nRENEW BOOK")
@@ -564,29 +546,12 @@ class LibraryLenderSystem:
         
         req_id = input("Enter Request ID: ")
         
-        # Find request
-        request = None
-        for req in self.requests:
-            if str(req.get('id')) == req_id and req.get('status') == 'Active':
-                request = req
-                break
-        
-        if not request:
-            print("Active request not found!")
-            return
-        
-        # Check renewals limit
-        if request.get('renewals', 0) >= 2:
-            print("Maximum renewals (2) reached!")
+        try:
+            request = self.service.renew(req_id)
+        except LendingError as e:
+            print(e)
             return
         
-        # Update due date
-        current_due = datetime.strptime(request.get('due_date'), "%Y-%m-%d")
-        new_due = current_due + timedelta(days=7)  # 1 week extension
-        request['due_date'] = new_due.strftime("%Y-%m-%d")
-        request['renewals'] = request.get('renewals', 0) + 1
-        
-        self.save_data()
         print(f"Book renewed successfully!")
         print(f"New due date: {request['due_date']}")
         print(f"Renewals used: {request['renewals']}")
@@ -594,34 +559,27 @@ class LibraryLenderSystem:
     def view_overdue(self):
         print("\nOVERDUE BOOKS")
         print("="*70)
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        overdue_count = 0
-        for request in self.requests:
-            if (request.get('status') == 'Active' and 
-                request.get('due_date') < today):
-                overdue_count += 1
-                
-                user_id = request.get('user_id')
-                book_id = request.get('book_id')
-                
-                user_name = self.get_user_name(user_id)
-                book_title = self.get_book_title(book_id)
-                
-                print(f"User: {user_name}")
-                print(f"Book: {book_title}")
-                print(f"Due Date: {request.get('due_date')} (OVERDUE)")
-                print(f"Request ID: {request.get('id')}")
-                print("-"*40)
         
-        if overdue_count == 0:
+        overdue = self.service.overdue_loans()
+        for request in overdue:
+            user_name = self.service.get_user_name(request.get('user_id'))
+            book_title = self.service.get_book_title(request.get('book_id'))
+            
+            print(f"User: {user_name}")
+            print(f"Book: {book_title}")
+            print(f"Due Date: {request.get('due_date')} (OVERDUE)")
+            print(f"Request ID: {request.get('id')}")
+            print("-"*40)
+        
+        if not overdue:
             print("No overdue books!")
         else:
-            print(f"\nTotal overdue books: {overdue_count}")
+            print(f"\nTotal overdue books: {len(overdue)}")
     
     # OPTION 5: GENERATE REPORTS
     def generate_reports(self):
         while True:
+            self.service.refresh()
             print("\n" + "="*50)
             print("GENERATE REPORTS")
             print("="*50)
@@ -630,9 +588,13 @@ class LibraryLenderSystem:
             print("3. User Activity Report")
             print("4. Overdue Analysis")
             print("5. Export All Data")
-            print("6. Back to Main Menu")
+            print("6. Trending Books")
+            print("7. Check Loan Counters")
+            print("8. Loan Analytics")
+            print("9. Run All Reports")
+            print("10. Back to Main Menu")
             
-            choice = input("\nEnter your choice (1-6): ")
+            choice = input("\nEnter your choice (1-10): ")
             
             if choice == '1':
                 self.library_statistics()
@@ -645,6 +607,14 @@ class LibraryLenderSystem:
             elif choice == '5':
                 self.export_all_data()
             elif choice == '6':
+                self.trending_books()
+            elif choice == '7':
+                self.check_loan_counters()
+            elif choice == '8':
+                self.loan_analytics()
+            elif choice == '9':
+                self.run_all_reports()
+            elif choice == '10':
                 break
             else:
                 print("Invalid choice!")
@@ -654,24 +624,18 @@ class LibraryLenderSystem:
         print("LIBRARY STATISTICS")
         print("="*50)
         
-        total_books = len(self.books)
-        available_books = sum(1 for book in self.books if book.get('status') == 'Available')
-        borrowed_books = sum(1 for book in self.books if book.get('status') == 'Borrowed')
-        total_users = len(self.users)
-        active_requests = sum(1 for req in self.requests if req.get('status') == 'Active')
+        counts = self.service.statistics()
+        for problem in counts['warnings']:
+            print(f"WARNING: {problem}")
         
-        print(f"Total Books: {total_books}")
-        print(f"Available Books: {available_books}")
-        print(f"Borrowed Books: {borrowed_books}")
-        print(f"Total Users: {total_users}")
-        print(f"Active Borrowings: {active_requests}")
+        print(f"Total Books: {counts['total_books']}")
+        print(f"Available Books: {counts['available_books']}")
+        print(f"Borrowed Books: {counts['borrowed_books']}")
+        print(f"Total Users: {counts['total_users']}")
+        print(f"Active Borrowings: {counts['active_requests']}")
         
         # Categories distribution
-        categories = {}
-        for book in self.books:
-            category = book.get('category', 'Uncategorized')
-            categories[category] = categories.get(category, 0) + 1
-        
+        categories = counts['categories']
         if categories:
             print("\nBooks by Category:")
             for category, count in categories.items():
@@ -682,23 +646,80 @@ class LibraryLenderSystem:
         print("MOST POPULAR BOOKS")
         print("="*50)
         
-        # Count borrowings per book
-        book_borrowings = {}
-        for request in self.requests:
-            book_id = request.get('book_id')
-            book_borrowings[book_id] = book_borrowings.get(book_id, 0) + 1
-        
-        # Sort by borrow count
-        sorted_books = sorted(book_borrowings.items(), key=lambda x: x[1], reverse=True)
-        
         print(f"{'Rank':<6} {'Book':<30} {'Borrowings':<12}")
         print("-"*50)
         
-        for i, (book_id, count) in enumerate(sorted_books[:10], 1):  # Top 10
-            book = self.get_book_by_id(book_id)
-            if book:
+        for i, (book, count) in enumerate(self.service.most_popular(10), 1):  # Top 10
+            print(f"{i:<6} {book.get('title', 'Unknown')[:28]:<30} {count:<12}")
+    
+    def trending_books(self):
+        for days in (7, 30, 365):
+            print("\n" + "="*50)
+            print(f"TRENDING BOOKS (LAST {days} DAYS)")
+            print("="*50)
+            
+            print(f"{'Rank':<6} {'Book':<30} {'Borrowings':<12}")
+            print("-"*50)
+            
+            for i, (book, count) in enumerate(self.service.most_popular(5, days=days), 1):
                 print(f"{i:<6} {book.get('title', 'Unknown')[:28]:<30} {count:<12}")
     
+    def check_loan_counters(self):
+        problems = self.service.check_loan_counters()
+        if not problems:
+            print("\nAll users' loan counters match their loans.")
+            return
+        print("\nRepaired loan counters:")
+        for problem in problems:
+            print(f"  {problem}")
+    
+    def run_all_reports(self):
+        workers = input(f"Worker processes (1-{os.cpu_count() or 1}, Enter for 1): ")
+        try:
+            workers = max(1, int(workers or 1))
+        except ValueError:
+            print("Invalid number!")
+            return
+        
+        started = time.perf_counter()
+        pack = self.service.report_pack(workers)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        json_file, text_file = write_report_pack(pack, timestamp)
+        
+        print(f"\nReports generated in {time.perf_counter() - started:.2f} seconds")
+        print(f"Written to {text_file} and {json_file}")
+    
+    def loan_analytics(self):
+        print("\n" + "="*50)
+        print("LOAN ANALYTICS")
+        print("="*50)
+        
+        report = self.service.loan_analytics()
+        print(f"Loans analysed: {report['loans']} ({report['engine']})")
+        average = report['average_loan_days']
+        if average is not None:
+            print(f"Average loan length: {average:.1f} days")
+        
+        print("\nOverdue loans:")
+        for label, loans in report['overdue_ranges'].items():
+            print(f"  {label:<12} {loans}")
+        
+        fines = sorted(report['fines_owed'].items(), key=lambda item: -item[1])[:10]
+        if fines:
+            print("\nFines owed (top 10):")
+            for user_id, fine in fines:
+                print(f"  {self.service.get_user_name(user_id)[:28]:<30} ${fine:.2f}")
+        
+        # The last six months with any loans
+        by_month = report['loans_by_category_month']
+        months = sorted({month for category, month in by_month})[-6:]
+        if months:
+            print("\nLoans per category:")
+            for (category, month), loans in sorted(by_month.items(),
+                                                   key=lambda item: (item[0][1], item[0][0])):
+                if month in months:
+                    print(f"  {month} {category[:28]:<30} {loans}")
+    
     def user_activity_report(self):
         print("\n" + "="*50)
         print("USER ACTIVITY REPORT")
@@ -707,69 +728,38 @@ class LibraryLenderSystem:
         print(f"{'User':<20} {'Active':<10} {'Total':<10}")
         print("-"*50)
         
-        for user in self.users:
-            print(f"{user.get('name', '')[:18]:<20} "
-                  f"{user.get('active_borrowings', 0):<10} "
-                  f"{user.get('total_borrowings', 0):<10}")
+        for row in self.service.user_activity():
+            print(f"{row['name'][:18]:<20} {row['active']:<10} {row['total']:<10}")
     
     def overdue_analysis(self):
         print("\n" + "="*50)
         print("OVERDUE ANALYSIS")
         print("="*50)
         
-        today = datetime.now()
-        overdue_total = 0
-        overdue_by_days = {}
-        
-        for request in self.requests:
-            if request.get('status') == 'Active':
-                due_date = datetime.strptime(request.get('due_date'), "%Y-%m-%d")
-                if due_date < today:
-                    days_overdue = (today - due_date).days
-                    overdue_total += 1
-                    overdue_by_days[days_overdue] = overdue_by_days.get(days_overdue, 0) + 1
+        analysis = self.service.overdue_analysis()
+        print(f"Total Overdue Books: {analysis['total']}")
         
-        print(f"Total Overdue Books: {overdue_total}")
-        
-        if overdue_by_days:
+        if analysis['by_days']:
             print("\nOverdue Distribution:")
-            for days, count in sorted(overdue_by_days.items()):
+            for days, count in sorted(analysis['by_days'].items()):
                 print(f"  {days} day(s) overdue: {count} book(s)")
     
     def export_all_data(self):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        since = None
+        last_export = last_export_time()
+        if last_export:
+            incremental = input(f"Only export rows changed since {last_export}? (y/n): ").lower()
+            if incremental == 'y':
+                since = last_export
+        compress = input("Compress files with gzip? (y/n): ").lower() == 'y'
         
-        # Export books
-        books_filename = f"books_export_{timestamp}.csv"
-        with open(books_filename, 'w') as f:
-            f.write("ID,Title,Author,ISBN,Category,Year,Status,Date Added\n")
-            for book in self.books:
-                f.write(f"{book.get('id')},\"{book.get('title')}\",\"{book.get('author')}\","
-                       f"{book.get('isbn')},{book.get('category')},{book.get('year')},"
-                       f"{book.get('status')},{book.get('date_added')}\n")
-        
-        # Export users
-        users_filename = f"users_export_{timestamp}.csv"
-        with open(users_filename, 'w') as f:
-            f.write("ID,Name,Email,Phone,Address,Date Joined,Active Borrowings,Total Borrowings\n")
-            for user in self.users:
-                f.write(f"{user.get('id')},\"{user.get('name')}\",{user.get('email')},"
-                       f"{user.get('phone')},\"{user.get('address')}\",{user.get('date_joined')},"
-                       f"{user.get('active_borrowings')},{user.get('total_borrowings')}\n")
-        
-        # Export requests
-        requests_filename = f"requests_export_{timestamp}.csv"
-        with open(requests_filename, 'w') as f:
-            f.write("ID,User ID,Book ID,Borrow Date,Due Date,Return Date,Status,Renewals\n")
-            for req in self.requests:
-                f.write(f"{req.get('id')},{req.get('user_id')},{req.get('book_id')},"
-                       f"{req.get('borrow_date')},{req.get('due_date')},{req.get('return_date', '')},"
-                       f"{req.get('status')},{req.get('renewals', 0)}\n")
+        # The three tables are written side by side
+        results = self.service.export_all(compress=compress, since=since)
         
         print(f"\nData exported successfully!")
-        print(f"Books: {books_filename}")
-        print(f"Users: {users_filename}")
-        print(f"Requests: {requests_filename}")
+        print(f"Books: {results['books'][0]} ({results['books'][1]} rows)")
+        print(f"Users: {results['users'][0]} ({results['users'][1]} rows)")
+        print(f"Requests: {results['requests'][0]} ({results['requests'][1]} rows)")
 
 
 # Main program
@@ -852,6 +842,9 @@ if __name__ == "__main__":
         with open("requests.json", 'w') as f:
             json.dump(sample_requests, f, indent=2)
     
-    # Run the system
-    system = LibraryLenderSystem()
+    # Run the system (LIBRARY_BACKEND=sqlite keeps the data in library.db)
+    system = LibraryLenderSystem(os.environ.get('LIBRARY_BACKEND', 'json'),
+                                 verify_stats=os.environ.get('LIBRARY_VERIFY_STATS') == '1',
+                                 show_timings=os.environ.get('LIBRARY_TIMINGS') == '1',
+                                 metrics_file=os.environ.get('LIBRARY_METRICS'))
     system.run()
\ No newline at end of file
@@ -0,0 +1,141 @@
+import json
+import time
+from functools import wraps
+
+# Upper bounds (seconds) of the latency histogram buckets; the last is +Inf
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+COUNTER_HELP = {
+    'records_scanned': "Records looked at by each operation",
+    'bytes_written': "Bytes written to storage by each operation"
+}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds):
+        for position, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[position] += 1
+                break
+        self.count += 1
+        self.total += seconds
+
+    def cumulative(self):
+        # (upper bound, observations at or below it), as Prometheus expects
+        running = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            running += count
+            yield bound, running
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        for bound, running in self.cumulative():
+            if running >= q * self.count:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+
+# Opt-in counters for LibraryService: pass LibraryService(metrics=Metrics())
+class Metrics:
+    def __init__(self):
+        self.latency = {}    # operation -> Histogram
+        self.counters = {name: {} for name in COUNTER_HELP}  # name -> {operation: total}
+
+    def observe(self, operation, seconds, failed=False):
+        histogram = self.latency.get(operation)
+        if histogram is None:
+            histogram = self.latency[operation] = Histogram()
+        histogram.observe(seconds)
+        if failed:
+            histogram.errors += 1
+
+    def add(self, name, operation, amount):
+        counter = self.counters[name]
+        counter[operation] = counter.get(operation, 0) + amount
+
+    def to_json(self):
+        operations = {}
+        for operation, histogram in sorted(self.latency.items()):
+            operations[operation] = {
+                'count': histogram.count,
+                'errors': histogram.errors,
+                'total_seconds': histogram.total,
+                'mean_seconds': histogram.total / histogram.count,
+                'p50_seconds': bound_value(histogram.quantile(0.5)),
+                'p95_seconds': bound_value(histogram.quantile(0.95)),
+                'p99_seconds': bound_value(histogram.quantile(0.99)),
+                'buckets': {bound_label(bound): running
+                            for bound, running in histogram.cumulative()}
+            }
+        return {'operations': operations,
+                **{name: dict(sorted(counter.items())) for name, counter in self.counters.items()}}
+
+    def to_prometheus(self):
+        lines = ["# HELP library_operation_seconds Time spent in each library operation",
+                 "# TYPE library_operation_seconds histogram"]
+        for operation, histogram in sorted(self.latency.items()):
+            for bound, running in histogram.cumulative():
+                lines.append(f'library_operation_seconds_bucket{{operation="{operation}",'
+                             f'le="{bound_label(bound)}"}} {running}')
+            lines.append(f'library_operation_seconds_sum{{operation="{operation}"}} '
+                         f'{histogram.total}')
+            lines.append(f'library_operation_seconds_count{{operation="{operation}"}} '
+                         f'{histogram.count}')
+
+        lines += ["# HELP library_operation_errors_total Operations that raised an error",
+                  "# TYPE library_operation_errors_total counter"]
+        for operation, histogram in sorted(self.latency.items()):
+            lines.append(f'library_operation_errors_total{{operation="{operation}"}} '
+                         f'{histogram.errors}')
+
+        for name, help_text in COUNTER_HELP.items():
+            lines += [f"# HELP library_{name}_total {help_text}",
+                      f"# TYPE library_{name}_total counter"]
+            for operation, total in sorted(self.counters[name].items()):
+                lines.append(f'library_{name}_total{{operation="{operation}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        # Prometheus text for .prom/.txt files, JSON otherwise
+        with open(path, 'w') as f:
+            if path.endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), f, indent=2)
+
+
+def bound_label(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def bound_value(bound):
+    # JSON has no infinity
+    return None if bound == float('inf') else bound
+
+
+def measured(operation):
+    # Times a LibraryService method when the service has metrics turned on
+    def decorate(method):
+        @wraps(method)
+        def timed_method(self, *args, **kwargs):
+            if self.metrics is None:
+                return method(self, *args, **kwargs)
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = method(self, *args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.metrics.observe(operation, time.perf_counter() - started, failed)
+        return timed_method
+    return decorate
@@ -0,0 +1,261 @@
+import sys
+from datetime import date
+
+# Compact in-memory records. Each one behaves like the dict it was loaded
+# from (get, [], in, items, update) and converts back to exactly that dict
+# with to_dict(), but keeps its fields in __slots__:
+#   - ids and id references as ints (references still read back as strings,
+#     the way borrow_book has always stored them)
+#   - dates as day ordinals and timestamps as seconds
+#   - status and category strings interned, so all books share one copy
+# A value that doesn't fit its compact form (an id like "B-7", a date like
+# "unknown") is kept unchanged in `extra`, as is any field we don't know.
+
+MISSING = object()
+
+
+def decode_id(value):
+    if type(value) is not int:
+        raise ValueError(value)
+    return value
+
+
+def decode_ref(value):
+    # Only canonical digit strings, so str(int(value)) gives the same text back
+    if type(value) is not str or not value.isdigit() or str(int(value)) != value:
+        raise ValueError(value)
+    return int(value)
+
+
+def decode_text(value):
+    if type(value) is not str:
+        raise ValueError(value)
+    return value
+
+
+def decode_interned(value):
+    return sys.intern(decode_text(value))
+
+
+def decode_date(value):
+    # Few distinct dates, many records: remember each one's ordinal
+    ordinal = DATE_ORDINALS.get(value)
+    if ordinal is None:
+        if (type(value) is not str or len(value) != 10 or value[4] != '-' or value[7] != '-'
+                or not (value[:4] + value[5:7] + value[8:]).isdigit()):
+            raise ValueError(value)
+        ordinal = date(int(value[:4]), int(value[5:7]), int(value[8:])).toordinal()
+        DATE_ORDINALS[value] = ordinal
+    return ordinal
+
+
+def decode_stamp(value):
+    # "YYYY-MM-DD HH:MM:SS" -> seconds since day 1 of the ordinal calendar
+    if (type(value) is not str or len(value) != 19 or value[10] != ' '
+            or value[13] != ':' or value[16] != ':'):
+        raise ValueError(value)
+    hours, minutes, seconds = value[11:13], value[14:16], value[17:]
+    if (not (hours + minutes + seconds).isdigit() or hours > '23'
+            or minutes > '59' or seconds > '59'):
+        raise ValueError(value)
+    return (decode_date(value[:10]) * 86400 + int(hours) * 3600
+            + int(minutes) * 60 + int(seconds))
+
+
+def encode_ref(value):
+    return str(value)
+
+
+def encode_date(value):
+    return date.fromordinal(value).isoformat()
+
+
+def encode_stamp(value):
+    days, seconds = divmod(value, 86400)
+    return (f"{encode_date(days)} {seconds // 3600:02d}:"
+            f"{seconds // 60 % 60:02d}:{seconds % 60:02d}")
+
+
+DATE_ORDINALS = {}
+
+DECODERS = {
+    'id': decode_id,
+    'int': decode_id,
+    'ref': decode_ref,
+    'text': decode_text,
+    'interned': decode_interned,
+    'date': decode_date,
+    'stamp': decode_stamp
+}
+
+ENCODERS = {
+    'ref': encode_ref,
+    'date': encode_date,
+    'stamp': encode_stamp
+}
+
+
+class Record:
+    __slots__ = ('extra',)
+    KINDS = {}  # field -> kind, in the field order of the JSON schema
+
+    def __init__(self):
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, values):
+        record = cls()
+        decoders = cls.DECODERS
+        for key, value in values.items():
+            decoder = decoders.get(key)
+            if decoder is not None:
+                try:
+                    setattr(record, key, decoder(value))
+                    continue
+                except (TypeError, ValueError):
+                    pass
+            if record.extra is None:
+                record.extra = {}
+            record.extra[key] = value
+        return record
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def get(self, key, default=None):
+        kind = self.KINDS.get(key)
+        if kind is not None:
+            value = getattr(self, key, MISSING)
+            if value is not MISSING:
+                encoder = ENCODERS.get(kind)
+                return encoder(value) if encoder else value
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        return default
+
+    def ordinal(self, key):
+        # Day ordinal of a date field without going through the string
+        value = getattr(self, key, MISSING)
+        if value is MISSING:
+            return decode_date(self.get(key))
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        kind = self.KINDS.get(key)
+        if kind is not None:
+            try:
+                stored = self.DECODERS[key](value)
+            except (TypeError, ValueError):
+                # Keep values that don't fit the compact form as they are
+                if hasattr(self, key):
+                    delattr(self, key)
+            else:
+                setattr(self, key, stored)
+                if self.extra is not None and key in self.extra:
+                    del self.extra[key]
+                return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def keys(self):
+        return [key for key, value in self.items()]
+
+    def items(self):
+        items = []
+        for key, kind in self.KINDS.items():
+            value = getattr(self, key, MISSING)
+            if value is not MISSING:
+                encoder = ENCODERS.get(kind)
+                items.append((key, encoder(value) if encoder else value))
+        if self.extra:
+            items.extend(self.extra.items())
+        return items
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def clear(self):
+        for key in self.KINDS:
+            if hasattr(self, key):
+                delattr(self, key)
+        self.extra = None
+
+    # Pickle (the snapshot cache) as a plain tuple of field values, with
+    # None for unset fields; a stored field is never None
+    def __getstate__(self):
+        return tuple(getattr(self, key, None) for key in self.KINDS) + (self.extra,)
+
+    def __setstate__(self, state):
+        self.extra = state[-1]
+        for key, value in zip(self.KINDS, state):
+            if value is not None:
+                setattr(self, key, value)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Book(Record):
+    KINDS = {
+        'id': 'id', 'title': 'text', 'author': 'text', 'isbn': 'text',
+        'category': 'interned', 'year': 'interned', 'status': 'interned',
+        'date_added': 'date', 'last_modified': 'stamp', 'version': 'int'
+    }
+    __slots__ = tuple(KINDS)
+    DECODERS = {key: DECODERS[kind] for key, kind in KINDS.items()}
+
+
+class User(Record):
+    KINDS = {
+        'id': 'id', 'name': 'text', 'email': 'text', 'phone': 'text', 'address': 'text',
+        'date_joined': 'date', 'active_borrowings': 'int', 'total_borrowings': 'int',
+        'last_modified': 'stamp', 'version': 'int'
+    }
+    __slots__ = tuple(KINDS)
+    DECODERS = {key: DECODERS[kind] for key, kind in KINDS.items()}
+
+
+class Request(Record):
+    KINDS = {
+        'id': 'id', 'user_id': 'ref', 'book_id': 'ref', 'borrow_date': 'date',
+        'due_date': 'date', 'status': 'interned', 'renewals': 'int',
+        'return_date': 'date', 'barcode': 'text', 'last_modified': 'stamp', 'version': 'int'
+    }
+    __slots__ = tuple(KINDS)
+    DECODERS = {key: DECODERS[kind] for key, kind in KINDS.items()}
+
+
+class Hold(Record):
+    KINDS = {
+        'id': 'id', 'user_id': 'ref', 'book_id': 'ref', 'status': 'interned',
+        'hold_date': 'date', 'barcode': 'text', 'pickup_by': 'date',
+        'last_modified': 'stamp', 'version': 'int'
+    }
+    __slots__ = tuple(KINDS)
+    DECODERS = {key: DECODERS[kind] for key, kind in KINDS.items()}
+
+
+RECORD_TYPES = {
+    'books': Book,
+    'users': User,
+    'requests': Request,
+    'holds': Hold
+}
+
+
+def encode_record(value):
+    # json.dump(default=...) hook
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,121 @@
+import heapq
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from library_index import field_ordinal, sort_key
+from library_storage import JSONStorage, SQLiteStorage
+
+# The monthly management pack: statistics, most popular books, user
+# activity and overdue analysis. The loan figures come from one pass over
+# every loan. The pass only builds tallies, which add up, so the archive
+# months can be shared out to worker processes and their tallies merged
+# afterwards.
+
+
+def new_tally():
+    return {
+        'borrows': {},          # book id -> loans
+        'overdue_by_days': {}   # days overdue -> active loans, due today counting as 0
+    }
+
+
+def tally_loans(tally, requests, today, skip=()):
+    borrows, overdue = tally['borrows'], tally['overdue_by_days']
+    for request in requests:
+        if skip and str(request.get('id')) in skip:
+            continue
+        book_id = request.get('book_id')
+        borrows[book_id] = borrows.get(book_id, 0) + 1
+        if request.get('status') != 'Active':
+            continue
+        try:
+            days = today - field_ordinal(request, 'due_date')
+        except (TypeError, ValueError):
+            continue
+        if days >= 0:
+            overdue[days] = overdue.get(days, 0) + 1
+    return tally
+
+
+def tally_archive(backend, months, today, skip):
+    # Runs in a worker process: reads its archive months straight from the
+    # storage, leaving out the loans the parent counts itself
+    storage = SQLiteStorage() if backend == 'sqlite' else JSONStorage()
+    tally = new_tally()
+    try:
+        for month in months:
+            tally_loans(tally, storage.load_archive(month), today, skip)
+    finally:
+        storage.close()
+    return tally
+
+
+def tally_sharded(backend, months, today, skip, workers):
+    # One shard of months per worker, dealt round robin so busy months spread out
+    shards = [months[start::workers] for start in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(tally_archive, [backend] * workers, shards,
+                             [today] * workers, [skip] * workers))
+
+
+def merge_tallies(tally, others):
+    for other in others:
+        for name, counts in other.items():
+            merged = tally[name]
+            for key, count in counts.items():
+                merged[key] = merged.get(key, 0) + count
+    return tally
+
+
+def top_borrowed(borrows, limit):
+    # [(book id, loans)], most borrowed first, ties by id
+    return heapq.nsmallest(limit, borrows.items(),
+                           key=lambda item: (-item[1], sort_key(str(item[0]))))
+
+
+def format_report_pack(pack):
+    # The pack as text, laid out like the report screens
+    lines = [f"LIBRARY REPORTS - {pack['generated']}", ""]
+
+    counts = pack['statistics']
+    lines += ["="*50, "LIBRARY STATISTICS", "="*50,
+              f"Total Books: {counts['total_books']}",
+              f"Available Books: {counts['available_books']}",
+              f"Borrowed Books: {counts['borrowed_books']}",
+              f"Total Users: {counts['total_users']}",
+              f"Active Borrowings: {counts['active_requests']}"]
+    if counts['categories']:
+        lines.append("")
+        lines.append("Books by Category:")
+        lines += [f"  {category}: {count}" for category, count in counts['categories'].items()]
+
+    lines += ["", "="*50, "MOST POPULAR BOOKS", "="*50,
+              f"{'Rank':<6} {'Book':<30} {'Borrowings':<12}", "-"*50]
+    for rank, row in enumerate(pack['most_popular'], 1):
+        lines.append(f"{rank:<6} {row['title'][:28]:<30} {row['borrowings']:<12}")
+
+    lines += ["", "="*50, "USER ACTIVITY REPORT", "="*50,
+              f"{'User':<20} {'Active':<10} {'Total':<10}", "-"*50]
+    for row in pack['user_activity']:
+        lines.append(f"{row['name'][:18]:<20} {row['active']:<10} {row['total']:<10}")
+
+    overdue = pack['overdue']
+    lines += ["", "="*50, "OVERDUE ANALYSIS", "="*50,
+              f"Total Overdue Books: {overdue['total']}"]
+    if overdue['by_days']:
+        lines.append("")
+        lines.append("Overdue Distribution:")
+        lines += [f"  {days} day(s) overdue: {count} book(s)"
+                  for days, count in sorted(overdue['by_days'].items())]
+    return "\n".join(lines) + "\n"
+
+
+def write_report_pack(pack, timestamp, directory='.'):
+    # Writes the pack as JSON and as text; returns the two paths
+    base = os.path.join(directory, f"report_pack_{timestamp}")
+    with open(base + ".json", 'w') as f:
+        json.dump(pack, f, indent=2)
+    with open(base + ".txt", 'w') as f:
+        f.write(format_report_pack(pack))
+    return base + ".json", base + ".txt"
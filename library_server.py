@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs, urlsplit
+
+from library_metrics import Metrics
+from library_records import encode_record
+from library_service import LendingError, LibraryService
+
+MAX_BODY = 1024 * 1024
+REFRESH_INTERVAL = 1.0  # seconds between checks for changes saved by other processes
+MAX_BATCH = 64          # queued writes applied under one group commit
+
+log = logging.getLogger('library_server')
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 409: 'Conflict', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Local HTTP/JSON front end over one warm LibraryService. Reads are answered
+# straight from memory by each connection; writes are queued and applied one
+# at a time by a single writer task, a batch of them per group commit.
+class LibraryServer:
+    def __init__(self, service, host='127.0.0.1', port=8080):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.writes = None
+        self.server = None
+        self.writer_task = None
+
+        self.routes = {
+            ('GET', '/search'): self.search,
+            ('GET', '/overdue'): self.overdue,
+            ('GET', '/statistics'): self.statistics,
+            ('GET', '/metrics'): self.metrics,
+            ('POST', '/borrow'): self.borrow,
+            ('POST', '/return'): self.return_book,
+            ('POST', '/renew'): self.renew,
+            ('POST', '/hold'): self.place_hold,
+            ('POST', '/cancel_hold'): self.cancel_hold
+        }
+
+    async def start(self):
+        self.writes = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self.apply_writes())
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.writer_task.cancel()
+        try:
+            await self.writer_task
+        except asyncio.CancelledError:
+            pass
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    # Writer
+    async def apply_writes(self):
+        while True:
+            try:
+                batch = [await asyncio.wait_for(self.writes.get(), REFRESH_INTERVAL)]
+            except asyncio.TimeoutError:
+                self.service.refresh()
+                continue
+            # Writes that queued up meanwhile share one group commit, so one
+            # fsync covers them all; nobody gets an answer before it is done
+            while len(batch) < MAX_BATCH and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            outcomes = []
+            try:
+                with self.service.group_commit():
+                    for operation, args, future in batch:
+                        try:
+                            outcomes.append((future, operation(*args), None))
+                        except Exception as e:
+                            outcomes.append((future, None, e))
+            except Exception as e:
+                outcomes = [(future, None, e) for operation, args, future in batch]
+            for future, result, error in outcomes:
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    async def write(self, operation, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((operation, args, future))
+        return await future
+
+    # Handlers: (query params, JSON body) -> JSON-able result
+    async def search(self, params, body):
+        query = params.get('q', '')
+        limit = int(params.get('limit', 20))
+        return {'results': self.service.search(query, limit)}
+
+    async def overdue(self, params, body):
+        return {'overdue': self.service.overdue_loans()}
+
+    async def statistics(self, params, body):
+        return self.service.statistics()
+
+    async def metrics(self, params, body):
+        if self.service.metrics is None:
+            raise HTTPError(404, "Metrics are off; start the server with --metrics")
+        return self.service.metrics.to_json()
+
+    async def borrow(self, params, body):
+        user_id = require(body, 'user_id')
+        book_id = require(body, 'book_id')
+        return await self.write(self.service.borrow, user_id, book_id,
+                                body.get('expected_version'))
+
+    async def return_book(self, params, body):
+        return await self.write(self.service.return_book, require(body, 'request_id'))
+
+    async def renew(self, params, body):
+        return await self.write(self.service.renew, require(body, 'request_id'))
+
+    async def place_hold(self, params, body):
+        user_id = require(body, 'user_id')
+        book_id = require(body, 'book_id')
+        return await self.write(self.service.place_hold, user_id, book_id)
+
+    async def cancel_hold(self, params, body):
+        return await self.write(self.service.cancel_hold, require(body, 'hold_id'))
+
+    # HTTP plumbing
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'Malformed request line'}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # Without a length we can trust there is no telling where the body ends
+                    await self.respond(writer, 400, {'error': 'Invalid Content-Length'}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 400, {'error': 'Request body too large'}, False)
+                    break
+                raw_body = await reader.readexactly(length) if length else b""
+
+                keep_alive = (version == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                status, payload = await self.dispatch(method, target, raw_body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, raw_body):
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                return 405, {'error': f"{method} not allowed on {url.path}"}
+            return 404, {'error': f"No such endpoint: {url.path}"}
+
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+            if not isinstance(body, dict):
+                raise HTTPError(400, "Request body must be a JSON object")
+            return 200, await handler(params, body)
+        except ValueError as e:
+            return 400, {'error': f"Bad request: {e}"}
+        except HTTPError as e:
+            return e.status, {'error': str(e)}
+        except LendingError as e:
+            return 409, {'error': str(e)}
+        except Exception:
+            # A bug, not a bad request: keep serving, and keep the details in the log
+            log.exception("%s %s failed", method, target)
+            return 500, {'error': "Internal server error"}
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, default=encode_record).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+def require(body, field):
+    if field not in body:
+        raise HTTPError(400, f"Missing field: {field}")
+    return body[field]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the lending operations over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--backend', default='json', choices=('json', 'sqlite'))
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="record operation metrics and write them here on shutdown "
+                             "(Prometheus text for .prom, JSON otherwise)")
+    args = parser.parse_args()
+
+    metrics = Metrics() if args.metrics else None
+    server = LibraryServer(LibraryService(args.backend, metrics=metrics), args.host, args.port)
+    print(f"Library server listening on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.service.close()
+        if metrics:
+            metrics.dump(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
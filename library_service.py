@@ -0,0 +1,1213 @@
+import time
+from contextlib import contextmanager
+from itertools import islice
+from datetime import date, datetime, timedelta
+
+from library_analytics import LoanColumns, engine, overdue_ranges
+from library_export import export_tables, save_export_time
+from library_import import clean_row, read_rows
+from library_index import (BookLoanIndex, CopyPool, DueDateIndex, HoldQueue, LibraryStats, Listing,
+                           PopularityIndex, SearchIndex, UserLoanIndex, book_copies, copy_barcode,
+                           field_ordinal, sort_key)
+from library_metrics import measured
+from library_reports import merge_tallies, new_tally, tally_loans, tally_sharded, top_borrowed
+from library_records import RECORD_TYPES, Book, Hold, Request, User
+from library_storage import TABLES, RequestArchive, open_storage
+
+
+FINE_PER_DAY = 1.00  # dollars per day overdue
+
+
+class LendingError(Exception):
+    # A request the library rules refuse (unknown id, book not available, ...)
+    pass
+
+
+# All library operations without any input()/print(); the menus in
+# library_lender.py, scripts and benchmarks all drive this class
+class LibraryService:
+    def __init__(self, backend='json', verify_stats=False, metrics=None):
+        started = time.perf_counter()
+        self.backend = backend
+        self.storage = open_storage(backend)
+        self.pending_changes = []
+        self.verify_stats = verify_stats  # recount on every statistics call
+        self.metrics = metrics            # a library_metrics.Metrics to record into, if any
+        self.load_times = {}  # seconds each table took to load and index
+        self.load_data()
+        self.startup_time = time.perf_counter() - started
+
+    def load_data(self):
+        # Tables are only read the first time something needs them
+        self.storage.open()
+        self.tables = {}
+        self.id_indexes = {}
+        self.next_ids = {}
+        self.search_index = None             # full-text index, built by the first search
+        self.stats = LibraryStats()          # running totals for statistics
+        self.due_index = DueDateIndex()      # active loans by due date for the overdue reports
+        self.popularity = None               # borrow counts per book, built by the first ranking
+        self.loan_columns = None             # every loan as columns, built by the first analytics report
+        self.listings = {}                   # table -> ids in order, built when it is first paged through
+        self.archive = RequestArchive(self.storage)  # closed loans, read by month on demand
+        self.copies = CopyPool()             # each title's free copies
+        # Filled in as their tables load; read them through user_loans,
+        # book_loans and holds, which load the table first
+        self.user_loan_index = UserLoanIndex()  # each user's active (and past) loans
+        self.book_loan_index = BookLoanIndex()  # each book's active loans
+        self.hold_queue = HoldQueue()           # open holds, queued per book
+
+    def table(self, table):
+        records = self.tables.get(table)
+        if records is None:
+            started = time.perf_counter()
+            records = self.storage.load_table(table)
+            while records is None:
+                # Another process replaced the snapshots; start over from them
+                self.load_data()
+                records = self.storage.load_table(table)
+
+            # Next id to hand out, never one an archived record already has
+            self.next_ids[table] = max(max((int(record['id']) for record in records), default=0) + 1,
+                                       self.storage.id_floor(table))
+            if table == 'requests':
+                # Only active loans stay in memory
+                records = self.archive.take_closed(records)
+
+            self.tables[table] = records
+            self.build_indexes(table, records)
+            self.load_times[table] = time.perf_counter() - started
+        return records
+
+    def build_indexes(self, table, records):
+        # Id-keyed lookups so we don't scan the lists on every operation
+        self.id_indexes[table] = {str(record.get('id')): record for record in records}
+
+        if table == 'books':
+            for book in records:
+                self.stats.add_book(book)
+            self.copies.build(records)
+        elif table == 'requests':
+            for request in records:
+                self.stats.add_request(request)
+            self.due_index.build(records)
+            self.user_loans.build(records)
+            self.book_loans.build(records)
+        elif table == 'holds':
+            self.holds.build(records)
+
+    @property
+    def books(self):
+        return self.table('books')
+
+    @property
+    def users(self):
+        return self.table('users')
+
+    @property
+    def requests(self):
+        # The active loans; all_requests() adds the archived ones
+        return self.table('requests')
+
+    @property
+    def hold_index(self):
+        return self.table_index('holds')
+
+    @property
+    def user_loans(self):
+        self.table('requests')
+        return self.user_loan_index
+
+    @property
+    def book_loans(self):
+        self.table('requests')
+        return self.book_loan_index
+
+    @property
+    def holds(self):
+        self.table('holds')
+        return self.hold_queue
+
+    @property
+    def book_index(self):
+        return self.table_index('books')
+
+    @property
+    def user_index(self):
+        return self.table_index('users')
+
+    @property
+    def request_index(self):
+        return self.table_index('requests')
+
+    def new_id(self, table):
+        self.table(table)
+        new_id = self.next_ids[table]
+        self.next_ids[table] = new_id + 1
+        return new_id
+
+    def index_book(self, book):
+        if self.search_index is not None:
+            self.search_index.add(book)
+        self.stats.add_book(book)
+        self.copies.add(book)
+
+    def unindex_book(self, book):
+        if self.search_index is not None:
+            self.search_index.remove(book.get('id'))
+        self.stats.remove_book(book)
+        self.copies.remove(book)
+
+    def index_request(self, request):
+        self.stats.add_request(request)
+        self.due_index.add(request)
+        self.user_loans.add(request)
+        self.book_loans.add(request)
+        if self.loan_columns is not None:
+            self.loan_columns.put(request)
+
+    def unindex_request(self, request):
+        self.stats.remove_request(request)
+        self.due_index.remove(request)
+        self.user_loans.remove(request)
+        self.book_loans.remove(request)
+
+    def archive_loan(self, request):
+        self.archive.add(request)
+        self.user_loans.add_closed(request)
+        if self.loan_columns is not None:
+            self.loan_columns.put(request)
+
+    def record_change(self, table, record):
+        # The timestamp lets incremental exports pick up only changed rows,
+        # the version lets other sessions notice the record moved on
+        record['last_modified'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        record['version'] = record.get('version', 0) + 1
+        self.pending_changes.append(('put', table, record))
+        self.list_record(table, record)
+
+    def record_delete(self, table, record_id):
+        self.pending_changes.append(('delete', table, str(record_id)))
+        self.unlist_record(table, record_id)
+
+    def list_record(self, table, record):
+        listing = self.listings.get(table)
+        if listing is not None:
+            listing.put(record)
+
+    def unlist_record(self, table, record_id):
+        listing = self.listings.get(table)
+        if listing is not None:
+            listing.remove(record_id)
+
+    @contextmanager
+    def transaction(self):
+        # Hold the storage lock, catch up with other processes, apply, save.
+        # A refusal raised before anything changed leaves nothing to undo;
+        # otherwise a failed operation is rolled back, so no later
+        # transaction saves its changes.
+        with self.storage.lock():
+            self.refresh()
+            try:
+                yield
+            except LendingError:
+                if self.pending_changes:
+                    self.rollback()
+                raise
+            except Exception:
+                self.rollback()
+                raise
+            self.save_data()
+
+    def rollback(self):
+        # Forget the unsaved changes by reading everything back from storage
+        self.pending_changes = []
+        self.load_data()
+
+    @contextmanager
+    def group_commit(self):
+        # Transactions inside the block reach the disk together when it ends,
+        # one flush for the lot; nothing they did should be reported as saved
+        # before then. The lock is held throughout, as SQLite keeps one
+        # database transaction open for the group.
+        with self.storage.lock(), self.storage.group_commit():
+            yield
+
+    def refresh(self):
+        # Apply whatever other processes saved since we last looked
+        with self.storage.lock():
+            changes = self.storage.changes_since_load()
+            if changes is None:
+                self.load_data()
+            elif changes:
+                self.apply_changes(changes)
+
+    def apply_changes(self, changes):
+        for op, table, item in changes:
+            if table not in self.tables:
+                continue  # picked up when the table is first loaded
+            index = self.table_index(table)
+            if op == 'put':
+                record_id = str(item.get('id'))
+                existing = index.get(record_id)
+                self.next_ids[table] = max(self.next_ids[table], int(record_id) + 1)
+                if table == 'requests' and item.get('status') != 'Active':
+                    self.apply_closed_loan(item, existing)
+                    continue
+                if existing is None:
+                    existing = RECORD_TYPES[table]()
+                    index[record_id] = existing
+                    self.tables[table].append(existing)
+                    if table == 'requests' and self.popularity is not None:
+                        self.popularity.add(item)
+                else:
+                    self.unindex_record(table, existing)
+                # Update in place so the list keeps its order and references stay valid
+                existing.clear()
+                existing.update(item)
+                self.index_record(table, existing)
+                self.list_record(table, existing)
+            else:
+                existing = index.pop(str(item), None)
+                if existing is not None:
+                    self.unindex_record(table, existing)
+                    self.tables[table].remove(existing)
+                elif table == 'requests':
+                    existing = self.archive.discard(str(item))
+                    self.user_loans.remove_closed(str(item))
+                if table == 'requests' and existing is not None and self.popularity is not None:
+                    self.popularity.remove(existing)
+                if table == 'requests' and self.loan_columns is not None:
+                    self.loan_columns.discard(str(item))
+                self.unlist_record(table, item)
+
+    def apply_closed_loan(self, item, existing):
+        # A loan another process closed moves from the active set to the archive
+        if existing is not None:
+            self.unindex_request(existing)
+            del self.request_index[str(existing.get('id'))]
+            self.requests.remove(existing)
+            existing.clear()
+            existing.update(item)
+        else:
+            # Never seen active here: it may or may not be in the counts already
+            existing = RECORD_TYPES['requests'].from_dict(item)
+            self.popularity = None
+        self.archive_loan(existing)
+        self.list_record('requests', existing)
+
+    def table_index(self, table):
+        self.table(table)
+        return self.id_indexes[table]
+
+    def index_record(self, table, record):
+        if table == 'books':
+            self.index_book(record)
+        elif table == 'requests':
+            self.index_request(record)
+        elif table == 'holds':
+            self.holds.add(record)
+
+    def unindex_record(self, table, record):
+        if table == 'books':
+            self.unindex_book(record)
+        elif table == 'requests':
+            self.unindex_request(record)
+        elif table == 'holds':
+            self.holds.remove(record)
+
+    @measured('save_data')
+    def save_data(self):
+        # Write only what changed since the last save
+        if self.pending_changes:
+            written = self.storage.write(self.pending_changes)
+            self.count('bytes_written', 'save_data', written)
+            self.pending_changes = []
+            if not self.storage.archives_on_compact:
+                self.archive.clear_pending()
+
+        if self.storage.needs_compaction():
+            self.compact_data()
+
+    @measured('compact_data')
+    def compact_data(self):
+        with self.storage.lock():
+            tables = self.table_data()
+            written = self.storage.compact(tables, list(self.archive.pending.values()))
+            self.archive.clear_pending()
+        self.count('bytes_written', 'compact_data', written)
+        self.pending_changes = []
+
+    def count(self, name, operation, amount):
+        # Add to a metrics counter (records_scanned, bytes_written) when metrics are on
+        if self.metrics is not None:
+            self.metrics.add(name, operation, amount)
+
+    def close(self):
+        with self.transaction():
+            self.storage.checkpoint(self.compact_data)
+        self.storage.close()
+
+    def table_data(self):
+        # Books, users, the active loans and the open holds
+        return {table: self.table(table) for table in TABLES}
+
+    def listing(self, table):
+        listing = self.listings.get(table)
+        if listing is None:
+            if table == 'requests':
+                # Every loan, archived ones included
+                self.table('requests')
+                records = {str(request.get('id')): request for request in self.requests}
+                records.update((str(request.get('id')), request)
+                               for request in self.archive.records())
+            else:
+                records = self.table_index(table)
+            listing = self.listings[table] = Listing(records)
+        return listing
+
+    @measured('page')
+    def page(self, table, size=20, after=None, before=None, number=None, **filters):
+        # One page of a table in id order. `after`/`before` are cursors (the
+        # last id of the page before, the first id of the page after) and
+        # `number` jumps straight to page N. Filters like status='Active'
+        # keep only the matching records. Records are read one by one and
+        # stop as soon as the page is full. Returns the records, the cursors
+        # for the next and previous pages (None at either end) and, unless
+        # filtered, the total count.
+        filters = {field: str(value).lower() for field, value in filters.items() if value}
+        if self.backend == 'sqlite':
+            # Read a page at a time through the primary key; no table is loaded
+            rows, more, earlier, total = self.storage.page(table, size, after, before, number,
+                                                           filters)
+            self.count('records_scanned', 'page', len(rows))
+            return {'records': rows,
+                    'next': str(rows[-1].get('id')) if more else None,
+                    'prev': str(rows[0].get('id')) if earlier else None,
+                    'total': total}
+
+        listing = self.listing(table)
+
+        def matching(records):
+            for record in records:
+                if all(str(record.get(field, '')).lower() == value
+                       for field, value in filters.items()):
+                    yield record
+
+        if before is not None:
+            rows = list(islice(matching(listing.backward(listing.before(before))), size))
+            rows.reverse()
+        elif number is not None:
+            if filters:
+                # No index per filter: skip the earlier matches without keeping them
+                records = islice(matching(listing.forward(0)), (max(number, 1) - 1) * size, None)
+            else:
+                records = listing.forward((max(number, 1) - 1) * size)
+            rows = list(islice(records, size))
+        else:
+            start = listing.after(after) if after is not None else 0
+            rows = list(islice(matching(listing.forward(start)), size))
+
+        result = {'records': rows, 'next': None, 'prev': None,
+                  'total': None if filters else len(listing)}
+        if rows:
+            first, last = rows[0].get('id'), rows[-1].get('id')
+            if next(matching(listing.forward(listing.after(last))), None) is not None:
+                result['next'] = str(last)
+            if next(matching(listing.backward(listing.before(first))), None) is not None:
+                result['prev'] = str(first)
+        self.count('records_scanned', 'page', len(rows))
+        return result
+
+    def all_requests(self):
+        # Every loan, archived ones included, in id order
+        self.table('requests')
+        requests = list(self.requests) + list(self.archive.records())
+        requests.sort(key=lambda request: sort_key(str(request.get('id'))))
+        return requests
+
+    # Lookups. Changes go through the id indexes; these are for reading.
+    def lookup(self, table, record_id):
+        if self.backend == 'sqlite' and table not in self.tables:
+            # One row by primary key, rather than loading the table for it
+            return self.storage.record(table, record_id)
+        return self.table_index(table).get(str(record_id))
+
+    def get_book_by_id(self, book_id):
+        return self.lookup('books', book_id)
+
+    def get_user_by_id(self, user_id):
+        return self.lookup('users', user_id)
+
+    def get_request_by_id(self, req_id):
+        # Active loans only, as the requests table in memory holds
+        request = self.lookup('requests', req_id)
+        return request if request is not None and request.get('status') == 'Active' else None
+
+    def get_user_name(self, user_id):
+        user = self.get_user_by_id(user_id)
+        if user:
+            return user.get('name', 'Unknown')
+        return 'Unknown'
+
+    def get_book_title(self, book_id):
+        book = self.get_book_by_id(book_id)
+        if book:
+            return book.get('title', 'Unknown')
+        return 'Unknown'
+
+    # Books
+    @measured('search')
+    def search(self, query, limit=None):
+        if self.backend == 'sqlite':
+            # The database answers it; the books table is never loaded for a search
+            results = self.storage.search_books(query, limit)
+            self.count('records_scanned', 'search', len(results))
+            return results
+        if not query.strip():
+            books = self.books
+            results = list(books[:limit] if limit else books)
+            self.count('records_scanned', 'search', len(results))
+            return results
+        if self.search_index is None:
+            started = time.perf_counter()
+            self.search_index = SearchIndex()
+            self.search_index.build(self.books)
+            self.load_times['search_index'] = time.perf_counter() - started
+        results = [self.book_index[book_id]
+                   for book_id in self.search_index.search(query, limit)]
+        self.count('records_scanned', 'search', len(results))
+        return results
+
+    def add_book(self, title, author, isbn='', category='', year=''):
+        new_book = {
+            'id': None,
+            'title': title,
+            'author': author,
+            'isbn': isbn,
+            'category': category,
+            'year': year,
+            'status': 'Available',
+            'date_added': datetime.now().strftime("%Y-%m-%d")
+        }
+        with self.transaction():
+            new_book['id'] = self.new_id('books')
+            return self.insert_book(new_book)
+
+    def insert_book(self, values):
+        book = Book.from_dict(values)
+        self.books.append(book)
+        self.book_index[str(book['id'])] = book
+        self.index_book(book)
+        self.record_change('books', book)
+        return book
+
+    def update_book(self, book_id, **changes):
+        # Only title, author, isbn, category, year and status can change
+        with self.transaction():
+            book = self.book_index.get(str(book_id))
+            if not book:
+                raise LendingError("Book not found!")
+
+            self.unindex_book(book)
+            for field in ('title', 'author', 'isbn', 'category', 'year', 'status'):
+                if changes.get(field) is not None:
+                    book[field] = changes[field]
+            self.index_book(book)
+            self.record_change('books', book)
+        return book
+
+    def delete_book(self, book_id):
+        with self.transaction():
+            book = self.book_index.get(str(book_id))
+            if not book:
+                raise LendingError("Book not found!")
+            if any(copy.get('status') == 'Borrowed' for copy in book_copies(book)):
+                raise LendingError("Cannot delete borrowed book!")
+            if self.book_holds(book_id):
+                raise LendingError("Cannot delete book with holds!")
+
+            self.books.remove(book)
+            del self.book_index[str(book.get('id'))]
+            self.unindex_book(book)
+            self.record_delete('books', book.get('id'))
+        return book
+
+    def add_copies(self, book_id, count=1):
+        # More copies of a title, each with its own barcode
+        if count < 1:
+            raise LendingError("Number of copies must be at least 1!")
+        with self.transaction():
+            book = self.book_index.get(str(book_id))
+            if not book:
+                raise LendingError("Book not found!")
+
+            self.unindex_book(book)
+            # A single-copy book gets its one implicit copy written out first
+            copies = [dict(copy) for copy in book_copies(book)]
+            number = len(copies)
+            for _ in range(count):
+                number += 1
+                copies.append({'barcode': copy_barcode(book.get('id'), number),
+                               'status': 'Available'})
+            book['copies'] = copies
+            if book.get('status') == 'Borrowed':
+                book['status'] = 'Available'
+            self.index_book(book)
+            self.serve_holds(book)
+            self.record_change('books', book)
+        return book
+
+    def set_copy_status(self, book, barcode, status):
+        # Mark one copy and bring the title's status in line: a title is
+        # Borrowed only once no copy is left
+        copies = book.get('copies')
+        if copies is not None:
+            for copy in copies:
+                if copy.get('barcode') == barcode:
+                    copy['status'] = status
+                    break
+        self.stats.remove_book(book)
+        book['status'] = 'Available' if self.copies.available(book.get('id')) else 'Borrowed'
+        self.stats.add_book(book)
+
+    @measured('check_availability')
+    def check_availability(self, book_id):
+        # The book, how many of its copies are free, and its active loans
+        book = self.book_index.get(str(book_id))
+        if not book:
+            raise LendingError("Book not found!")
+
+        self.table('requests')
+        return {'book': book,
+                'available': self.copies.available(book_id),
+                'total': self.copies.total(book_id),
+                'loans': self.book_loans.active_loans(book_id),
+                'holds': self.book_holds(book_id)}
+
+    def bulk_import(self, table, path):
+        # Add every valid row from a CSV or JSON Lines file with a single save
+        insert = self.insert_book if table == 'books' else self.insert_user
+        rows = []
+        errors = []
+        for line_number, row in read_rows(path):
+            record, error = clean_row(table, row)
+            if error:
+                errors.append((line_number, error))
+            else:
+                rows.append(record)
+
+        with self.transaction():
+            for record in rows:
+                insert({'id': self.new_id(table), **record})
+        return len(rows), errors
+
+    # Users
+    def add_user(self, name, email='', phone='', address=''):
+        new_user = {
+            'id': None,
+            'name': name,
+            'email': email,
+            'phone': phone,
+            'address': address,
+            'date_joined': datetime.now().strftime("%Y-%m-%d"),
+            'active_borrowings': 0,
+            'total_borrowings': 0
+        }
+        with self.transaction():
+            new_user['id'] = self.new_id('users')
+            return self.insert_user(new_user)
+
+    def insert_user(self, values):
+        user = User.from_dict(values)
+        self.users.append(user)
+        self.user_index[str(user['id'])] = user
+        self.record_change('users', user)
+        return user
+
+    def update_user(self, user_id, **changes):
+        # Only name, email, phone and address can change
+        with self.transaction():
+            user = self.user_index.get(str(user_id))
+            if not user:
+                raise LendingError("User not found!")
+
+            for field in ('name', 'email', 'phone', 'address'):
+                if changes.get(field) is not None:
+                    user[field] = changes[field]
+            self.record_change('users', user)
+        return user
+
+    def delete_user(self, user_id):
+        with self.transaction():
+            user = self.user_index.get(str(user_id))
+            if not user:
+                raise LendingError("User not found!")
+
+            # Check if user has active borrowings
+            if self.user_loans.active_count(user_id) > 0:
+                raise LendingError("Cannot delete user with active borrowings!")
+
+            self.users.remove(user)
+            del self.user_index[str(user.get('id'))]
+            self.record_delete('users', user.get('id'))
+        return user
+
+    @measured('user_history')
+    def user_history(self, user_id):
+        # The user, their active loans and their past loans
+        user = self.get_user_by_id(user_id)
+        if not user:
+            raise LendingError("User not found!")
+
+        self.table('requests')
+        if not self.user_loans.has_closed(user_id):
+            # First look at this user's history: read only their archived loans
+            self.user_loans.set_closed(user_id, self.archive.user_records(user_id))
+        active = self.user_loans.active_loans(user_id)
+        past = self.user_loans.closed_loans(user_id)
+        self.count('records_scanned', 'user_history', len(active) + len(past))
+        return {'user': user, 'active_loans': active, 'past_loans': past}
+
+    # Loans
+    @measured('borrow')
+    def borrow(self, user_id, book_id, expected_version=None):
+        # expected_version: the book version the caller last saw, if it wants
+        # the loan refused when anyone has touched the book since
+        book = self.get_book_by_id(book_id)
+        seen_status = book.get('status') if book else None
+        if self.backend == 'sqlite':
+            # Unknown readers and books are refused on two primary key reads,
+            # before any table is loaded for the loan
+            if self.storage.record('users', user_id) is None:
+                raise LendingError("User not found!")
+            if self.storage.record('books', book_id) is None:
+                raise LendingError("Book not found!")
+
+        with self.transaction():
+            book = self.book_index.get(str(book_id))
+            if book and expected_version is not None and book.get('version', 0) != expected_version:
+                raise LendingError("Book was changed by another session, please try again")
+            if book and seen_status is not None and book.get('status') != seen_status:
+                raise LendingError(f"Book was just changed to '{book.get('status')}' "
+                                   f"by another session")
+            return self.process_borrow(user_id, book_id)
+
+    @measured('return')
+    def return_book(self, req_id):
+        with self.transaction():
+            request = self.process_return(req_id)
+        days_overdue, fine = self.calculate_fine(request)
+        # The hold the returned copy was set aside for, if someone was waiting
+        barcode = request.get('barcode') or copy_barcode(request.get('book_id'), 1)
+        return {'request': request, 'days_overdue': days_overdue, 'fine': fine,
+                'hold': self.holds.ready.get(barcode)}
+
+    @measured('renew')
+    def renew(self, req_id):
+        with self.transaction():
+            return self.process_renew(req_id)
+
+    def process_borrow(self, user_id, book_id):
+        # Applies a loan in memory; the caller saves
+        user_id = str(user_id)
+        book_id = str(book_id)
+
+        # Check if user exists
+        user = self.user_index.get(str(user_id))
+        if not user:
+            raise LendingError("User not found!")
+
+        # Check if book exists and is available
+        book = self.book_index.get(str(book_id))
+        if not book:
+            raise LendingError("Book not found!")
+
+        # A copy set aside for this user's hold is theirs even though the book looks out
+        self.expire_holds()
+        hold = self.holds.get(user_id, book_id)
+        ready = hold is not None and hold.get('status') == 'Ready'
+        if not ready and (book.get('status') != 'Available' or not self.copies.available(book_id)):
+            raise LendingError(f"Book is not available. Status: {book.get('status')}")
+
+        # Check user's active borrowings
+        if self.user_loans.active_count(user_id) >= 5:  # Limit to 5 books
+            raise LendingError("User has reached maximum borrowing limit (5 books)")
+
+        # Generate request ID
+        req_id = self.new_id('requests')
+
+        borrow_date = datetime.now().strftime("%Y-%m-%d")
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")  # 2 weeks
+
+        # Take the copy held for this user, or any free one
+        if ready:
+            barcode = hold.get('barcode')
+        else:
+            barcode = self.copies.claim(book_id)
+        if hold is not None:
+            self.close_hold(hold)
+        self.set_copy_status(book, barcode, 'Borrowed')
+
+        new_request = Request.from_dict({
+            'id': req_id,
+            'user_id': user_id,
+            'book_id': book_id,
+            'barcode': barcode,
+            'borrow_date': borrow_date,
+            'due_date': due_date,
+            'status': 'Active',
+            'renewals': 0
+        })
+
+        # Update user stats
+        user['active_borrowings'] = user.get('active_borrowings', 0) + 1
+        user['total_borrowings'] = user.get('total_borrowings', 0) + 1
+
+        self.requests.append(new_request)
+        self.request_index[str(req_id)] = new_request
+        self.index_request(new_request)
+        if self.popularity is not None:
+            self.popularity.add(new_request)
+        self.record_change('requests', new_request)
+        self.record_change('books', book)
+        self.record_change('users', user)
+        return new_request
+
+    def process_return(self, req_id):
+        # Closes a loan in memory; the caller saves
+        request = self.request_index.get(str(req_id))
+        if not request or request.get('status') != 'Active':
+            raise LendingError("Active request not found!")
+
+        user_id = request.get('user_id')
+        book_id = request.get('book_id')
+        self.expire_holds()
+
+        # Close the loan and move it from the active set to the archive
+        self.unindex_request(request)
+        del self.request_index[str(request.get('id'))]
+        self.requests.remove(request)
+        request['status'] = 'Returned'
+        request['return_date'] = datetime.now().strftime("%Y-%m-%d")
+        self.archive_loan(request)
+
+        # Put the copy back in the free pool; loans from before copies
+        # were tracked are on the book's first copy
+        book = self.book_index.get(str(book_id))
+        if book:
+            barcode = request.get('barcode') or copy_barcode(book_id, 1)
+            self.copies.release(book_id, barcode)
+            self.set_copy_status(book, barcode, 'Available')
+            self.serve_holds(book)
+            self.record_change('books', book)
+
+        # Update user stats
+        user = self.user_index.get(str(user_id))
+        if user:
+            user['active_borrowings'] = max(0, user.get('active_borrowings', 0) - 1)
+            self.record_change('users', user)
+
+        self.record_change('requests', request)
+        return request
+
+    def process_renew(self, req_id):
+        # Find request
+        request = self.request_index.get(str(req_id))
+        if not request or request.get('status') != 'Active':
+            raise LendingError("Active request not found!")
+
+        # Check renewals limit
+        if request.get('renewals', 0) >= 2:
+            raise LendingError("Maximum renewals (2) reached!")
+
+        # Someone waiting for the book gets it back on time
+        self.table('holds')
+        if self.holds.next_waiting(request.get('book_id')) is not None:
+            raise LendingError("Cannot renew, other users are waiting for this book!")
+
+        # Update due date
+        current_due = datetime.strptime(request.get('due_date'), "%Y-%m-%d")
+        new_due = current_due + timedelta(days=7)  # 1 week extension
+        self.unindex_request(request)
+        request['due_date'] = new_due.strftime("%Y-%m-%d")
+        request['renewals'] = request.get('renewals', 0) + 1
+        self.index_request(request)
+        self.record_change('requests', request)
+        return request
+
+    # Holds
+    @measured('place_hold')
+    def place_hold(self, user_id, book_id):
+        with self.transaction():
+            return self.process_place_hold(user_id, book_id)
+
+    def process_place_hold(self, user_id, book_id):
+        # Queues the user for the next copy of a book that is out
+        user_id = str(user_id)
+        book_id = str(book_id)
+
+        if not self.user_index.get(str(user_id)):
+            raise LendingError("User not found!")
+        book = self.book_index.get(str(book_id))
+        if not book:
+            raise LendingError("Book not found!")
+
+        self.expire_holds()
+        if book.get('status') == 'Available' and self.copies.available(book_id):
+            raise LendingError("Book is available, borrow it instead!")
+        if self.holds.get(user_id, book_id) is not None:
+            raise LendingError("User already has a hold on this book!")
+        self.table('requests')
+        if any(loan.get('user_id') == user_id for loan in self.book_loans.active_loans(book_id)):
+            raise LendingError("User already has this book!")
+
+        hold = Hold.from_dict({
+            'id': self.new_id('holds'),
+            'user_id': user_id,
+            'book_id': book_id,
+            'status': 'Waiting',
+            'hold_date': datetime.now().strftime("%Y-%m-%d")
+        })
+        self.table('holds').append(hold)
+        self.hold_index[str(hold['id'])] = hold
+        self.holds.add(hold)
+        self.record_change('holds', hold)
+        return hold
+
+    def cancel_hold(self, hold_id):
+        with self.transaction():
+            hold = self.hold_index.get(str(hold_id))
+            if not hold:
+                raise LendingError("Hold not found!")
+            self.close_hold(hold)
+            if hold.get('status') == 'Ready':
+                self.release_held_copy(hold)
+        return hold
+
+    def book_holds(self, book_id):
+        # The holds on a book: ready ones first, then the queue in order
+        self.table('holds')
+        book_id = str(book_id)
+        ready = [hold for hold in self.holds.ready.values() if hold.get('book_id') == book_id]
+        return ready + self.holds.waiting_holds(book_id)
+
+    def close_hold(self, hold):
+        # Fulfilled, cancelled or expired holds are simply dropped
+        self.holds.remove(hold)
+        del self.hold_index[str(hold.get('id'))]
+        self.table('holds').remove(hold)
+        self.record_delete('holds', hold.get('id'))
+
+    def serve_holds(self, book):
+        # Sets the book's free copies aside for the oldest waiting holds
+        book_id = str(book.get('id'))
+        self.table('holds')
+        while self.copies.available(book_id):
+            hold = self.holds.next_waiting(book_id)
+            if hold is None:
+                break
+            self.holds.remove(hold)
+            barcode = self.copies.claim(book_id)
+            self.set_copy_status(book, barcode, 'On Hold')
+            hold['status'] = 'Ready'
+            hold['barcode'] = barcode
+            # 3 days to collect it
+            hold['pickup_by'] = (datetime.now() + timedelta(days=3)).strftime("%Y-%m-%d")
+            self.holds.add(hold)
+            self.record_change('holds', hold)
+
+    def release_held_copy(self, hold):
+        # A copy nobody collected goes to the next in line, or back on the shelf
+        book = self.book_index.get(str(hold.get('book_id')))
+        if book:
+            self.copies.release(hold.get('book_id'), hold.get('barcode'))
+            self.set_copy_status(book, hold.get('barcode'), 'Available')
+            self.serve_holds(book)
+            self.record_change('books', book)
+
+    def expire_holds(self):
+        # Only the ready holds past their pickup date are looked at
+        self.table('holds')
+        expired = []
+        for hold_id in self.holds.expired(date.today().toordinal()):
+            hold = self.hold_index[hold_id]
+            self.close_hold(hold)
+            self.release_held_copy(hold)
+            expired.append(hold)
+        return expired
+
+    def calculate_fine(self, request):
+        # (days overdue, fine) for a returned loan
+        days_overdue = field_ordinal(request, 'return_date') - field_ordinal(request, 'due_date')
+        if days_overdue > 0:
+            return days_overdue, days_overdue * FINE_PER_DAY
+        return 0, 0.0
+
+    @measured('batch_borrow')
+    def batch_borrow(self, loans):
+        # loans: (user_id, book_id) pairs; everything is saved in one write
+        results = []
+        with self.transaction():
+            self.borrow_each(loans, results)
+        return results
+
+    def borrow_each(self, loans, results):
+        for user_id, book_id in loans:
+            try:
+                request = self.process_borrow(user_id, book_id)
+            except LendingError as e:
+                results.append({'user_id': str(user_id), 'book_id': str(book_id),
+                                'ok': False, 'error': str(e)})
+            else:
+                results.append({'user_id': str(user_id), 'book_id': str(book_id),
+                                'ok': True, 'request_id': request['id'],
+                                'due_date': request['due_date']})
+
+    @measured('batch_return')
+    def batch_return(self, request_ids):
+        results = []
+        with self.transaction():
+            self.return_each(request_ids, results)
+        return results
+
+    def return_each(self, request_ids, results):
+        for req_id in request_ids:
+            try:
+                request = self.process_return(req_id)
+            except LendingError as e:
+                results.append({'request_id': str(req_id), 'ok': False, 'error': str(e)})
+            else:
+                days_overdue, fine = self.calculate_fine(request)
+                results.append({'request_id': str(req_id), 'ok': True,
+                                'days_overdue': days_overdue, 'fine': fine})
+
+    @measured('overdue_loans')
+    def overdue_loans(self):
+        # Active loans past their due date, earliest due first
+        if self.backend == 'sqlite':
+            loans = self.storage.overdue_requests(date.today().isoformat())
+            self.count('records_scanned', 'overdue_loans', len(loans))
+            return loans
+        today = date.today().toordinal()
+        self.table('requests')
+        loans = [self.request_index[req_id] for due, req_id in self.due_index.due_before(today)]
+        self.count('records_scanned', 'overdue_loans', len(loans))
+        return loans
+
+    # Reports
+    @measured('statistics')
+    def statistics(self):
+        if self.backend == 'sqlite':
+            # Counted by the database from the rows themselves, so nothing can drift
+            counts = self.storage.statistics()
+            counts['warnings'] = []
+            return counts
+        self.table('books')
+        self.table('requests')
+        warnings = self.check_statistics() if self.verify_stats else []
+        counts = self.stats.counts()
+        counts['total_users'] = len(self.users)
+        counts['warnings'] = warnings
+        return counts
+
+    def check_statistics(self):
+        # Compare the running totals with a full recount and repair any drift
+        expected = LibraryStats.count(self.books, self.requests)
+        self.count('records_scanned', 'statistics', len(self.books) + len(self.requests))
+        actual = self.stats.counts()
+        problems = []
+        for key, value in expected.counts().items():
+            if actual[key] != value:
+                problems.append(f"{key} was {actual[key]}, recount gives {value}")
+        if problems:
+            self.stats = expected
+        return problems
+
+    @measured('check_loan_counters')
+    def check_loan_counters(self):
+        # Recount every user's active and total loans in one pass over the
+        # loans (archive included), rebuild the per-user index from the same
+        # pass and repair the users whose counters drifted
+        with self.transaction():
+            user_loans = UserLoanIndex()
+            closed = []
+            totals = {}
+            scanned = 0
+            for request in self.requests:
+                user_loans.add(request)
+                totals[request.get('user_id')] = totals.get(request.get('user_id'), 0) + 1
+                scanned += 1
+            for request in self.archive.records():
+                closed.append(request)
+                totals[request.get('user_id')] = totals.get(request.get('user_id'), 0) + 1
+                scanned += 1
+            user_loans.build_closed(closed)
+            self.user_loan_index = user_loans
+            self.count('records_scanned', 'check_loan_counters', scanned)
+
+            problems = []
+            for user in self.users:
+                user_id = str(user.get('id'))
+                active = user_loans.active_count(user_id)
+                total = totals.get(user_id, 0)
+                repaired = False
+                for field, value in (('active_borrowings', active), ('total_borrowings', total)):
+                    if user.get(field, 0) != value:
+                        problems.append(f"User {user_id} ({user.get('name', '')}): {field} "
+                                        f"was {user.get(field, 0)}, loans give {value}")
+                        user[field] = value
+                        repaired = True
+                if repaired:
+                    self.record_change('users', user)
+        return problems
+
+    @measured('most_popular')
+    def most_popular(self, limit=10, days=None):
+        # [(book, borrow count)], most borrowed first; `days` (7, 30 or 365)
+        # counts only loans made in that many recent days
+        try:
+            if self.backend == 'sqlite':
+                # Counted by the database; only the ranked books are read
+                PopularityIndex.check_window(days)
+                since = (date.today() - timedelta(days=days)).isoformat() if days else None
+                ranking = self.storage.popular_books(limit, since)
+                books = self.storage.records_by_id('books', [book_id for book_id, count in ranking])
+            else:
+                if self.popularity is None:
+                    # First ranking: count the whole history once, then keep it current
+                    self.popularity = PopularityIndex()
+                    self.popularity.build(self.requests)
+                    self.popularity.build(self.archive.records())
+                ranking = self.popularity.top(limit, days)
+                books = self.book_index
+        except ValueError as e:
+            raise LendingError(str(e))
+        self.count('records_scanned', 'most_popular', len(ranking))
+
+        results = []
+        for book_id, count in ranking:
+            book = books.get(str(book_id))
+            if book:
+                results.append((book, count))
+        return results
+
+    @measured('user_activity')
+    def user_activity(self):
+        if self.backend == 'sqlite':
+            rows = self.storage.user_activity()
+        else:
+            rows = [(user.get('id'), user.get('name', ''), user.get('active_borrowings', 0),
+                     user.get('total_borrowings', 0)) for user in self.users]
+        self.count('records_scanned', 'user_activity', len(rows))
+        return [{'id': user_id, 'name': name, 'active': active, 'total': total}
+                for user_id, name, active, total in rows]
+
+    @measured('overdue_analysis')
+    def overdue_analysis(self):
+        # Loans due today already count, as 0 days overdue
+        if self.backend == 'sqlite':
+            overdue_by_days = self.storage.overdue_counts(date.today().isoformat())
+        else:
+            today = date.today().toordinal()
+            self.table('requests')
+            overdue_by_days = {}
+            for due, req_id in self.due_index.due_before(today + 1):
+                days_overdue = today - due
+                overdue_by_days[days_overdue] = overdue_by_days.get(days_overdue, 0) + 1
+        self.count('records_scanned', 'overdue_analysis', sum(overdue_by_days.values()))
+        return {'total': sum(overdue_by_days.values()), 'by_days': overdue_by_days}
+
+    @measured('report_pack')
+    def report_pack(self, workers=1):
+        # Statistics, most popular books, user activity and overdue analysis.
+        # The loan figures come from one pass over every loan; with workers > 1
+        # the archive months are shared out to that many processes, each
+        # reading its months from storage itself.
+        generated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        today = date.today().toordinal()
+        with self.storage.lock():
+            # Only the snapshot is taken under the lock; the pass runs after
+            self.table('requests')
+            active = list(self.requests)
+            pending = dict(self.archive.pending)
+            months = self.archive.month_names()
+            counts = LibraryStats.count(self.books, active).counts()
+            counts['total_users'] = len(self.users)
+            activity = self.user_activity()
+
+        # A loan active in the snapshot may reach the archive meanwhile, and
+        # a pending one its month's file: either way it is counted once, here
+        counted = {str(request.get('id')) for request in active}
+        counted.update(pending)
+        tally = tally_loans(new_tally(), active, today)
+        tally_loans(tally, pending.values(), today)
+        if workers > 1 and len(months) > 1:
+            merge_tallies(tally, tally_sharded(self.backend, months, today, counted,
+                                               min(workers, len(months))))
+        else:
+            for month in months:
+                tally_loans(tally, self.storage.load_archive(month), today, counted)
+
+        popular = []
+        for book_id, borrowings in top_borrowed(tally['borrows'], 10):
+            book = self.get_book_by_id(book_id)
+            if book:
+                popular.append({'book_id': str(book_id), 'title': book.get('title', 'Unknown'),
+                                'borrowings': borrowings})
+        by_days = dict(sorted(tally['overdue_by_days'].items()))
+        self.count('records_scanned', 'report_pack', sum(tally['borrows'].values()))
+        return {
+            'generated': generated,
+            'statistics': counts,
+            'most_popular': popular,
+            'user_activity': activity,
+            'overdue': {'total': sum(by_days.values()), 'by_days': by_days}
+        }
+
+    @measured('loan_analytics')
+    def loan_analytics(self):
+        # Overdue histogram, fines owed, loans per category and month and
+        # average loan length over every loan, archived ones included
+        if self.backend == 'sqlite':
+            # Laid out from one query over the loans; nothing is loaded or kept
+            columns = LoanColumns()
+            columns.build(self.storage.loan_fields())
+            categories = self.storage.book_categories()
+        else:
+            if self.loan_columns is None:
+                # First report: lay the whole history out as columns once, then keep them current
+                self.table('requests')
+                self.loan_columns = LoanColumns()
+                self.loan_columns.build(self.requests)
+                self.loan_columns.build(self.archive.records())
+            columns = self.loan_columns
+            categories = {str(book.get('id')): book.get('category') or 'Uncategorized'
+                          for book in self.books}
+        self.count('records_scanned', 'loan_analytics', len(columns))
+
+        today = date.today().toordinal()
+        by_days = columns.overdue_by_days(today)
+        return {
+            'engine': engine(),
+            'loans': len(columns),
+            'overdue_by_days': by_days,
+            'overdue_ranges': overdue_ranges(by_days),
+            'fines_owed': columns.fines_owed(today, FINE_PER_DAY),
+            'loans_by_category_month': columns.loans_by_category_month(categories),
+            'average_loan_days': columns.average_loan_days()
+        }
+
+    @measured('export_all')
+    def export_all(self, compress=False, since=None, parallel=True):
+        # {table: (filename, rows written)}
+        export_started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        tables = self.table_data()
+        tables['requests'] = self.all_requests()
+        results = export_tables(tables, timestamp, compress=compress,
+                                since=since, parallel=parallel)
+        save_export_time(export_started)
+        self.count('records_scanned', 'export_all',
+                   sum(len(records) for records in tables.values()))
+        return results
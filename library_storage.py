@@ -0,0 +1,971 @@
+import json
+import os
+import pickle
+import re
+import sqlite3
+from contextlib import contextmanager
+
+from library_index import SearchIndex, tokenize
+from library_records import RECORD_TYPES, encode_record
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks on this platform
+    fcntl = None
+
+TABLES = ('books', 'users', 'requests', 'holds')
+
+MONTH_PATTERN = re.compile(r"\d{4}-\d{2}$")
+
+
+# Exclusive advisory lock on a file, shared by every process using the same data.
+# Re-entrant within a process so a transaction can refresh while holding it.
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.depth = 0
+        self.handle = None
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.handle = open(self.path, 'a')
+            if fcntl:
+                fcntl.flock(self.handle, fcntl.LOCK_EX)
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl:
+                fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+
+def replace_file(path, write):
+    # Write to a temp file, flush it to disk, then move it over `path`: a
+    # crash leaves either the old file or the new one, never half of one
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def append_file(path, data):
+    # Append and flush to disk. A line torn by an earlier crash is cut off
+    # first, so it doesn't run into the first new one.
+    with open(path, 'ab+') as f:
+        cut_torn_line(f)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def cut_torn_line(f):
+    # Drop a last line that never got its newline
+    end = position = f.seek(0, os.SEEK_END)
+    while position > 0:
+        start = max(0, position - 4096)
+        f.seek(start)
+        chunk = f.read(position - start)
+        if position == end and chunk.endswith(b"\n"):
+            return
+        newline = chunk.rfind(b"\n")
+        if newline >= 0:
+            f.truncate(start + newline + 1)
+            return
+        position = start
+    f.truncate(0)
+
+
+def sync_directories(paths):
+    # Make new, renamed and removed files in these paths' directories survive a crash
+    for directory in {os.path.dirname(os.path.abspath(path)) for path in paths}:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass  # not supported for directories on this platform
+        finally:
+            os.close(fd)
+
+
+# Snapshot files plus an append-only journal of changes. Each save goes into
+# the journal as one transaction between begin and commit records and is on
+# disk before write() returns; a transaction without its commit record was
+# cut short and is never applied. Snapshots are replaced whole, by rename.
+class JSONStorage:
+    def __init__(self, books_file="books.json", users_file="users.json",
+                 requests_file="requests.json", holds_file="holds.json",
+                 journal_file="library_journal.jsonl",
+                 lock_file="library.lock", compact_threshold=1000, snapshot_cache=True,
+                 archive_dir="archive", ids_file="library_ids.json",
+                 user_months_file="library_user_months.json"):
+        self.files = {
+            'books': books_file,
+            'users': users_file,
+            'requests': requests_file,
+            'holds': holds_file
+        }
+        self.journal_file = journal_file
+        self.file_lock = FileLock(lock_file)
+        self.compact_threshold = compact_threshold  # journal entries before a full snapshot
+        self.journal_entries = 0
+        self.appended = 0            # journal entries this session wrote itself
+        self.journal_offset = 0      # bytes of the journal already applied
+        self.snapshot_stamp = None   # snapshot mtimes when we last read them
+        self.snapshot_cache = snapshot_cache  # keep a pickled copy next to each snapshot
+        self.archive_dir = archive_dir  # closed loans, one JSON Lines file per month
+        self.ids_file = ids_file        # highest id ever handed out per table
+        self.user_months_file = user_months_file  # user id -> archive months with their loans
+        self.user_months_cache = (None, None)  # (file stamp, index) as last read
+        self.archives_on_compact = True  # closed loans reach the archive files at compaction
+        self.group_depth = 0     # open group_commit blocks
+        self.unsynced = False    # journal written but not yet flushed to disk
+
+    def lock(self):
+        return self.file_lock
+
+    def load(self):
+        # Everything, archived loans included
+        with self.file_lock:
+            self.open()
+            tables = {table: self.load_table(table) for table in TABLES}
+            loaded = {str(request.get('id')) for request in tables['requests']}
+            for month in self.archive_months():
+                tables['requests'].extend(request for request in self.load_archive(month)
+                                          if str(request.get('id')) not in loaded)
+            return tables
+
+    def open(self):
+        # Note which snapshots and how much of the journal this session starts
+        # from; the tables themselves are read by load_table when first needed
+        with self.file_lock:
+            self.snapshot_stamp = self.current_stamp()
+            self.journal_offset = 0
+            self.journal_entries = 0
+            self.appended = 0
+            self.read_journal()
+            self.drop_unfinished()
+
+    def load_table(self, table):
+        # One table as of open() plus any changes read since; None if the
+        # snapshots were replaced in the meantime and the caller must start over
+        with self.file_lock:
+            if self.current_stamp() != self.snapshot_stamp:
+                return None
+            records = self.read_snapshot(table)
+
+            # Replay this table's changes written since the snapshot
+            changes = [change for change in self.journal_changes(0, self.journal_offset)
+                       if change[1] == table]
+            if changes:
+                index = {str(record.get('id')): record for record in records}
+                for op, _, item in changes:
+                    if op == 'put':
+                        index[str(item.get('id'))] = RECORD_TYPES[table].from_dict(item)
+                    else:
+                        index.pop(item, None)
+                # The index keeps insertion order, so rebuild the list from it
+                records = list(index.values())
+            return records
+
+    def read_snapshot(self, table):
+        path = self.files[table]
+        if not os.path.exists(path):
+            return []
+        key = self.cache_key(table)
+        if self.snapshot_cache and os.path.exists(path + ".cache"):
+            try:
+                with open(path + ".cache", 'rb') as f:
+                    cached_key, records = pickle.load(f)
+                if cached_key == key:
+                    return records
+            except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+                pass  # unreadable cache: fall back to the JSON
+
+        with open(path, 'r') as f:
+            records = [RECORD_TYPES[table].from_dict(record) for record in json.load(f)]
+        self.write_cache(path, key, records)
+        return records
+
+    def cache_key(self, table):
+        # The cache is only used while the JSON file is exactly the one it was
+        # made from, and the records still have the fields they were pickled with
+        stat = os.stat(self.files[table])
+        return (stat.st_mtime_ns, stat.st_size, tuple(RECORD_TYPES[table].KINDS))
+
+    def write_cache(self, path, key, records):
+        if not self.snapshot_cache:
+            return
+        temp_path = path + ".cache.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump((key, records), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path + ".cache")
+        except OSError:
+            pass  # the cache is only an optimisation
+
+    def current_stamp(self):
+        return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None
+                     for path in self.files.values())
+
+    def read_journal(self):
+        # Complete journal entries after journal_offset, as (op, table, record or id)
+        changes = []
+        for change, end in self.journal_entries_from(self.journal_offset):
+            changes.append(change)
+            self.journal_offset = end
+        self.journal_entries += len(changes)
+        return changes
+
+    def journal_changes(self, start, stop):
+        changes = []
+        for change, end in self.journal_entries_from(start):
+            if end > stop:
+                break
+            changes.append(change)
+        return changes
+
+    def journal_entries_from(self, start):
+        # (change, offset just after its commit record) for each committed
+        # change after `start`
+        if not os.path.exists(self.journal_file):
+            return
+        offset = start
+        transaction = None
+        with open(self.journal_file, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # still being written, or torn by an interrupted write
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                if entry['op'] == 'begin':
+                    transaction = []
+                    continue
+                if entry['op'] == 'commit':
+                    for change in transaction or ():
+                        yield change, offset
+                    transaction = None
+                    continue
+
+                if entry['op'] == 'put':
+                    change = ('put', entry['table'], entry['record'])
+                else:
+                    change = ('delete', entry['table'], str(entry['id']))
+                if transaction is None:
+                    yield change, offset  # journals from before transactions were marked
+                else:
+                    transaction.append(change)
+
+    def drop_unfinished(self):
+        # Roll back a transaction a crash cut short by cutting the journal
+        # back to the last commit. Only called with the lock held, so nobody
+        # is halfway through writing one.
+        if not os.path.exists(self.journal_file):
+            return
+        end = self.journal_offset
+        for change, end in self.journal_entries_from(self.journal_offset):
+            pass
+        if os.path.getsize(self.journal_file) > end:
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def changes_since_load(self):
+        # What other processes saved since we last looked; None means reload everything
+        if self.current_stamp() != self.snapshot_stamp:
+            return None  # someone compacted the journal into new snapshots
+        if not os.path.exists(self.journal_file):
+            return [] if self.journal_offset == 0 else None
+        if os.path.getsize(self.journal_file) < self.journal_offset:
+            return None
+        return self.read_journal()
+
+    def archive_path(self, month):
+        return os.path.join(self.archive_dir, f"requests_{month}.jsonl")
+
+    def archive_months(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(name[len("requests_"):-len(".jsonl")]
+                      for name in os.listdir(self.archive_dir)
+                      if name.startswith("requests_") and name.endswith(".jsonl"))
+
+    def load_archive(self, month):
+        # A month's closed loans; a loan appended twice (by a compaction that
+        # was interrupted before it cleared the journal) is read once
+        path = self.archive_path(month)
+        if not os.path.exists(path):
+            return []
+        records = {}
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[str(record.get('id'))] = RECORD_TYPES['requests'].from_dict(record)
+        return list(records.values())
+
+    def user_months(self):
+        # {user id: [archive months holding their loans]}, built from the
+        # archive itself the first time if it predates the index
+        with self.file_lock:
+            if not os.path.exists(self.user_months_file):
+                index = {}
+                for month in self.archive_months():
+                    for request in self.load_archive(month):
+                        add_user_month(index, request, month)
+                if not index:
+                    return index
+                replace_file(self.user_months_file, lambda f: json.dump(index, f))
+            stamp = os.stat(self.user_months_file).st_mtime_ns
+            if self.user_months_cache[0] != stamp:
+                with open(self.user_months_file, 'r') as f:
+                    self.user_months_cache = (stamp, json.load(f))
+            return self.user_months_cache[1]
+
+    def load_user_archive(self, user_id):
+        # One user's archived loans, reading only the months that hold any
+        user_id = str(user_id)
+        return [request for month in self.user_months().get(user_id, [])
+                for request in self.load_archive(month) if str(request.get('user_id')) == user_id]
+
+    def id_floor(self, table):
+        # Ids below this were handed out before, even if those records are archived
+        if not os.path.exists(self.ids_file):
+            return 0
+        with open(self.ids_file, 'r') as f:
+            return json.load(f).get(table, 0)
+
+    def write(self, changes):
+        lines = ['{"op":"begin"}\n']
+        for op, table, item in changes:
+            if op == 'put':
+                entry = {'table': table, 'op': 'put', 'record': item}
+            else:
+                entry = {'table': table, 'op': 'delete', 'id': item}
+            lines.append(json.dumps(entry, separators=(',', ':'), default=encode_record) + "\n")
+        lines.append('{"op":"commit"}\n')
+
+        data = ''.join(lines).encode('utf-8')
+        with self.file_lock:
+            self.drop_unfinished()
+            created = not os.path.exists(self.journal_file)
+            with open(self.journal_file, 'ab') as f:
+                f.write(data)
+                f.flush()
+                if self.group_depth:
+                    self.unsynced = True  # group_commit flushes it at the end
+                else:
+                    os.fsync(f.fileno())
+                # Callers refresh before writing, so everything up to here is applied
+                self.journal_offset = f.tell()
+            if created:
+                sync_directories([self.journal_file])
+        self.journal_entries += len(changes)
+        self.appended += len(changes)
+        return len(data)
+
+    @contextmanager
+    def group_commit(self):
+        # Writes inside the block skip their own fsync; one at the end covers
+        # them all
+        self.group_depth += 1
+        try:
+            yield
+        finally:
+            self.group_depth -= 1
+            if self.group_depth == 0 and self.unsynced:
+                self.unsynced = False
+                if os.path.exists(self.journal_file):
+                    with open(self.journal_file, 'ab') as f:
+                        os.fsync(f.fileno())
+
+    def needs_compaction(self):
+        return self.journal_entries >= self.compact_threshold
+
+    def compact(self, tables, archived=()):
+        # Append newly closed loans to their month's archive, write full
+        # snapshots and start a fresh journal; returns bytes written
+        written = 0
+        with self.file_lock:
+            months = {}
+            for request in archived:
+                months.setdefault(archive_month(request), []).append(
+                    json.dumps(request, separators=(',', ':'), default=encode_record) + "\n")
+            if months:
+                os.makedirs(self.archive_dir, exist_ok=True)
+            for month, lines in months.items():
+                data = ''.join(lines).encode('utf-8')
+                append_file(self.archive_path(month), data)
+                written += len(data)
+            if months:
+                user_months = self.user_months()
+                for request in archived:
+                    add_user_month(user_months, request, archive_month(request))
+                replace_file(self.user_months_file, lambda f: json.dump(user_months, f))
+
+            for table in TABLES:
+                path = self.files[table]
+                replace_file(path, lambda f: json.dump(tables[table], f, indent=2,
+                                                       default=encode_record))
+                written += os.path.getsize(path)
+                self.write_cache(path, self.cache_key(table), tables[table])
+
+            floors = {table: max([self.id_floor(table)] +
+                                 [int(record.get('id')) + 1 for record in tables[table]])
+                      for table in TABLES}
+            floors['requests'] = max([floors['requests']] +
+                                     [int(request.get('id')) + 1 for request in archived])
+            replace_file(self.ids_file, lambda f: json.dump(floors, f))
+
+            # Only drop the journal once the snapshots are safely on disk. A
+            # crash before this replays it onto the new snapshots, which
+            # changes nothing: each entry is a whole record or a delete.
+            sync_directories(list(self.files.values()) + [self.ids_file] +
+                             [self.archive_path(month) for month in months] +
+                             ([self.user_months_file] if months else []))
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self.snapshot_stamp = self.current_stamp()
+        self.journal_entries = 0
+        self.appended = 0
+        self.journal_offset = 0
+        return written
+
+    def checkpoint(self, compact):
+        # Fold the journal into the snapshots when closing; `compact` is only
+        # called then, so a session that changed nothing reads nothing more,
+        # even if it opened onto another session's journal
+        if self.appended:
+            compact()
+
+    def close(self):
+        pass
+
+
+# One indexed table per record type; the full record is kept as JSON in `data`
+# and the columns we filter on are copied out next to it. `seq` is the number
+# of the write that last touched the row, so other processes can catch up.
+SQLITE_COLUMNS = {
+    'books': ('title', 'author', 'isbn', 'category', 'status'),
+    'users': ('name', 'email'),
+    'requests': ('user_id', 'book_id', 'status', 'due_date'),
+    'holds': ('user_id', 'book_id', 'status')
+}
+
+SQLITE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_books_status ON books (status)",
+    "CREATE INDEX IF NOT EXISTS idx_books_category ON books (category)",
+    "CREATE INDEX IF NOT EXISTS idx_books_isbn ON books (isbn)",
+    "CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)",
+    "CREATE INDEX IF NOT EXISTS idx_requests_status_due ON requests (status, due_date)",
+    "CREATE INDEX IF NOT EXISTS idx_requests_user ON requests (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_requests_book ON requests (book_id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_seq ON books (seq)",
+    "CREATE INDEX IF NOT EXISTS idx_users_seq ON users (seq)",
+    "CREATE INDEX IF NOT EXISTS idx_requests_seq ON requests (seq)",
+    "CREATE INDEX IF NOT EXISTS idx_holds_seq ON holds (seq)",
+    "CREATE INDEX IF NOT EXISTS idx_deleted_seq ON deleted (seq)",
+    "CREATE INDEX IF NOT EXISTS idx_requests_month ON requests (month, id)"
+)
+
+
+# Fills in the archive month of closed loans saved before the month column
+# existed, matching archive_month(); newer rows get it from upsert
+SQLITE_ARCHIVE_MONTHS = (
+    "UPDATE requests SET month = (SELECT CASE WHEN substr(day, 1, 7) "
+    "GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]' THEN substr(day, 1, 7) ELSE 'undated' END FROM ("
+    "SELECT COALESCE(NULLIF(json_extract(requests.data, '$.return_date'), ''), "
+    "NULLIF(json_extract(requests.data, '$.borrow_date'), ''), '') AS day)) "
+    "WHERE status IS NOT 'Active'"
+)
+
+
+class SQLiteStorage:
+    def __init__(self, db_file="library.db"):
+        self.db_file = db_file
+        self.file_lock = FileLock(db_file + ".lock")
+        self.conn = sqlite3.connect(db_file, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")  # a commit is on disk once it returns
+        for table, columns in SQLITE_COLUMNS.items():
+            column_defs = ''.join(f", {column} TEXT" for column in columns)
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                              f"(id INTEGER PRIMARY KEY{column_defs}, data TEXT NOT NULL, "
+                              f"seq INTEGER NOT NULL DEFAULT 0)")
+            # Databases created before seq existed
+            existing = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            if 'seq' not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            # The archive month of a closed loan, so the archive is read by index
+            if table == 'requests' and 'month' not in existing:
+                self.conn.execute("ALTER TABLE requests ADD COLUMN month TEXT")
+                self.conn.execute(SQLITE_ARCHIVE_MONTHS)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS deleted "
+                          "(tbl TEXT NOT NULL, id INTEGER NOT NULL, seq INTEGER NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        for statement in SQLITE_INDEXES:
+            self.conn.execute(statement)
+        self.last_seq = 0
+        self.archives_on_compact = False  # closed loans stay in the requests table
+        self.grouped = False  # inside group_commit: writes are savepoints of its transaction
+
+    def lock(self):
+        return self.file_lock
+
+    def current_seq(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        return row[0] if row else 0
+
+    def load(self):
+        self.conn.execute("BEGIN")
+        try:
+            self.open()
+            return {table: self.load_table(table) for table in TABLES}
+        finally:
+            self.conn.execute("COMMIT")
+
+    def open(self):
+        self.last_seq = self.current_seq()
+
+    def load_table(self, table):
+        # Rows may already include changes after last_seq; applying those
+        # again from changes_since_load is harmless. Closed loans stay in the
+        # table and are read by month through load_archive.
+        if table == 'requests':
+            rows = self.conn.execute("SELECT data FROM requests WHERE status = 'Active' ORDER BY id")
+        else:
+            rows = self.conn.execute(f"SELECT data FROM {table} ORDER BY id")
+        return [RECORD_TYPES[table].from_dict(json.loads(data)) for (data,) in rows]
+
+    def changes_since_load(self):
+        # None means reload everything
+        seq = self.current_seq()
+        if seq == self.last_seq:
+            return []
+        pruned = self.conn.execute("SELECT value FROM meta WHERE key = 'pruned'").fetchone()
+        if pruned and pruned[0] > self.last_seq:
+            return None  # a compaction dropped tombstones this session has not seen
+
+        # Puts and deletes are applied in the order they were saved in; at
+        # the same seq the delete goes first, as the row outlived it
+        changes = []
+        for table in TABLES:
+            rows = self.conn.execute(f"SELECT seq, data FROM {table} WHERE seq > ?",
+                                     (self.last_seq,))
+            changes.extend((row_seq, 1, ('put', table, json.loads(data))) for row_seq, data in rows)
+        rows = self.conn.execute("SELECT seq, tbl, id FROM deleted WHERE seq > ?", (self.last_seq,))
+        changes.extend((row_seq, 0, ('delete', table, str(record_id)))
+                       for row_seq, table, record_id in rows)
+        changes.sort(key=lambda change: change[:2])
+        self.last_seq = seq
+        return [change for _, _, change in changes]
+
+    def archive_months(self):
+        rows = self.conn.execute("SELECT DISTINCT month FROM requests WHERE month IS NOT NULL "
+                                 "ORDER BY month")
+        return [month for (month,) in rows]
+
+    def load_archive(self, month):
+        rows = self.conn.execute("SELECT data FROM requests WHERE month = ? ORDER BY id", (month,))
+        return [RECORD_TYPES['requests'].from_dict(json.loads(data)) for (data,) in rows]
+
+    def load_user_archive(self, user_id):
+        rows = self.conn.execute("SELECT data FROM requests WHERE user_id = ? AND month IS NOT NULL "
+                                 "ORDER BY id", (str(user_id),))
+        return self.records('requests', rows)
+
+    def id_floor(self, table):
+        # Ids below this were handed out before, even if those records are deleted
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", ('next_id:' + table,)).fetchone()
+        highest = self.conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+        return max(row[0] if row else 0, highest)
+
+    def raise_id_floor(self, table, floor):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, MAX(?, "
+                          "COALESCE((SELECT value FROM meta WHERE key = ?), 0)))",
+                          ('next_id:' + table, floor, 'next_id:' + table))
+
+    def is_empty(self):
+        for table in TABLES:
+            if self.conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+
+    def upsert(self, table, record, seq):
+        columns = SQLITE_COLUMNS[table]
+        values = [int(record.get('id'))]
+        for column in columns:
+            value = record.get(column)
+            values.append(None if value is None else str(value))
+        if table == 'requests':
+            columns += ('month',)
+            values.append(None if record.get('status') == 'Active' else archive_month(record))
+        data = json.dumps(record, separators=(',', ':'), default=encode_record)
+        values.append(data)
+        values.append(seq)
+        placeholders = ', '.join('?' * len(values))
+        self.conn.execute(f"INSERT OR REPLACE INTO {table} (id, {', '.join(columns)}, data, seq) "
+                          f"VALUES ({placeholders})", values)
+        return len(data)
+
+    def next_seq(self):
+        seq = self.current_seq() + 1
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seq', ?)", (seq,))
+        return seq
+
+    @contextmanager
+    def write_transaction(self):
+        # All or nothing: a transaction of its own, or a savepoint in the
+        # group commit's transaction
+        if self.grouped:
+            self.conn.execute("SAVEPOINT write")
+            try:
+                yield
+            except Exception:
+                self.conn.execute("ROLLBACK TO write")
+                self.conn.execute("RELEASE write")
+                raise
+            self.conn.execute("RELEASE write")
+            return
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    @contextmanager
+    def group_commit(self):
+        # The writes inside the block are committed, and synced, together at the end
+        if self.grouped:
+            yield
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.grouped = True
+        try:
+            yield
+        finally:
+            self.grouped = False
+            if self.conn.in_transaction:
+                self.conn.execute("COMMIT")
+
+    def write(self, changes):
+        # All changes from one save_data go in together or not at all
+        # Returns the size of the record data written
+        written = 0
+        floors = {}
+        with self.write_transaction():
+            seq = self.next_seq()
+            for op, table, item in changes:
+                if op == 'put':
+                    written += self.upsert(table, item, seq)
+                    floors[table] = max(floors.get(table, 0), int(item.get('id')) + 1)
+                else:
+                    self.conn.execute(f"DELETE FROM {table} WHERE id = ?", (int(item),))
+                    self.conn.execute("INSERT INTO deleted (tbl, id, seq) VALUES (?, ?, ?)",
+                                      (table, int(item), seq))
+            # Kept apart from MAX(id), so a deleted record's id is never reused
+            for table, floor in floors.items():
+                self.raise_id_floor(table, floor)
+        self.last_seq = seq
+        return written
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, tables, archived=()):
+        # Replace the stored tables with the given records; closed loans are
+        # kept, as `tables` only holds the active ones
+        written = 0
+        with self.write_transaction():
+            seq = self.next_seq()
+            for table in TABLES:
+                # The ids of records dropped here stay handed out
+                self.raise_id_floor(table, self.id_floor(table))
+                if table == 'requests':
+                    self.conn.execute("DELETE FROM requests WHERE status = 'Active'")
+                else:
+                    self.conn.execute(f"DELETE FROM {table}")
+                for record in tables[table]:
+                    written += self.upsert(table, record, seq)
+            for request in archived:
+                written += self.upsert('requests', request, seq)
+            # Sessions that loaded before this seq can no longer see these
+            # deletes, so changes_since_load sends them to a full reload
+            self.conn.execute("DELETE FROM deleted")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pruned', ?)", (seq,))
+        self.last_seq = seq
+        return written
+
+    def checkpoint(self, compact):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.conn.close()
+
+    # SQL versions of the lookups. On this backend the service answers
+    # searches, overdue lists, statistics and rankings with these, so none
+    # of them needs a table loaded into memory.
+    def search_books(self, query, limit=None):
+        # Same results, in the same order, as SearchIndex.search: SQL keeps
+        # the books containing every term and only those are ranked here
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            sql, params = "SELECT data FROM books ORDER BY id", []
+            if limit:
+                sql += " LIMIT ?"
+                params.append(limit)
+            return self.records('books', self.conn.execute(sql, params))
+
+        clauses = []
+        params = []
+        for term in terms:
+            clauses.append("(title LIKE ? OR author LIKE ? OR isbn LIKE ? OR category LIKE ? "
+                           "OR REPLACE(REPLACE(isbn, '-', ''), ' ', '') LIKE ?)")
+            params += [f"%{term}%"] * 5
+        rows = self.conn.execute(f"SELECT data FROM books WHERE {' AND '.join(clauses)}", params)
+        books = {str(book.get('id')): book for book in self.records('books', rows)}
+        index = SearchIndex()
+        index.build(books.values())
+        return [books[book_id] for book_id in index.search(query, limit)]
+
+    def overdue_requests(self, today):
+        # Active loans due before `today` (YYYY-MM-DD), earliest due first
+        rows = self.conn.execute("SELECT data FROM requests WHERE status = 'Active' "
+                                 "AND due_date < ? ORDER BY due_date, id", (today,))
+        return self.records('requests', rows)
+
+    def overdue_counts(self, today):
+        # {days overdue: active loans} for loans due on or before `today`
+        rows = self.conn.execute(
+            "SELECT CAST(julianday(?) - julianday(due_date) AS INTEGER) AS days, COUNT(*) "
+            "FROM requests WHERE status = 'Active' AND due_date <= ? "
+            "AND julianday(due_date) IS NOT NULL GROUP BY days ORDER BY days DESC",
+            (today, today))
+        return dict(rows)
+
+    def statistics(self):
+        stats = {'total_books': 0, 'available_books': 0, 'borrowed_books': 0}
+        for status, count in self.conn.execute("SELECT status, COUNT(*) FROM books GROUP BY status"):
+            stats['total_books'] += count
+            if status == 'Available':
+                stats['available_books'] = count
+            elif status == 'Borrowed':
+                stats['borrowed_books'] = count
+        stats['total_users'] = self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        stats['active_requests'] = self.conn.execute(
+            "SELECT COUNT(*) FROM requests WHERE status = 'Active'").fetchone()[0]
+        stats['categories'] = dict(self.conn.execute(
+            "SELECT COALESCE(category, 'Uncategorized'), COUNT(*) FROM books GROUP BY 1"))
+        return stats
+
+    def popular_books(self, limit=10, since=None):
+        # [(book id, loans)], most borrowed first, ties by id; `since`
+        # (YYYY-MM-DD) counts only loans borrowed after that day
+        sql = "SELECT book_id, COUNT(*) AS n FROM requests WHERE book_id IS NOT NULL"
+        params = []
+        if since:
+            sql += " AND json_extract(data, '$.borrow_date') > ?"
+            params.append(since)
+        sql += " GROUP BY book_id ORDER BY n DESC, CAST(book_id AS INTEGER), book_id LIMIT ?"
+        params.append(limit)
+        return list(self.conn.execute(sql, params))
+
+    def records_by_id(self, table, ids):
+        # {id: record} for the given ids that exist
+        ids = [int(record_id) for record_id in ids]
+        if not ids:
+            return {}
+        placeholders = ', '.join('?' * len(ids))
+        rows = self.conn.execute(f"SELECT data FROM {table} WHERE id IN ({placeholders})", ids)
+        return {str(record.get('id')): record for record in self.records(table, rows)}
+
+    def record(self, table, record_id):
+        # One record by primary key, or None
+        if not str(record_id).isdigit():
+            return None
+        row = self.conn.execute(f"SELECT data FROM {table} WHERE id = ?", (int(record_id),)).fetchone()
+        return self.records(table, [row])[0] if row else None
+
+    def page(self, table, size, after=None, before=None, number=None, filters=None):
+        # One page in id order for LibraryService.page, read through the
+        # primary key: (records, whether a page follows, whether one comes
+        # before, total or None when filtered). `filters` maps fields to
+        # lower-case values.
+        where, params = [], []
+        for field, value in (filters or {}).items():
+            if field in SQLITE_COLUMNS[table]:
+                where.append(f"LOWER({field}) = ?")
+            else:
+                where.append("LOWER(CAST(json_extract(data, ?) AS TEXT)) = ?")
+                params.append(f"$.{field}")
+            params.append(value)
+
+        def select(columns, condition, condition_params, order, limit, offset=0):
+            clauses = where + ([condition] if condition else [])
+            sql = f"SELECT {columns} FROM {table}"
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += f" ORDER BY id {order} LIMIT ? OFFSET ?"
+            return self.conn.execute(sql, params + condition_params + [limit, offset]).fetchall()
+
+        if before is not None:
+            rows = select("data", "id < ?", [int(before)], "DESC", size)
+            rows.reverse()
+        elif number is not None:
+            rows = select("data", None, [], "ASC", size, (max(number, 1) - 1) * size)
+        elif after is not None:
+            rows = select("data", "id > ?", [int(after)], "ASC", size)
+        else:
+            rows = select("data", None, [], "ASC", size)
+        records = self.records(table, rows)
+
+        more = earlier = False
+        if records:
+            more = bool(select("1", "id > ?", [int(records[-1].get('id'))], "ASC", 1))
+            earlier = bool(select("1", "id < ?", [int(records[0].get('id'))], "DESC", 1))
+        total = None
+        if not filters:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return records, more, earlier, total
+
+    def user_activity(self):
+        # [(id, name, active, total)] from each user's stored counters, in id order
+        return list(self.conn.execute(
+            "SELECT id, COALESCE(name, ''), COALESCE(json_extract(data, '$.active_borrowings'), 0), "
+            "COALESCE(json_extract(data, '$.total_borrowings'), 0) FROM users ORDER BY id"))
+
+    def loan_fields(self):
+        # Every loan, archived ones included, as dicts of the fields the
+        # analytics columns use
+        rows = self.conn.execute(
+            "SELECT id, user_id, book_id, json_extract(data, '$.borrow_date'), due_date, "
+            "json_extract(data, '$.return_date'), status FROM requests")
+        fields = ('id', 'user_id', 'book_id', 'borrow_date', 'due_date', 'return_date', 'status')
+        for row in rows:
+            yield dict(zip(fields, row))
+
+    def book_categories(self):
+        # {book id: category}, 'Uncategorized' for books without one
+        return {str(book_id): category for book_id, category in self.conn.execute(
+            "SELECT id, COALESCE(NULLIF(category, ''), 'Uncategorized') FROM books")}
+
+    def records(self, table, rows):
+        return [RECORD_TYPES[table].from_dict(json.loads(data)) for (data,) in rows]
+
+def archive_month(request):
+    # Closed loans are filed under the month they were returned in
+    day = request.get('return_date') or request.get('borrow_date') or ''
+    month = str(day)[:7]
+    return month if MONTH_PATTERN.match(month) else 'undated'
+
+
+def add_user_month(index, request, month):
+    months = index.setdefault(str(request.get('user_id')), [])
+    if month not in months:
+        months.append(month)
+        months.sort()
+
+
+# The closed loans, by archive month. Months are read from storage the first
+# time a report asks for them; loans closed since the last compaction are
+# held in `pending` until compact writes them to their month.
+class RequestArchive:
+    def __init__(self, storage):
+        self.storage = storage
+        self.months = {}    # month -> {request id: request}, for the months read so far
+        self.pending = {}   # request id -> request closed since the last compaction
+
+    def add(self, request):
+        request_id = str(request.get('id'))
+        self.pending[request_id] = request
+        month = self.months.get(archive_month(request))
+        if month is not None:
+            month[request_id] = request
+
+    def take_closed(self, requests):
+        # Files the closed loans among `requests` and returns the active ones
+        active = []
+        for request in requests:
+            if request.get('status') == 'Active':
+                active.append(request)
+            else:
+                self.add(request)
+        return active
+
+    def discard(self, request_id):
+        request = self.pending.pop(request_id, None)
+        for month in self.months.values():
+            request = month.pop(request_id, None) or request
+        return request
+
+    def month_names(self):
+        names = set(self.storage.archive_months())
+        names.update(archive_month(request) for request in self.pending.values())
+        return sorted(names)
+
+    def load(self, month):
+        records = self.months.get(month)
+        if records is None:
+            records = {str(request.get('id')): request
+                       for request in self.storage.load_archive(month)}
+            for request_id, request in self.pending.items():
+                if archive_month(request) == month:
+                    records[request_id] = request
+            self.months[month] = records
+        return list(records.values())
+
+    def records(self, months=None):
+        # Closed loans of the given months (all by default), oldest month first
+        for month in (self.month_names() if months is None else months):
+            yield from self.load(month)
+
+    def user_records(self, user_id):
+        # One user's closed loans, without reading the other users' months
+        user_id = str(user_id)
+        records = {str(request.get('id')): request
+                   for request in self.storage.load_user_archive(user_id)}
+        for request_id, request in self.pending.items():
+            if str(request.get('user_id')) == user_id:
+                records[request_id] = request
+        return list(records.values())
+
+    def clear_pending(self):
+        # The pending loans are now stored in their months
+        self.pending = {}
+
+
+def open_storage(backend='json'):
+    if backend == 'json':
+        return JSONStorage()
+    if backend == 'sqlite':
+        storage = SQLiteStorage()
+        # First run on SQLite: bring over whatever the JSON files hold
+        if storage.is_empty():
+            source = JSONStorage()
+            tables = source.load()
+            if any(tables[table] for table in TABLES):
+                storage.compact(tables)
+                for table in TABLES:
+                    storage.raise_id_floor(table, source.id_floor(table))
+        return storage
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,15 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+# Each test runs in a directory of its own, as the storage works on files in
+# the current directory
+class LibraryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="library_test_")
+        previous = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.addCleanup(os.chdir, previous)
@@ -0,0 +1,94 @@
+import random
+import unittest
+from datetime import date
+from unittest import mock
+
+import library_analytics
+from library_analytics import LoanColumns, overdue_ranges
+from tests.support import LibraryTestCase
+
+
+TODAY = date(2024, 3, 31).toordinal()
+
+
+def loan(request_id, user_id, book_id, borrowed, due, returned=None, status='Active'):
+    request = {'id': request_id, 'user_id': str(user_id), 'book_id': str(book_id),
+               'borrow_date': borrowed, 'due_date': due, 'status': status}
+    if returned:
+        request['return_date'] = returned
+    return request
+
+
+def reports(columns):
+    return (columns.overdue_by_days(TODAY),
+            columns.fines_owed(TODAY, 1.0),
+            columns.loans_by_category_month({'1': 'Fiction', '2': 'Science'}),
+            columns.average_loan_days())
+
+
+class LoanColumnsTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.columns = LoanColumns()
+        self.columns.build([
+            loan(1, 1, 1, '2024-03-01', '2024-03-15'),
+            loan(2, 2, 2, '2024-02-20', '2024-03-05'),
+            loan(3, 1, 3, '2024-01-10', '2024-01-24', '2024-01-20', 'Returned'),
+            loan(4, 2, 1, '2024-03-20', '2024-03-31'),
+            loan(5, 3, 2, '2024-02-01', 'unknown')
+        ])
+
+    def test_python_reports(self):
+        with mock.patch.object(library_analytics, 'np', None):
+            by_days, fines, by_month, average = reports(self.columns)
+        self.assertEqual(by_days, {0: 1, 16: 1, 26: 1})
+        self.assertEqual(fines, {'1': 16.0, '2': 26.0})
+        self.assertEqual(by_month, {('Fiction', '2024-03'): 2, ('Science', '2024-02'): 2,
+                                    ('Unknown', '2024-01'): 1})
+        self.assertEqual(average, 10.0)
+        self.assertEqual(overdue_ranges(by_days)['15-30 days'], 2)
+
+    def test_rows_are_updated_in_place(self):
+        self.columns.put(loan(1, 1, 1, '2024-03-01', '2024-03-15', '2024-03-25', 'Returned'))
+        self.columns.discard(2)
+        with mock.patch.object(library_analytics, 'np', None):
+            by_days, fines, by_month, average = reports(self.columns)
+        self.assertEqual(by_days, {0: 1})
+        self.assertEqual(fines, {})
+        self.assertEqual(len(self.columns), 4)
+        self.assertEqual(average, 17.0)
+
+    @unittest.skipIf(library_analytics.np is None, "NumPy is not installed")
+    def test_numpy_matches_python(self):
+        rng = random.Random(7)
+        columns = LoanColumns()
+        for request_id in range(1, 2001):
+            borrowed = TODAY - rng.randrange(400)
+            due = borrowed + 14
+            if rng.random() < 0.6 and due < TODAY:
+                request = loan(request_id, rng.randrange(50), rng.randrange(1, 4),
+                               date.fromordinal(borrowed).isoformat(),
+                               date.fromordinal(due).isoformat(),
+                               date.fromordinal(borrowed + rng.randrange(30)).isoformat(),
+                               'Returned')
+            else:
+                request = loan(request_id, rng.randrange(50), rng.randrange(1, 4),
+                               date.fromordinal(borrowed).isoformat(),
+                               date.fromordinal(due).isoformat())
+            columns.put(request)
+        for request_id in range(1, 2001, 97):
+            columns.discard(request_id)
+
+        with_numpy = reports(columns)
+        with mock.patch.object(library_analytics, 'np', None):
+            without = reports(columns)
+        self.assertEqual(with_numpy[0], without[0])
+        self.assertEqual(with_numpy[2], without[2])
+        self.assertEqual(with_numpy[1].keys(), without[1].keys())
+        for user_id, fine in without[1].items():
+            self.assertAlmostEqual(with_numpy[1][user_id], fine)
+        self.assertAlmostEqual(with_numpy[3], without[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
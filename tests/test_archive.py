@@ -0,0 +1,131 @@
+import json
+import os
+import unittest
+from datetime import date
+
+from library_service import LibraryService
+from tests.support import LibraryTestCase
+
+
+def closed_loan(request_id, book_id, return_date):
+    return {'id': request_id, 'user_id': '1', 'book_id': str(book_id),
+            'borrow_date': '2023-12-20', 'due_date': '2024-01-03',
+            'status': 'Returned', 'renewals': 0, 'return_date': return_date}
+
+
+class ArchiveTest(LibraryTestCase):
+    backend = 'json'
+
+    def setUp(self):
+        # An old requests.json that still holds returned loans next to an active one
+        super().setUp()
+        with open('users.json', 'w') as f:
+            json.dump([{'id': 1, 'name': "Ada", 'active_borrowings': 1}], f)
+        with open('books.json', 'w') as f:
+            json.dump([{'id': number, 'title': f"Book {number}",
+                        'status': 'Borrowed' if number == 4 else 'Available'}
+                       for number in range(1, 5)], f)
+        active = {'id': 4, 'user_id': '1', 'book_id': '4', 'borrow_date': '2024-02-20',
+                  'due_date': '2099-01-01', 'status': 'Active', 'renewals': 0}
+        with open('requests.json', 'w') as f:
+            json.dump([closed_loan(1, 1, '2024-01-02'), closed_loan(2, 2, '2024-02-10'),
+                       closed_loan(3, 1, '2024-01-28'), active], f)
+        LibraryService().compact_data()
+
+    def session(self):
+        library = LibraryService(backend=self.backend)
+        self.addCleanup(library.close)
+        return library
+
+    def test_only_active_loans_are_loaded(self):
+        library = self.session()
+        self.assertEqual([request['id'] for request in library.requests], [4])
+        self.assertEqual([request['id'] for request in library.all_requests()], [1, 2, 3, 4])
+        self.assertEqual(library.archive.month_names(), ['2024-01', '2024-02'])
+        self.assertEqual(sorted(request['id'] for request in library.archive.records(['2024-01'])),
+                         [1, 3])
+
+    def test_returned_loans_are_archived_and_ids_never_reused(self):
+        library = self.session()
+        library.return_book(4)
+        self.assertEqual(library.requests, [])
+        library.compact_data()
+
+        reopened = self.session()
+        self.assertEqual(reopened.requests, [])
+        self.assertEqual(len(reopened.all_requests()), 4)
+        self.assertEqual(reopened.borrow(1, 1)['id'], 5)
+        self.assertEqual([(book['id'], count) for book, count in reopened.most_popular(1)],
+                         [(1, 3)])
+
+    def test_history_reads_only_that_users_loans(self):
+        library = self.session()
+        library.add_user("Brian")
+        library.borrow(2, 2)
+        history = library.user_history(1)
+        self.assertEqual(sorted(request['id'] for request in history['past_loans']), [1, 2, 3])
+        self.assertEqual([request['id'] for request in history['active_loans']], [4])
+        self.assertEqual(library.archive.months, {})  # no month was read whole
+
+        library.return_book(4)
+        library.return_book(5)
+        self.assertEqual(sorted(request['id'] for request in library.user_history(1)['past_loans']),
+                         [1, 2, 3, 4])
+        library.compact_data()
+        self.assertEqual([request['id'] for request in self.session().user_history(2)['past_loans']],
+                         [5])
+
+    def test_json_archive_is_split_by_month(self):
+        self.assertEqual(sorted(os.listdir('archive')),
+                         ['requests_2024-01.jsonl', 'requests_2024-02.jsonl'])
+        with open('requests.json') as f:
+            self.assertEqual([request['id'] for request in json.load(f)], [4])
+
+    def test_user_months_index_is_rebuilt_when_missing(self):
+        with open('library_user_months.json') as f:
+            self.assertEqual(json.load(f), {'1': ['2024-01', '2024-02']})
+        os.remove('library_user_months.json')
+        history = self.session().user_history(1)
+        self.assertEqual(sorted(request['id'] for request in history['past_loans']), [1, 2, 3])
+        self.assertTrue(os.path.exists('library_user_months.json'))
+
+
+class SQLiteArchiveTest(ArchiveTest):
+    backend = 'sqlite'
+
+    def test_json_archive_is_split_by_month(self):
+        # SQLite keeps the closed loans in the requests table
+        library = self.session()
+        self.assertEqual(library.storage.archive_months(), ['2024-01', '2024-02'])
+        self.assertEqual([request['id'] for request in library.storage.load_archive('2024-02')],
+                         [2])
+
+    def test_user_months_index_is_rebuilt_when_missing(self):
+        # SQLite finds a user's closed loans through the user_id index instead
+        plan = self.session().storage.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT data FROM requests WHERE user_id = ? "
+            "AND month IS NOT NULL ORDER BY id", ('1',)).fetchall()
+        self.assertIn('idx_requests_user', str(plan))
+
+    def test_archive_is_read_by_its_month_index(self):
+        library = self.session()
+        library.return_book(4)
+        storage = library.storage
+        self.assertEqual(storage.archive_months()[-1], date.today().strftime('%Y-%m'))
+        plan = storage.conn.execute("EXPLAIN QUERY PLAN SELECT data FROM requests "
+                                    "WHERE month = ? ORDER BY id", ('2024-01',)).fetchall()
+        self.assertIn('idx_requests_month', str(plan))
+
+    def test_month_is_filled_in_for_older_databases(self):
+        storage = self.session().storage
+        storage.conn.execute("DROP INDEX idx_requests_month")
+        storage.conn.execute("ALTER TABLE requests DROP COLUMN month")
+
+        library = self.session()
+        self.assertEqual(library.storage.archive_months(), ['2024-01', '2024-02'])
+        self.assertEqual([request['id'] for request in library.storage.load_archive('2024-01')],
+                         [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from unittest import mock
+
+from library_service import LibraryService
+from tests.support import LibraryTestCase
+
+
+class BatchTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.library = LibraryService()
+        for title in ("Dune", "Emma", "Ulysses"):
+            self.library.add_book(title, "Author", category="Fiction")
+        self.library.add_user("Ada", "ada@example.com")
+        self.library.add_user("Brian", "brian@example.com")
+
+    def test_batch_borrow_reports_each_failure_and_saves_once(self):
+        with mock.patch.object(self.library.storage, 'write',
+                               wraps=self.library.storage.write) as write:
+            results = self.library.batch_borrow([(1, 1), (2, 1), (9, 2), (2, 3), (1, 7)])
+        self.assertEqual(write.call_count, 1)
+
+        self.assertEqual([result['ok'] for result in results], [True, False, False, True, False])
+        self.assertEqual(results[1]['error'], "Book is not available. Status: Borrowed")
+        self.assertEqual(results[2]['error'], "User not found!")
+        self.assertEqual(results[4]['error'], "Book not found!")
+
+        reopened = LibraryService()
+        self.assertEqual(len(reopened.requests), 2)
+        self.assertEqual([book['status'] for book in reopened.books],
+                         ['Borrowed', 'Available', 'Borrowed'])
+        self.assertEqual(reopened.get_user_by_id(2)['active_borrowings'], 1)
+
+    def test_batch_return_skips_unknown_and_closed_loans(self):
+        self.library.batch_borrow([(1, 1), (1, 2)])
+        results = self.library.batch_return([1, 1, 5, 2])
+        self.assertEqual([result['ok'] for result in results], [True, False, False, True])
+        self.assertEqual(results[1]['error'], "Active request not found!")
+        self.assertEqual(results[0]['fine'], 0.0)
+
+        reopened = LibraryService()
+        self.assertEqual([request['status'] for request in reopened.all_requests()],
+                         ['Returned', 'Returned'])
+        self.assertEqual(reopened.get_user_by_id(1)['active_borrowings'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
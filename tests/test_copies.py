@@ -0,0 +1,68 @@
+import unittest
+
+from library_index import CopyPool
+from library_service import LendingError, LibraryService
+from tests.support import LibraryTestCase
+
+
+class CopyPoolTest(LibraryTestCase):
+    def test_claim_and_release(self):
+        pool = CopyPool()
+        pool.build([
+            {'id': 1, 'status': 'Borrowed'},
+            {'id': 2, 'copies': [{'barcode': '2-1', 'status': 'Borrowed'},
+                                 {'barcode': '2-2', 'status': 'Available'}]}
+        ])
+        self.assertEqual((pool.available(1), pool.total(1)), (0, 1))
+        self.assertIsNone(pool.claim(1))
+        self.assertEqual(pool.claim(2), '2-2')
+        self.assertIsNone(pool.claim(2))
+        pool.release(2, '2-1')
+        pool.release(2, '2-1')
+        self.assertEqual((pool.available(2), pool.total(2)), (1, 2))
+
+
+class CopiesTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.library = LibraryService()
+        for name in ("Ada", "Brian", "Cleo", "Dan"):
+            self.library.add_user(name)
+        self.library.add_book("Dune", "Frank Herbert")
+        self.library.add_copies(1, 2)
+
+    def test_each_borrow_takes_its_own_copy(self):
+        barcodes = {self.library.borrow(user_id, 1)['barcode'] for user_id in (1, 2)}
+        self.assertEqual(len(barcodes), 2)
+        self.assertEqual(self.library.get_book_by_id(1)['status'], 'Available')
+
+        last = self.library.borrow(3, 1)
+        self.assertEqual(self.library.get_book_by_id(1)['status'], 'Borrowed')
+        with self.assertRaises(LendingError):
+            self.library.borrow(4, 1)
+        with self.assertRaises(LendingError):
+            self.library.delete_book(1)
+
+        self.library.return_book(last['id'])
+        availability = LibraryService().check_availability(1)
+        self.assertEqual((availability['available'], availability['total']), (1, 3))
+        self.assertEqual(len(availability['loans']), 2)
+        self.assertEqual(LibraryService().borrow(4, 1)['barcode'], last['barcode'])
+
+    def test_single_copy_books_keep_working(self):
+        self.library.add_book("Emma", "Jane Austen")
+        loan = self.library.borrow(1, 2)
+        self.assertEqual(loan['barcode'], '2-1')
+        self.assertNotIn('copies', self.library.get_book_by_id(2))
+        self.library.return_book(loan['id'])
+        self.assertEqual(LibraryService().check_availability(2)['available'], 1)
+
+    def test_copies_must_be_positive(self):
+        with self.assertRaises(LendingError):
+            self.library.add_copies(1, 0)
+        with self.assertRaises(LendingError):
+            self.library.add_copies(9, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import csv
+import gzip
+import unittest
+
+from library_export import export_table, export_tables
+from tests.support import LibraryTestCase
+
+
+BOOKS = [
+    {'id': 1, 'title': 'Dune, Deluxe Edition', 'author': 'Frank "F." Herbert',
+     'isbn': '978-0441013593', 'category': 'Fiction', 'year': '1965',
+     'status': 'Available', 'date_added': '2024-01-01',
+     'last_modified': '2024-01-01 10:00:00'},
+    {'id': 2, 'title': 'Notes\nand Queries', 'author': 'Various',
+     'status': 'Borrowed', 'last_modified': '2024-02-01 10:00:00'}
+]
+
+
+def read_csv(filename, opener=open):
+    with opener(filename, 'rt', newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))
+
+
+class ExportTest(LibraryTestCase):
+    def test_commas_quotes_and_newlines_round_trip(self):
+        self.assertEqual(export_table('books', BOOKS, 'books.csv'), 2)
+        rows = read_csv('books.csv')
+        self.assertEqual(rows[0][:3], ['ID', 'Title', 'Author'])
+        self.assertEqual(rows[1][1:3], ['Dune, Deluxe Edition', 'Frank "F." Herbert'])
+        self.assertEqual(rows[2][1], 'Notes\nand Queries')
+        self.assertEqual(rows[2][3], '')  # missing fields export empty
+        self.assertEqual(len(rows), 3)
+
+    def test_incremental_export_skips_unchanged_rows(self):
+        export_table('books', BOOKS, 'books.csv', since='2024-01-15 00:00:00')
+        self.assertEqual([row[0] for row in read_csv('books.csv')], ['ID', '2'])
+
+    def test_compressed_exports_of_every_table(self):
+        tables = {'books': BOOKS, 'users': [{'id': 1, 'name': 'Ada, Countess'}], 'requests': []}
+        results = export_tables(tables, 'test', compress=True)
+        self.assertEqual(results['users'], ('users_export_test.csv.gz', 1))
+        self.assertEqual(read_csv('users_export_test.csv.gz', gzip.open)[1][1], 'Ada, Countess')
+        self.assertEqual(results['requests'][1], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import unittest
+
+from library_service import LendingError, LibraryService
+from tests.support import LibraryTestCase
+
+
+class HoldQueueTest(LibraryTestCase):
+    def setUp(self):
+        # Book 1 is out with reader 1
+        super().setUp()
+        self.library = LibraryService()
+        for name in ('One', 'Two', 'Three', 'Four'):
+            self.library.add_user(name)
+        self.library.add_book("Held", "Author")
+        self.loan = self.library.borrow(1, 1)
+
+    def test_returned_copy_goes_to_the_oldest_hold(self):
+        self.library.place_hold(2, 1)
+        self.library.place_hold(3, 1)
+        with self.assertRaises(LendingError):
+            self.library.renew(self.loan['id'])
+
+        result = self.library.return_book(self.loan['id'])
+        self.assertEqual(result['hold']['user_id'], '2')
+        self.assertEqual(result['hold']['status'], 'Ready')
+        with self.assertRaises(LendingError):
+            self.library.borrow(3, 1)
+
+        second = LibraryService().borrow(2, 1)
+        library = LibraryService()
+        self.assertEqual([hold['user_id'] for hold in library.book_holds(1)], ['3'])
+        self.assertEqual(library.return_book(second['id'])['hold']['user_id'], '3')
+
+    def test_hold_rules(self):
+        self.library.add_book("Free", "Author")
+        for user_id, book_id in ((2, 2), (1, 1), (9, 1), (2, 9)):
+            with self.assertRaises(LendingError):
+                self.library.place_hold(user_id, book_id)
+        self.library.place_hold(2, 1)
+        with self.assertRaises(LendingError):
+            self.library.place_hold(2, 1)
+        with self.assertRaises(LendingError):
+            self.library.delete_book(1)
+
+    def test_cancelled_ready_hold_passes_the_copy_on(self):
+        first = self.library.place_hold(2, 1)
+        self.library.place_hold(3, 1)
+        self.library.return_book(self.loan['id'])
+        self.library.cancel_hold(first['id'])
+
+        library = LibraryService()
+        ready = library.book_holds(1)[0]
+        self.assertEqual((ready['user_id'], ready['status']), ('3', 'Ready'))
+        library.borrow(3, 1)
+        self.assertEqual(LibraryService().book_holds(1), [])
+
+
+class ExpiredHoldTest(LibraryTestCase):
+    def setUp(self):
+        # Reader 2's hold on book 1 is ready, but its pickup date has passed;
+        # book 2 is out with reader 1
+        super().setUp()
+        library = LibraryService()
+        for name in ('One', 'Two', 'Three'):
+            library.add_user(name)
+        library.add_book("Held", "Author")
+        library.add_book("Out", "Author")
+        loan = library.borrow(1, 1)
+        library.place_hold(2, 1)
+        library.return_book(loan['id'])
+        library.borrow(1, 2)
+        library.close()
+
+        with open('holds.json') as f:
+            holds = json.load(f)
+        holds[0]['pickup_by'] = '2000-01-01'
+        with open('holds.json', 'w') as f:
+            json.dump(holds, f)
+
+    def test_refused_borrow_leaves_nothing_to_save(self):
+        library = LibraryService()
+        with self.assertRaises(LendingError):
+            library.borrow(3, 2)  # expires the hold, then finds book 2 is out
+        self.assertEqual(library.pending_changes, [])
+
+        # An unrelated change must not carry the expiry along with it
+        library.add_user('Four')
+        hold = LibraryService().hold_index.get('1')
+        self.assertIsNotNone(hold)
+        self.assertEqual(hold['status'], 'Ready')
+
+    def test_expiry_is_saved_with_the_next_borrow(self):
+        library = LibraryService()
+        with self.assertRaises(LendingError):
+            library.borrow(3, 2)
+        library.borrow(3, 1)
+
+        fresh = LibraryService()
+        self.assertIsNone(fresh.hold_index.get('1'))
+        self.assertEqual(fresh.get_book_by_id(1)['status'], 'Borrowed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from library_service import LibraryService
+from tests.support import LibraryTestCase
+
+
+class BulkImportTest(LibraryTestCase):
+    def test_imported_books_are_on_the_shelf(self):
+        with open('books.csv', 'w') as f:
+            f.write("Title,Author,Status\n"
+                    "Dune,Frank Herbert,Borrowed\n"
+                    "Emma,Jane Austen,\n"
+                    "Ulysses,James Joyce,Lost\n"
+                    ",Nobody,Available\n")
+        library = LibraryService()
+        added, errors = library.bulk_import('books', 'books.csv')
+        self.assertEqual(added, 2)
+        self.assertEqual(errors, [(4, "invalid status 'Lost'"), (5, "missing title")])
+
+        reopened = LibraryService()
+        self.assertEqual([book['status'] for book in reopened.books], ['Available', 'Available'])
+        user = reopened.add_user('Ada')
+        reopened.borrow(user['id'], 1)
+        self.assertEqual(reopened.statistics()['borrowed_books'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
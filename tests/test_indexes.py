@@ -0,0 +1,79 @@
+import unittest
+from datetime import date, timedelta
+
+from library_index import DueDateIndex, PopularityIndex
+from tests.support import LibraryTestCase
+
+
+def loan(request_id, due_date, status='Active'):
+    return {'id': request_id, 'user_id': '1', 'book_id': str(request_id),
+            'due_date': due_date, 'status': status}
+
+
+class DueDateIndexTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = DueDateIndex()
+        self.index.build([
+            loan(1, '2024-03-10'),
+            loan(2, '2024-03-01'),
+            loan(3, '2024-02-01', status='Returned'),
+            loan(4, '2024-03-05')
+        ])
+        self.day = date(2024, 3, 6).toordinal()
+
+    def test_only_active_loans_due_before_the_day(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual([request_id for due, request_id in self.index.due_before(self.day)],
+                         ['2', '4'])
+
+    def test_renewal_and_return_move_the_loan(self):
+        self.index.remove(loan(2, '2024-03-01'))
+        self.index.add(loan(2, '2024-03-08'))
+        self.index.remove(loan(4, '2024-03-05'))
+        self.index.add(loan(4, '2024-03-05', status='Returned'))
+        self.assertEqual(self.index.due_before(self.day), [])
+        self.assertEqual([request_id for due, request_id in self.index.due_before(self.day + 3)],
+                         ['2'])
+
+
+def borrowed(request_id, book_id, days_ago):
+    borrow_date = date.today() - timedelta(days=days_ago)
+    return {'id': request_id, 'user_id': '1', 'book_id': str(book_id),
+            'borrow_date': borrow_date.isoformat(), 'status': 'Returned'}
+
+
+class PopularityIndexTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = PopularityIndex()
+        self.index.build([
+            borrowed(1, 1, 400), borrowed(2, 1, 200), borrowed(3, 1, 100),
+            borrowed(4, 2, 20), borrowed(5, 2, 10),
+            borrowed(6, 3, 2), borrowed(7, 4, 1), borrowed(8, 3, 0)
+        ])
+
+    def test_each_window_counts_only_its_days(self):
+        self.assertEqual(self.index.top(3), [('1', 3), ('2', 2), ('3', 2)])
+        self.assertEqual(self.index.top(10, days=365), [('1', 2), ('2', 2), ('3', 2), ('4', 1)])
+        self.assertEqual(self.index.top(10, days=30), [('2', 2), ('3', 2), ('4', 1)])
+        self.assertEqual(self.index.top(10, days=7), [('3', 2), ('4', 1)])
+        with self.assertRaises(ValueError):
+            self.index.top(10, days=14)
+
+    def test_removed_loans_stop_counting(self):
+        self.index.remove(borrowed(6, 3, 2))
+        self.index.remove(borrowed(8, 3, 0))
+        self.assertEqual(self.index.top(10, days=7), [('4', 1)])
+        self.assertEqual(self.index.top(2), [('1', 3), ('2', 2)])
+
+    def test_windows_move_on_as_days_pass(self):
+        # An index built five days ago still drops what has left the window since
+        index = PopularityIndex(today=date.today().toordinal() - 5)
+        index.build([borrowed(1, 1, 9), borrowed(2, 2, 7), borrowed(3, 2, 6)])
+        self.assertEqual(index.top(10, days=7), [('2', 1)])
+        self.assertEqual(index.top(10, days=30), [('2', 2), ('1', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
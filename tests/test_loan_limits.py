@@ -0,0 +1,34 @@
+import unittest
+
+from library_service import LendingError, LibraryService
+from tests.support import LibraryTestCase
+
+
+# The loan rules must hold in a fresh session too, before anything has
+# loaded the requests table
+class LoanLimitTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        library = LibraryService()
+        library.add_user('Reader', 'reader@example.com')
+        for number in range(7):
+            library.add_book(f"Book {number}", "Author")
+        for book_id in range(1, 6):
+            library.borrow(1, book_id)
+        library.close()
+
+    def test_borrow_limit_in_new_session(self):
+        library = LibraryService()
+        with self.assertRaises(LendingError):
+            library.borrow(1, 6)
+        self.assertEqual(LibraryService().get_book_by_id(6)['status'], 'Available')
+
+    def test_delete_user_with_loans_in_new_session(self):
+        library = LibraryService()
+        with self.assertRaises(LendingError):
+            library.delete_user(1)
+        self.assertIsNotNone(LibraryService().get_user_by_id(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import unittest
+
+from library_metrics import Histogram, Metrics
+from library_service import LendingError, LibraryService
+from tests.support import LibraryTestCase
+
+
+class MetricsTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.metrics = Metrics()
+        self.library = LibraryService(metrics=self.metrics)
+        self.library.add_user("Ada")
+        self.library.add_book("Dune", "Frank Herbert")
+        self.library.borrow(1, 1)
+        with self.assertRaises(LendingError):
+            self.library.borrow(1, 1)
+
+    def test_operations_are_timed_with_errors_counted(self):
+        borrow = self.metrics.to_json()['operations']['borrow']
+        self.assertEqual(borrow['count'], 2)
+        self.assertEqual(borrow['errors'], 1)
+        self.assertEqual(borrow['buckets']['+Inf'], 2)
+        self.assertGreater(self.metrics.counters['bytes_written']['save_data'], 0)
+
+    def test_prometheus_and_json_dumps(self):
+        text = self.metrics.to_prometheus()
+        self.assertIn('library_operation_seconds_count{operation="borrow"} 2', text)
+        self.assertIn('library_operation_errors_total{operation="borrow"} 1', text)
+        self.assertIn('library_operation_seconds_bucket{operation="borrow",le="+Inf"} 2', text)
+
+        self.metrics.dump('metrics.json')
+        with open('metrics.json') as f:
+            self.assertEqual(json.load(f)['operations']['borrow']['count'], 2)
+
+    def test_metrics_are_off_by_default(self):
+        library = LibraryService()
+        self.assertIsNone(library.metrics)
+        library.search("dune")
+
+    def test_histogram_quantiles_use_bucket_bounds(self):
+        histogram = Histogram()
+        for seconds in (0.0002, 0.0002, 0.0002, 0.003):
+            histogram.observe(seconds)
+        self.assertEqual(histogram.quantile(0.5), 0.00025)
+        self.assertEqual(histogram.quantile(0.99), 0.005)
+        self.assertIsNone(Histogram().quantile(0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+from library_index import Listing
+from library_service import LibraryService
+from tests.support import LibraryTestCase
+
+
+def ids(page):
+    return [record['id'] for record in page['records']]
+
+
+class PaginationTest(LibraryTestCase):
+    backend = 'json'
+
+    def setUp(self):
+        # 12 books, every third one in Science and every fourth one borrowed
+        super().setUp()
+        self.library = LibraryService(backend=self.backend)
+        self.library.add_user("Ada")
+        for number in range(1, 13):
+            category = 'Science' if number % 3 == 0 else 'Fiction'
+            self.library.add_book(f"Book {number}", "Author", category=category)
+        for book_id in (4, 8, 12):
+            self.library.borrow(1, book_id)
+
+    def test_cursors_walk_forward_and_back(self):
+        first = self.library.page('books', size=5)
+        self.assertEqual(ids(first), [1, 2, 3, 4, 5])
+        self.assertEqual((first['next'], first['prev'], first['total']), ('5', None, 12))
+
+        second = self.library.page('books', size=5, after=first['next'])
+        self.assertEqual(ids(second), [6, 7, 8, 9, 10])
+        last = self.library.page('books', size=5, after=second['next'])
+        self.assertEqual(ids(last), [11, 12])
+        self.assertIsNone(last['next'])
+
+        back = self.library.page('books', size=5, before=last['prev'])
+        self.assertEqual(ids(back), ids(second))
+        self.assertEqual(ids(self.library.page('books', size=5, before=back['prev'])), ids(first))
+
+    def test_numbered_pages(self):
+        self.assertEqual(ids(self.library.page('books', size=5, number=3)), [11, 12])
+        self.assertEqual(ids(self.library.page('books', size=5, number=0)), [1, 2, 3, 4, 5])
+        self.assertEqual(self.library.page('books', size=5, number=4)['records'], [])
+        science = self.library.page('books', size=2, number=2, category='science')
+        self.assertEqual(ids(science), [9, 12])
+        self.assertIsNone(science['total'])
+
+    def test_filters_and_changes_between_pages(self):
+        borrowed = self.library.page('books', size=2, status='Borrowed')
+        self.assertEqual(ids(borrowed), [4, 8])
+        self.assertEqual(ids(self.library.page('books', size=2, status='Borrowed',
+                                               after=borrowed['next'])), [12])
+
+        # A cursor is an id, so records added or removed before it don't shift the page
+        first = self.library.page('books', size=5)
+        self.library.delete_book(2)
+        self.library.add_book("Book 13", "Author")
+        self.assertEqual(ids(self.library.page('books', size=5, after=first['next'])),
+                         [6, 7, 8, 9, 10])
+        self.assertEqual(self.library.page('books', size=5)['total'], 12)
+
+    def test_requests_pages_include_archived_loans(self):
+        self.library.return_book(1)
+        self.library.compact_data()
+        library = LibraryService(backend=self.backend)
+        self.assertEqual(ids(library.page('requests', size=10)), [1, 2, 3])
+        self.assertEqual(ids(library.page('requests', size=10, status='Active')), [2, 3])
+
+    def test_listing_positions(self):
+        listing = Listing({str(record_id): {'id': record_id} for record_id in (3, 1, 10)})
+        self.assertEqual([record['id'] for record in listing.forward(listing.after('1'))], [3, 10])
+        self.assertEqual([record['id'] for record in listing.backward(listing.before('10'))],
+                         [3, 1])
+
+
+class SQLitePaginationTest(PaginationTest):
+    backend = 'sqlite'
+
+    def test_pages_are_read_without_loading_tables(self):
+        library = LibraryService(backend='sqlite')
+        self.addCleanup(library.close)
+        self.assertEqual(ids(library.page('books', size=2, after='3', status='borrowed')), [4, 8])
+        self.assertEqual(library.page('requests', size=5)['total'], 3)
+        self.assertEqual(library.tables, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
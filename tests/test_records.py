@@ -0,0 +1,60 @@
+import json
+import unittest
+
+from library_records import Book, Request, User, encode_record
+from library_service import LibraryService
+from tests.support import LibraryTestCase
+
+
+BOOK = {'id': 7, 'title': "Dune", 'author': "Frank Herbert", 'isbn': "978-0441013593",
+        'category': "Fiction", 'year': "1965", 'status': "Available",
+        'date_added': "2024-01-31", 'last_modified': "2024-02-01 09:30:05", 'version': 3}
+USER = {'id': 2, 'name': "Ada", 'email': "ada@example.com", 'phone': "", 'address': "",
+        'date_joined': "2024-01-02", 'active_borrowings': 1, 'total_borrowings': 4}
+REQUEST = {'id': 11, 'user_id': "2", 'book_id': "7", 'borrow_date': "2024-02-01",
+           'due_date': "2024-02-15", 'status': "Active", 'renewals': 0}
+
+
+class RecordTest(LibraryTestCase):
+    def test_records_convert_back_to_the_same_dict(self):
+        for record_type, values in ((Book, BOOK), (User, USER), (Request, REQUEST)):
+            record = record_type.from_dict(values)
+            self.assertEqual(record.to_dict(), values)
+            self.assertEqual(list(record.keys()), list(values))
+            self.assertEqual(json.dumps(record, default=encode_record), json.dumps(values))
+
+        request = Request.from_dict(REQUEST)
+        self.assertEqual(request['book_id'], "7")
+        self.assertEqual(request.ordinal('due_date'), 738931)
+
+    def test_values_that_do_not_fit_are_kept_as_they_are(self):
+        odd = dict(REQUEST, id="R-1", book_id="B-7", due_date="unknown", return_date=None,
+                   note="left at the desk")
+        record = Request.from_dict(odd)
+        self.assertEqual(record.to_dict(), odd)
+        self.assertEqual(record['book_id'], "B-7")
+        self.assertIsNone(record['return_date'])
+
+        # Fixing a value moves it back into its compact slot
+        record['book_id'] = "8"
+        self.assertEqual(record.get('book_id'), "8")
+        self.assertNotIn('book_id', record.extra)
+
+    def test_saved_files_keep_their_schema(self):
+        with open('books.json', 'w') as f:
+            json.dump([BOOK, dict(BOOK, id=8, year=1999, isbn=None)], f, indent=2)
+        with open('users.json', 'w') as f:
+            json.dump([USER], f, indent=2)
+        with open('requests.json', 'w') as f:
+            json.dump([REQUEST], f, indent=2)
+
+        library = LibraryService()
+        library.compact_data()
+        with open('books.json') as f:
+            self.assertEqual(json.load(f), [BOOK, dict(BOOK, id=8, year=1999, isbn=None)])
+        with open('requests.json') as f:
+            self.assertEqual(json.load(f), [REQUEST])
+
+
+if __name__ == '__main__':
+    unittest.main()
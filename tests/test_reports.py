@@ -0,0 +1,102 @@
+import json
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+from library_reports import format_report_pack
+from library_service import LibraryService
+from tests.support import LibraryTestCase
+
+
+def days_ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def write_library():
+    # Three readers, four books; closed loans over three months and three
+    # active loans, two of them overdue
+    loans = []
+    for number, (user_id, book_id, month) in enumerate(
+            [(1, 1, '2024-01'), (2, 1, '2024-01'), (1, 2, '2024-02'),
+             (3, 1, '2024-03'), (1, 3, '2024-03'), (2, 2, '2024-03')], 1):
+        loans.append({'id': number, 'user_id': str(user_id), 'book_id': str(book_id),
+                      'borrow_date': f"{month}-01", 'due_date': f"{month}-15",
+                      'return_date': f"{month}-10", 'status': 'Returned', 'renewals': 0})
+    for number, (user_id, book_id, due) in enumerate([(1, 1, 3), (2, 4, 3), (3, 2, -5)], 7):
+        loans.append({'id': number, 'user_id': str(user_id), 'book_id': str(book_id),
+                      'borrow_date': days_ago(20), 'due_date': days_ago(due),
+                      'status': 'Active', 'renewals': 0})
+    users = [{'id': user_id, 'name': name, 'active_borrowings': 1, 'total_borrowings': total}
+             for user_id, name, total in ((1, "Ada", 4), (2, "Brian", 3), (3, "Cleo", 2))]
+    books = [{'id': book_id, 'title': title, 'category': category,
+              'status': 'Available' if book_id == 3 else 'Borrowed'}
+             for book_id, title, category in ((1, "Dune", "Fiction"), (2, "Emma", "Fiction"),
+                                              (3, "Cosmos", "Science"), (4, "Walden", "Essays"))]
+    for name, records in (('users', users), ('books', books), ('requests', loans)):
+        with open(f"{name}.json", 'w') as f:
+            json.dump(records, f)
+
+
+class ReportPackTest(LibraryTestCase):
+    backend = 'json'
+
+    def setUp(self):
+        super().setUp()
+        write_library()
+        LibraryService().compact_data()
+        self.library = LibraryService(backend=self.backend)
+        self.addCleanup(self.library.close)
+
+    def test_pack_matches_the_separate_reports(self):
+        pack = self.library.report_pack()
+        statistics = self.library.statistics()
+        del statistics['warnings']
+        self.assertEqual(pack['statistics'], statistics)
+        self.assertEqual([(row['book_id'], row['borrowings']) for row in pack['most_popular']],
+                         [(str(book['id']), count) for book, count in self.library.most_popular()])
+        self.assertEqual(pack['user_activity'], self.library.user_activity())
+        self.assertEqual(pack['overdue'], self.library.overdue_analysis())
+        self.assertEqual(pack['overdue']['by_days'], {3: 2})
+        self.assertIn("Total Overdue Books: 2", format_report_pack(pack))
+
+    def test_sharded_pack_matches_serial(self):
+        serial = self.library.report_pack()
+        sharded = self.library.report_pack(workers=2)
+        del serial['generated'], sharded['generated']
+        self.assertEqual(sharded, serial)
+        self.assertEqual(serial['most_popular'][0],
+                         {'book_id': '1', 'title': "Dune", 'borrowings': 4})
+
+    def test_archive_is_read_outside_the_lock(self):
+        lock = self.library.storage.lock()
+        load_archive = self.library.storage.load_archive
+
+        def unlocked(month):
+            self.assertEqual(lock.depth, 0)
+            return load_archive(month)
+        with mock.patch.object(self.library.storage, 'load_archive', side_effect=unlocked) as read:
+            pack = self.library.report_pack()
+        self.assertEqual(read.call_count, 3)
+        self.assertEqual(pack['most_popular'][0]['borrowings'], 4)
+
+    def test_user_activity_has_one_source(self):
+        # Counters that have drifted from the loans are reported as stored,
+        # by the pack and by the user activity report alike
+        user = self.library.user_index['1']
+        user['total_borrowings'] = 9
+        self.library.record_change('users', user)
+        self.library.save_data()
+        library = LibraryService(backend=self.backend)
+        self.addCleanup(library.close)
+
+        pack = library.report_pack()
+        self.assertEqual(pack['user_activity'], library.user_activity())
+        self.assertEqual(pack['user_activity'][0]['total'], 9)
+
+
+class SQLiteReportPackTest(ReportPackTest):
+    backend = 'sqlite'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from library_index import SearchIndex
+from tests.support import LibraryTestCase
+
+
+BOOKS = [
+    {'id': 1, 'title': "Great Expectations", 'author': "Charles Dickens",
+     'isbn': "978-0-14-143956-3", 'category': "Fiction"},
+    {'id': 2, 'title': "The Greek Myths", 'author': "Robert Graves",
+     'isbn': "978-0-14-017199-0", 'category': "History"},
+    {'id': 3, 'title': "Gardening", 'author': "Emma Green",
+     'isbn': "978-1-40-535428-4", 'category': "Fiction"},
+    {'id': 4, 'title': "Green", 'author': "Sam Ward",
+     'isbn': "978-0-00-000000-1", 'category': "Fiction"}
+]
+
+
+class SearchIndexTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = SearchIndex()
+        self.index.build(BOOKS)
+
+    def test_every_word_must_match_as_a_prefix(self):
+        self.assertEqual(self.index.search("gre fic"), ['1', '4', '3'])
+        self.assertEqual(self.index.search("gre hist"), ['2'])
+        self.assertEqual(self.index.search("gre poetry"), [])
+
+    def test_title_and_whole_word_hits_rank_first(self):
+        # A whole-word title hit, then title prefixes, then the author
+        self.assertEqual(self.index.search("green"), ['4', '3'])
+        self.assertEqual(self.index.search("gre"), ['1', '2', '4', '3'])
+        self.assertEqual(self.index.search("gre", limit=2), ['1', '2'])
+
+    def test_isbn_matches_with_or_without_dashes(self):
+        self.assertEqual(self.index.search("9780141439563"), ['1'])
+        self.assertEqual(self.index.search("978-0-14-017199-0"), ['2'])
+
+    def test_updates_and_removals_are_reflected(self):
+        self.index.update(dict(BOOKS[0], title="Hard Times"))
+        self.index.remove(4)
+        self.assertEqual(self.index.search("gre"), ['2', '3'])
+        self.assertEqual(self.index.search("hard"), ['1'])
+        self.assertNotIn('great', self.index.terms)
+
+
+if __name__ == '__main__':
+    unittest.main()
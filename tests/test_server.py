@@ -0,0 +1,78 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from library_server import LibraryServer
+from library_service import LibraryService
+from tests.support import LibraryTestCase
+
+
+async def call(port, method, path, body=None, length=None):
+    # One request per connection; returns (status, JSON payload). `length`
+    # overrides the Content-Length header.
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = b"" if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+    length = len(data) if length is None else length
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n"
+                 f"Content-Length: {length}\r\n\r\n".encode() + data)
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+class LibraryServerTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.library = LibraryService()
+        self.library.add_user("Ada")
+        self.library.add_book("Dune", "Frank Herbert", category="Fiction")
+
+    def serve(self, *requests):
+        # Start a server on a free port, send the requests in order, stop it
+        async def run():
+            server = await LibraryServer(self.library, port=0).start()
+            try:
+                return [await call(server.port, *request) for request in requests]
+            finally:
+                await server.stop()
+        return asyncio.run(run())
+
+    def test_borrow_and_read_back(self):
+        borrowed, again, search, statistics = self.serve(
+            ('POST', '/borrow', {'user_id': 1, 'book_id': 1}),
+            ('POST', '/borrow', {'user_id': 1, 'book_id': 1}),
+            ('GET', '/search?q=dun'),
+            ('GET', '/statistics'))
+        self.assertEqual(borrowed[0], 200)
+        self.assertEqual(borrowed[1]['book_id'], '1')
+        self.assertEqual(again, (409, {'error': "Book is not available. Status: Borrowed"}))
+        self.assertEqual([book['title'] for book in search[1]['results']], ["Dune"])
+        self.assertEqual(statistics[1]['borrowed_books'], 1)
+        self.assertEqual(len(LibraryService().requests), 1)
+
+    def test_bad_requests(self):
+        responses = self.serve(('GET', '/nowhere'),
+                               ('GET', '/borrow'),
+                               ('POST', '/borrow', {'user_id': 1}),
+                               ('POST', '/return', b'{not json'),
+                               ('POST', '/renew', [1]))
+        self.assertEqual([status for status, payload in responses], [404, 405, 400, 400, 400])
+        self.assertEqual(responses[2][1], {'error': "Missing field: book_id"})
+
+    def test_bad_content_length(self):
+        responses = self.serve(('POST', '/renew', b'{}', 'two'),
+                               ('POST', '/renew', b'{}', -2))
+        self.assertEqual(responses, [(400, {'error': "Invalid Content-Length"})] * 2)
+
+    def test_unexpected_error_is_a_500(self):
+        with mock.patch.object(self.library, 'statistics', side_effect=KeyError('total')), \
+                self.assertLogs('library_server', 'ERROR'):
+            failed, search = self.serve(('GET', '/statistics'), ('GET', '/search?q=dune'))
+        self.assertEqual(failed, (500, {'error': "Internal server error"}))
+        self.assertEqual(search[0], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+from library_lender import LibraryLenderSystem
+from library_service import LendingError, LibraryService
+from tests.support import LibraryTestCase
+
+
+class LibraryServiceTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.library = LibraryService()
+        self.library.add_user("Ada", "ada@example.com")
+        self.library.add_book("Dune", "Frank Herbert", category="Fiction")
+        self.library.add_book("Emma", "Jane Austen", category="Fiction")
+
+    def test_rules_raise_lending_error(self):
+        loan = self.library.borrow(1, 1)
+        for user_id, book_id, message in ((9, 2, "User not found!"),
+                                          (1, 9, "Book not found!"),
+                                          (1, 1, "Book is not available. Status: Borrowed")):
+            with self.assertRaises(LendingError) as caught:
+                self.library.borrow(user_id, book_id)
+            self.assertEqual(str(caught.exception), message)
+
+        self.library.renew(loan['id'])
+        self.library.renew(loan['id'])
+        with self.assertRaises(LendingError):
+            self.library.renew(loan['id'])
+        with self.assertRaises(LendingError):
+            self.library.delete_book(1)
+        with self.assertRaises(LendingError):
+            self.library.delete_user(1)
+
+    def test_service_never_prompts_or_prints(self):
+        output = io.StringIO()
+        with mock.patch('builtins.input', side_effect=AssertionError("prompted")), \
+                contextlib.redirect_stdout(output):
+            loan = self.library.borrow(1, 2)
+            self.library.search("dune")
+            self.library.statistics()
+            self.library.overdue_analysis()
+            result = self.library.return_book(loan['id'])
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(result['fine'], 0.0)
+
+    def test_menu_goes_through_the_service(self):
+        menu = LibraryLenderSystem(service=self.library)
+        output = io.StringIO()
+        with mock.patch('builtins.input', side_effect=["1", "2", "1", "9"]), \
+                contextlib.redirect_stdout(output):
+            menu.borrow_book()
+            menu.borrow_book()
+        self.assertEqual(self.library.get_book_by_id(2)['status'], 'Borrowed')
+        self.assertIn("Book not found!", output.getvalue())
+        self.assertEqual(len(LibraryService().requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from library_index import LibraryStats
+from library_service import LibraryService
+from tests.support import LibraryTestCase
+
+
+class RunningTotalsTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.library = LibraryService()
+        self.library.add_book("Dune", "Frank Herbert", category="Fiction")
+        self.library.add_book("Emma", "Jane Austen", category="Fiction")
+        self.library.add_book("Cosmos", "Carl Sagan", category="Science")
+        self.library.add_user("Ada", "ada@example.com")
+        self.library.borrow(1, 1)
+        self.library.borrow(1, 3)
+        self.library.return_book(1)
+        self.library.delete_book(2)
+
+    def test_totals_follow_every_change(self):
+        self.assertEqual(self.library.stats.counts(), {
+            'total_books': 2,
+            'available_books': 1,
+            'borrowed_books': 1,
+            'active_requests': 1,
+            'categories': {'Fiction': 1, 'Science': 1}
+        })
+        self.assertEqual(self.library.check_statistics(), [])
+
+    def test_totals_match_a_fresh_count(self):
+        reopened = LibraryService()
+        expected = LibraryStats.count(reopened.books, reopened.requests)
+        self.assertEqual(reopened.stats.counts(), expected.counts())
+        self.assertEqual(reopened.stats.counts(), self.library.stats.counts())
+
+    def test_drift_is_reported_and_repaired(self):
+        self.library.stats.add_book({'status': 'Available', 'category': 'Fiction'})
+        problems = self.library.check_statistics()
+        self.assertEqual(len(problems), 3)
+        self.assertEqual(self.library.stats.counts()['total_books'], 2)
+        self.assertEqual(self.library.check_statistics(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
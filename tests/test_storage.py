@@ -0,0 +1,307 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+from library_service import LendingError, LibraryService
+from library_storage import JSONStorage, SQLiteStorage
+from tests.support import LibraryTestCase
+
+
+def snapshot(library):
+    # Every table as {id: record dict}, archived loans included
+    tables = {table: {str(record['id']): record.to_dict() for record in library.table(table)}
+              for table in ('books', 'users', 'holds')}
+    tables['requests'] = {str(request['id']): request.to_dict()
+                          for request in library.all_requests()}
+    return tables
+
+
+def sample_library(library):
+    # Two readers, three books, a returned loan, an active one and a hold
+    library.add_user('Ada', 'ada@example.com')
+    library.add_user('Brian', 'brian@example.com')
+    for title in ('Dune', 'Emma', 'Ulysses'):
+        library.add_book(title, "Author", category='Fiction')
+    loan = library.borrow(1, 1)
+    library.return_book(loan['id'])
+    library.borrow(1, 2)
+    library.place_hold(2, 2)
+
+
+class JournalTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        library = LibraryService()
+        library.add_book("Dune", "Frank Herbert", category="Fiction")
+        library.add_book("Emma", "Jane Austen", category="Fiction")
+
+    def test_saves_append_to_the_journal(self):
+        self.assertFalse(os.path.exists('books.json'))
+        with open('library_journal.jsonl') as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([entry['op'] for entry in entries], ['begin', 'put', 'commit'] * 2)
+
+        reopened = LibraryService()
+        self.assertEqual([book['title'] for book in reopened.books], ['Dune', 'Emma'])
+        self.assertEqual(reopened.get_book_by_id(2)['author'], "Jane Austen")
+
+    def test_torn_last_line_is_ignored(self):
+        with open('library_journal.jsonl', 'a') as f:
+            f.write('{"table":"books","op":"put","rec')
+        reopened = LibraryService()
+        self.assertEqual(len(reopened.books), 2)
+
+    def test_compaction_folds_the_journal_into_snapshots(self):
+        library = LibraryService()
+        library.delete_book(1)
+        library.compact_data()
+        self.assertFalse(os.path.exists('library_journal.jsonl'))
+
+        reopened = LibraryService()
+        self.assertEqual([book['title'] for book in reopened.books], ['Emma'])
+
+    def test_only_a_session_that_wrote_compacts_on_close(self):
+        reader = LibraryService()
+        self.assertEqual(len(reader.books), 2)
+        reader.close()
+        self.assertTrue(os.path.exists('library_journal.jsonl'))
+        self.assertFalse(os.path.exists('books.json'))
+
+        writer = LibraryService()
+        writer.add_user('Ada')
+        writer.close()
+        self.assertFalse(os.path.exists('library_journal.jsonl'))
+        self.assertEqual(len(LibraryService().books), 2)
+
+
+class SnapshotCacheTest(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        library = LibraryService()
+        library.add_book("Dune", "Frank Herbert")
+        library.add_user("Ada")
+        library.compact_data()
+
+    def test_tables_load_on_first_use(self):
+        library = LibraryService()
+        self.assertEqual(library.tables, {})
+        library.get_user_name(1)
+        self.assertEqual(list(library.tables), ['users'])
+
+    def test_unchanged_snapshot_is_read_from_the_cache(self):
+        self.assertTrue(os.path.exists('books.json.cache'))
+        with mock.patch('library_storage.json.load', side_effect=AssertionError("parsed JSON")):
+            storage = JSONStorage()
+            storage.open()
+            self.assertEqual([book['title'] for book in storage.load_table('books')], ["Dune"])
+
+    def test_edited_snapshot_replaces_the_cache(self):
+        with open('books.json') as f:
+            books = json.load(f)
+        books[0]['title'] = "Dune Messiah"
+        with open('books.json', 'w') as f:
+            json.dump(books, f)
+        self.assertEqual(LibraryService().get_book_title(1), "Dune Messiah")
+
+        with open('books.json.cache', 'wb') as f:
+            f.write(b"not a pickle")
+        self.assertEqual(LibraryService().get_book_title(1), "Dune Messiah")
+
+
+class SQLiteStorageTest(LibraryTestCase):
+    def test_saves_are_read_back(self):
+        library = LibraryService(backend='sqlite')
+        library.add_book("Dune", "Frank Herbert", category="Fiction")
+        library.add_user("Ada", "ada@example.com")
+        library.close()
+        self.assertFalse(os.path.exists('books.json'))
+
+        reopened = LibraryService(backend='sqlite')
+        self.assertEqual(reopened.get_book_by_id(1)['title'], "Dune")
+        self.assertEqual(reopened.get_user_by_id(1)['name'], "Ada")
+        reopened.close()
+
+    def test_group_commit_persists(self):
+        library = LibraryService(backend='sqlite')
+        library.add_user('Ada')
+        library.add_book("Dune", "Author")
+        library.add_book("Emma", "Author")
+        with library.group_commit():
+            library.borrow(1, 1)
+            with self.assertRaises(LendingError):
+                library.borrow(1, 99)
+            library.add_user('Brian')
+        library.close()
+
+        reopened = LibraryService(backend='sqlite')
+        self.assertEqual(reopened.get_book_by_id(1)['status'], 'Borrowed')
+        self.assertEqual(reopened.get_user_name(2), 'Brian')
+        self.assertEqual(len(reopened.requests), 1)
+        reopened.close()
+
+    def test_lookups_and_reports_answer_without_loading_tables(self):
+        library = LibraryService()
+        sample_library(library)
+        library.close()
+        expected = LibraryService()
+
+        library = LibraryService(backend='sqlite')  # the same data, migrated
+        self.addCleanup(library.close)
+        self.assertEqual(library.get_book_by_id(2).to_dict(), expected.get_book_by_id(2).to_dict())
+        self.assertEqual(library.get_user_name(2), 'Brian')
+        self.assertIsNone(library.get_request_by_id(1))  # returned
+        self.assertEqual(library.get_request_by_id(2)['book_id'], '2')
+        for user_id, book_id in ((9, 1), (1, 9)):
+            with self.assertRaises(LendingError):
+                library.borrow(user_id, book_id)
+        self.assertEqual(library.user_activity(), expected.user_activity())
+        analytics = library.loan_analytics()
+        self.assertEqual(library.tables, {})
+        self.assertEqual(analytics, expected.loan_analytics())
+
+    def test_changes_come_back_in_the_order_they_were_saved(self):
+        storage = SQLiteStorage()
+        self.addCleanup(storage.close)
+        storage.open()
+        storage.write([('put', 'users', {'id': 1, 'name': "Ada"})])
+        storage.write([('delete', 'users', '1')])
+        storage.write([('put', 'users', {'id': 1, 'name': "Ada again"})])
+
+        reader = SQLiteStorage()
+        self.addCleanup(reader.close)
+        reader.last_seq = 0
+        self.assertEqual([op for op, _, _ in reader.changes_since_load()], ['delete', 'put'])
+
+    def test_json_data_is_migrated_on_first_start(self):
+        library = LibraryService()
+        sample_library(library)
+        library.close()
+        expected = snapshot(LibraryService())
+        self.assertTrue(JSONStorage().archive_months())  # the returned loan is archived
+
+        migrated = LibraryService(backend='sqlite')
+        self.assertEqual(snapshot(migrated), expected)
+        migrated.close()
+
+
+class JournalRecoveryTest(LibraryTestCase):
+    def test_truncated_transaction_rolls_back(self):
+        library = LibraryService()
+        library.add_user('Ada')
+        library.add_book("Dune", "Author")
+        before = snapshot(LibraryService())
+
+        # A borrow cut short: the book is written, the loan and commit are not
+        with open('library_journal.jsonl', 'ab') as f:
+            f.write(b'{"op":"begin"}\n'
+                    b'{"table":"books","op":"put","record":{"id":1,"title":"Dune",'
+                    b'"author":"Author","status":"Borrowed"}}\n'
+                    b'{"table":"requests","op":"put","rec')
+
+        recovered = LibraryService()
+        self.assertEqual(snapshot(recovered), before)
+
+        # The torn tail is gone, so the next save is read back normally
+        recovered.borrow(1, 1)
+        book = LibraryService().get_book_by_id(1)
+        self.assertEqual(book['status'], 'Borrowed')
+        self.assertEqual(len(LibraryService().requests), 1)
+
+    def test_journal_without_transactions_still_replays(self):
+        LibraryService().add_user('Ada')
+        with open('library_journal.jsonl', 'ab') as f:
+            f.write(b'{"table":"users","op":"put","record":{"id":2,"name":"Brian"}}\n')
+        self.assertEqual(LibraryService().get_user_name(2), 'Brian')
+
+
+class ConcurrentSessionTest(LibraryTestCase):
+    backend = 'json'
+
+    def setUp(self):
+        super().setUp()
+        library = LibraryService(backend=self.backend)
+        library.add_user('Ada')
+        library.add_user('Brian')
+        library.add_book("Dune", "Author")
+        library.add_book("Emma", "Author")
+        library.close()
+
+    def session(self):
+        library = LibraryService(backend=self.backend)
+        self.addCleanup(library.close)
+        return library
+
+    def test_stale_status_is_refused(self):
+        first, second = self.session(), self.session()
+        self.assertEqual(second.get_book_by_id(1)['status'], 'Available')
+        first.borrow(1, 1)
+        with self.assertRaises(LendingError):
+            second.borrow(2, 1)
+        self.assertEqual(len(self.session().requests), 1)
+
+    def test_stale_version_is_refused(self):
+        first, second = self.session(), self.session()
+        version = second.get_book_by_id(1)['version']
+        loan = first.borrow(1, 1)
+        first.return_book(loan['id'])
+        with self.assertRaises(LendingError):
+            second.borrow(2, 1, expected_version=version)
+        self.assertEqual(self.session().get_book_by_id(1)['status'], 'Available')
+
+    def test_refresh_picks_up_other_sessions(self):
+        first, second = self.session(), self.session()
+        second.borrow(1, 1)
+        second.delete_book(2)
+        second.add_user('Cleo')
+
+        first.refresh()
+        self.assertEqual(snapshot(first), snapshot(self.session()))
+        self.assertEqual(first.search("emma"), [])
+        self.assertEqual(first.statistics()['borrowed_books'], 1)
+
+        # New records carry on from the other session's ids
+        self.assertEqual(first.add_user('Dan')['id'], 4)
+
+    def test_refresh_after_compaction_elsewhere(self):
+        first, second = self.session(), self.session()
+        second.borrow(1, 1)
+        second.add_book("Ulysses", "Author")
+        second.compact_data()
+
+        first.refresh()
+        self.assertEqual(snapshot(first), snapshot(self.session()))
+        self.assertEqual(first.get_book_by_id(1)['status'], 'Borrowed')
+
+        # And it carries on writing on top of the new snapshots
+        first.add_book("Walden", "Author")
+        self.assertEqual(len(self.session().books), 4)
+
+    def test_delete_before_compaction_elsewhere(self):
+        first, second = self.session(), self.session()
+        self.assertEqual(len(first.books), 2)
+        second.delete_book(2)
+        second.compact_data()
+
+        first.refresh()
+        self.assertEqual(snapshot(first), snapshot(self.session()))
+        self.assertEqual([book['title'] for book in first.books], ['Dune'])
+
+
+class SQLiteConcurrentSessionTest(ConcurrentSessionTest):
+    backend = 'sqlite'
+
+    def test_deleted_ids_are_not_reused(self):
+        first = self.session()
+        first.books  # loaded before the other sessions change anything
+        self.session().delete_book(2)
+        replacement = self.session().add_book("Replacement", "Author")
+        self.assertEqual(replacement['id'], 3)
+
+        first.refresh()
+        self.assertEqual(snapshot(first), snapshot(self.session()))
+        self.assertEqual([book['title'] for book in first.books], ['Dune', 'Replacement'])
+
+
+if __name__ == '__main__':
+    unittest.main()